@@ -1,12 +1,23 @@
+from datetime import timedelta
+
 from django.contrib import admin
+from django.template.response import TemplateResponse
+from django.urls import path
 from django.utils.html import format_html
 from django.db.models import Sum, Count
 from django.utils import timezone
 from .models import (
     Category, SubCategory, FoodItem, MealPeriod, DailyMenu,
     DailyMenuItem, StudentProfile, Order, OrderItem, MPesaTransaction,
-    OrderReceipt, MessStaff, SystemSettings
+    OrderReceipt, OrderEvent, OutboxEmail, MessStaff, SystemSettings, ArchivedOrder,
+    MenuTemplate, MenuTemplateItem, DailySalesRollup, MealCloseSnapshot
 )
+from .analytics import close_meals, waste_analytics
+from .menu_builder import apply_templates, clone_menu, date_range
+from .onboarding import ADMIN_IMPORT_WORKERS, import_students, read_student_csv
+from .pagination import ApproximateCountPaginator
+from .rollups import REPORT_PERIODS, period_range
+from .tracing import meal_period_window, phase_summary
 
 
 @admin.register(Category)
@@ -17,9 +28,13 @@ class CategoryAdmin(admin.ModelAdmin):
     prepopulated_fields = {'slug': ('name',)}
     list_editable = ['is_active', 'display_order']
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(_subcategory_count=Count('subcategories'))
+    
     def subcategory_count(self, obj):
-        return obj.subcategories.count()
+        return obj._subcategory_count
     subcategory_count.short_description = 'Subcategories'
+    subcategory_count.admin_order_field = '_subcategory_count'
 
 
 @admin.register(SubCategory)
@@ -29,6 +44,7 @@ class SubCategoryAdmin(admin.ModelAdmin):
     search_fields = ['name', 'category__name', 'description']
     prepopulated_fields = {'slug': ('name',)}
     list_editable = ['is_active', 'display_order']
+    list_select_related = ['category']
 
 
 @admin.register(FoodItem)
@@ -38,6 +54,7 @@ class FoodItemAdmin(admin.ModelAdmin):
     search_fields = ['name', 'description', 'category__name']
     prepopulated_fields = {'slug': ('name',)}
     list_editable = ['is_active', 'is_available', 'price_per_plate', 'display_order']
+    list_select_related = ['category', 'subcategory__category']
     readonly_fields = ['created_at', 'updated_at']
     
     fieldsets = (
@@ -86,21 +103,84 @@ class DailyMenuAdmin(admin.ModelAdmin):
     search_fields = ['notes']
     prepopulated_fields = {'slug': ('date', 'meal_period')}
     inlines = [DailyMenuItemInline]
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['created_at', 'updated_at', 'closed_at']
+    list_select_related = ['meal_period', 'created_by']
+    actions = ['clone_to_next_week', 'close_meal']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            _total_items=Count('menu_items'),
+            _total_plates=Sum('menu_items__total_plates_available'),
+        )
     
     def total_items(self, obj):
-        return obj.menu_items.count()
+        return obj._total_items
     total_items.short_description = 'Items'
+    total_items.admin_order_field = '_total_items'
     
     def total_plates(self, obj):
-        total = obj.menu_items.aggregate(Sum('total_plates_available'))['total_plates_available__sum']
-        return total or 0
+        return obj._total_plates or 0
     total_plates.short_description = 'Total Plates'
+    total_plates.admin_order_field = '_total_plates'
     
     def save_model(self, request, obj, form, change):
         if not obj.created_by:
             obj.created_by = request.user
         super().save_model(request, obj, form, change)
+    
+    def clone_to_next_week(self, request, queryset):
+        created = 0
+        for menu in queryset.select_related('meal_period'):
+            dates = date_range(menu.date + timedelta(days=1), 7)
+            created += len(clone_menu(menu, dates, created_by=request.user))
+        self.message_user(request, f"{created} menus created.")
+    clone_to_next_week.short_description = 'Clone to the following 7 days'
+    
+    def close_meal(self, request, queryset):
+        closed = close_meals(queryset)
+        self.message_user(request, f"{closed} menus closed and snapshotted.")
+    close_meal.short_description = 'Close meal (snapshot leftovers)'
+
+
+class MenuTemplateItemInline(admin.TabularInline):
+    model = MenuTemplateItem
+    extra = 1
+    fields = ['food_item', 'sufuria_count', 'plates_per_sufuria']
+
+
+@admin.register(MenuTemplate)
+class MenuTemplateAdmin(admin.ModelAdmin):
+    list_display = ['name', 'meal_period', 'weekday', 'is_active', 'item_count']
+    list_filter = ['meal_period', 'weekday', 'is_active']
+    search_fields = ['name', 'notes']
+    prepopulated_fields = {'slug': ('name',)}
+    list_select_related = ['meal_period']
+    inlines = [MenuTemplateItemInline]
+    actions = ['schedule_next_week', 'schedule_next_month']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(_item_count=Count('items'))
+    
+    def item_count(self, obj):
+        return obj._item_count
+    item_count.short_description = 'Items'
+    item_count.admin_order_field = '_item_count'
+    
+    def _schedule(self, request, queryset, days):
+        meal_periods = list(MealPeriod.objects.filter(
+            id__in=queryset.values('meal_period')
+        ))
+        dates = date_range(timezone.now().date() + timedelta(days=1), days)
+        menus = apply_templates(dates, meal_periods, templates=queryset, created_by=request.user)
+        self.message_user(request, f"{len(menus)} menus scheduled.")
+    
+    def schedule_next_week(self, request, queryset):
+        self._schedule(request, queryset, 7)
+    schedule_next_week.short_description = 'Schedule menus for the next 7 days'
+    
+    def schedule_next_month(self, request, queryset):
+        self._schedule(request, queryset, 30)
+    schedule_next_month.short_description = 'Schedule menus for the next 30 days'
 
 
 @admin.register(DailyMenuItem)
@@ -110,6 +190,7 @@ class DailyMenuItemAdmin(admin.ModelAdmin):
     list_filter = ['daily_menu__date', 'daily_menu__meal_period', 'is_available', 'food_item__category']
     search_fields = ['food_item__name', 'daily_menu__date']
     readonly_fields = ['total_plates_available', 'plates_remaining', 'created_at', 'updated_at']
+    list_select_related = ['daily_menu__meal_period', 'food_item']
     
     def get_readonly_fields(self, request, obj=None):
         if obj:  # Editing
@@ -124,10 +205,44 @@ class StudentProfileAdmin(admin.ModelAdmin):
     search_fields = ['registration_number', 'user__username', 'user__email', 'user__first_name', 'user__last_name', 'phone_number']
     prepopulated_fields = {'slug': ('registration_number',)}
     readonly_fields = ['created_at', 'updated_at']
+    list_select_related = ['user']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(_order_count=Count('orders'))
+    
+    def get_urls(self):
+        urls = [
+            path('import/', self.admin_site.admin_view(self.import_view), name='ecommerce_studentprofile_import'),
+        ]
+        return urls + super().get_urls()
+    
+    def import_view(self, request):
+        if not self.has_add_permission(request):
+            return self.admin_site.login(request)
+        
+        result = None
+        if request.method == 'POST' and request.FILES.get('csv_file'):
+            rows = read_student_csv(request.FILES['csv_file'].file)
+            result = import_students(
+                rows,
+                send_welcome=bool(request.POST.get('send_welcome')),
+                workers=ADMIN_IMPORT_WORKERS,
+                site_url=request.build_absolute_uri('/'),
+            )
+            self.message_user(request, f"{result.created} students imported.")
+        
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Import students',
+            'result': result,
+        }
+        return TemplateResponse(request, 'admin/ecommerce/studentprofile/import.html', context)
     
     def order_count(self, obj):
-        return obj.orders.count()
+        return obj._order_count
     order_count.short_description = 'Orders'
+    order_count.admin_order_field = '_order_count'
 
 
 class OrderItemInline(admin.TabularInline):
@@ -147,6 +262,11 @@ class OrderAdmin(admin.ModelAdmin):
     readonly_fields = ['order_code', 'slug', 'ordered_at', 'confirmed_at', 'served_at', 
                       'payment_date', 'expires_at', 'created_at', 'updated_at']
     inlines = [OrderItemInline]
+    list_select_related = ['student_profile', 'daily_menu__meal_period']
+    # The order table is large: estimate the total instead of COUNT(*) and
+    # skip the second unfiltered count the changelist shows by default
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
     
     fieldsets = (
         ('Order Information', {
@@ -211,6 +331,9 @@ class OrderItemAdmin(admin.ModelAdmin):
     list_filter = ['order__daily_menu__date', 'food_item__category']
     search_fields = ['order__order_code', 'food_item__name']
     readonly_fields = ['subtotal', 'created_at']
+    list_select_related = ['order__student_profile', 'food_item']
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
 
 
 @admin.register(MPesaTransaction)
@@ -221,6 +344,9 @@ class MPesaTransactionAdmin(admin.ModelAdmin):
     search_fields = ['merchant_request_id', 'checkout_request_id', 'mpesa_receipt_number', 
                      'phone_number', 'order__order_code']
     readonly_fields = ['created_at', 'updated_at']
+    list_select_related = ['order__student_profile']
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
     
     def status_badge(self, obj):
         colors = {
@@ -236,14 +362,75 @@ class MPesaTransactionAdmin(admin.ModelAdmin):
             color, obj.get_status_display()
         )
     status_badge.short_description = 'Status'
+    
+    def get_urls(self):
+        urls = [
+            path('phases/', self.admin_site.admin_view(self.phases_view), name='ecommerce_mpesatransaction_phases'),
+        ]
+        return urls + super().get_urls()
+    
+    def phases_view(self, request):
+        if not self.has_view_permission(request):
+            return self.admin_site.login(request)
+        
+        periods = list(MealPeriod.objects.filter(is_active=True))
+        selected = request.GET.get('meal_period')
+        if selected == 'all':
+            meal_period, start, end = None, None, None
+        else:
+            chosen = next((period for period in periods if period.slug == selected), None)
+            meal_period, start, end = meal_period_window(chosen)
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Checkout phase timings',
+            'rows': phase_summary(start, end),
+            'meal_period': meal_period,
+            'meal_periods': periods,
+            'start': start,
+            'end': end,
+        }
+        return TemplateResponse(request, 'admin/ecommerce/mpesatransaction/phases.html', context)
 
 
 @admin.register(OrderReceipt)
 class OrderReceiptAdmin(admin.ModelAdmin):
-    list_display = ['order', 'receipt_type', 'recipient_email', 'recipient_phone', 'is_sent', 'sent_at']
-    list_filter = ['receipt_type', 'is_sent', 'sent_at']
-    search_fields = ['order__order_code', 'recipient_email', 'recipient_phone']
-    readonly_fields = ['sent_at', 'created_at']
+    list_display = ['order', 'receipt_type', 'recipient_email', 'recipient_phone', 'is_sent', 'sms_status', 'sent_at']
+    list_filter = ['receipt_type', 'is_sent', 'sms_status', 'sent_at']
+    search_fields = ['order__order_code', 'recipient_email', 'recipient_phone', 'sms_message_id']
+    readonly_fields = ['sent_at', 'created_at', 'sms_attempts', 'sms_message_id', 'sms_error']
+    list_select_related = ['order__student_profile']
+
+
+@admin.register(OrderEvent)
+class OrderEventAdmin(admin.ModelAdmin):
+    list_display = ['id', 'order_code', 'from_status', 'to_status', 'created_at']
+    list_filter = ['to_status', 'created_at']
+    search_fields = ['order_code']
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ['kind', 'subject', 'recipients', 'status', 'attempts', 'next_attempt_at', 'sent_at']
+    list_filter = ['kind', 'status', 'created_at']
+    search_fields = ['subject', 'recipients', 'order__order_code']
+    # Bodies are sent exactly as stored; staff can read and retry them, not rewrite them
+    readonly_fields = ['body', 'attempts', 'last_error', 'created_at', 'sent_at']
+    raw_id_fields = ['order']
+    actions = ['retry_now']
+    
+    def retry_now(self, request, queryset):
+        updated = queryset.exclude(status='sent').update(status='pending', next_attempt_at=timezone.now())
+        self.message_user(request, f"{updated} email(s) queued for retry.")
+    retry_now.short_description = "Retry selected emails now"
 
 
 @admin.register(MessStaff)
@@ -253,6 +440,7 @@ class MessStaffAdmin(admin.ModelAdmin):
     search_fields = ['user__username', 'user__email', 'employee_id', 'phone_number']
     prepopulated_fields = {'slug': ('employee_id',)}
     readonly_fields = ['created_at', 'updated_at']
+    list_select_related = ['user']
 
 
 @admin.register(SystemSettings)
@@ -266,6 +454,81 @@ class SystemSettingsAdmin(admin.ModelAdmin):
     value_preview.short_description = 'Value'
 
 
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ['order_code', 'menu_date', 'status', 'total_amount', 'items_summary', 'ordered_at', 'archived_at']
+    list_filter = ['status', 'menu_date']
+    search_fields = ['order_code', 'guest_registration_number', 'mpesa_receipt_number']
+    date_hierarchy = 'menu_date'
+    paginator = ApproximateCountPaginator
+    show_full_result_count = False
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+
+@admin.register(DailySalesRollup)
+class DailySalesRollupAdmin(admin.ModelAdmin):
+    list_display = ['date', 'meal_period', 'food_item', 'plates_sold', 'revenue', 'plates_cancelled', 'plates_served']
+    list_filter = ['meal_period', 'date']
+    search_fields = ['food_item__name']
+    date_hierarchy = 'date'
+    list_select_related = ['meal_period', 'food_item']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(MealCloseSnapshot)
+class MealCloseSnapshotAdmin(admin.ModelAdmin):
+    list_display = ['date', 'meal_period', 'food_item', 'plates_available', 'plates_ordered', 'plates_served', 'plates_left', 'sold_out_at']
+    list_filter = ['meal_period', 'date']
+    search_fields = ['food_item__name']
+    date_hierarchy = 'date'
+    list_select_related = ['meal_period', 'food_item']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def get_urls(self):
+        urls = [
+            path('analytics/', self.admin_site.admin_view(self.analytics_view), name='ecommerce_mealclosesnapshot_analytics'),
+        ]
+        return urls + super().get_urls()
+    
+    def analytics_view(self, request):
+        if not self.has_view_permission(request):
+            return self.admin_site.login(request)
+        
+        period = request.GET.get('period', 'semester')
+        start, end = period_range(period if period in REPORT_PERIODS else 'semester', timezone.localdate())
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Waste & utilization',
+            'rows': waste_analytics(start, end),
+            'start': start,
+            'end': end,
+            'period': period,
+            'periods': REPORT_PERIODS,
+        }
+        return TemplateResponse(request, 'admin/ecommerce/mealclosesnapshot/analytics.html', context)
+    
+    def plates_left(self, obj):
+        return obj.plates_left
+    plates_left.short_description = 'Left Over'
+
+
 # Customize admin site
 admin.site.site_header = 'Muranga University Mess System'
 admin.site.site_title = 'Mess Admin'
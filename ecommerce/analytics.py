@@ -0,0 +1,213 @@
+"""
+End-of-meal close and waste analytics.
+
+Once a meal period's serving window has passed, close_meals() snapshots
+every menu item's final numbers (plates cooked, ordered and served, and
+when it sold out) into MealCloseSnapshot. waste_analytics() loads a
+semester of snapshots into NumPy arrays and computes, per food item and
+meal period in one vectorized pass, the waste rate, utilization, how often
+and how fast the item sells out, and the average surplus when it does not.
+Results are cached until the next close.
+"""
+from datetime import datetime
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max, Q, Sum
+from django.utils import timezone
+
+from .invalidation import publish
+from .models import DailyMenu, DailyMenuItem, FoodItem, MealCloseSnapshot, MealPeriod, OrderItem
+from .rollups import SOLD_STATUSES, period_range
+from .workers import start_worker
+
+
+ANALYTICS_CACHE_PREFIX = 'meal-analytics'
+
+
+def due_for_close(now=None):
+    """Unclosed menus whose serving window has ended"""
+    now = timezone.localtime(now or timezone.now())
+    return DailyMenu.objects.filter(closed_at__isnull=True).filter(
+        Q(date__lt=now.date())
+        | Q(date=now.date(), meal_period__serving_end_time__lte=now.time())
+    )
+
+
+def _sold_out_times(menu_item_ids, available):
+    """{menu_item_id: ordered_at of the order that took the last plate}"""
+    sold = Q(order__status__in=SOLD_STATUSES) | Q(order__status='expired', order__payment_date__isnull=False)
+    rows = list(
+        OrderItem.objects.filter(sold, daily_menu_item_id__in=menu_item_ids)
+        .order_by('daily_menu_item_id', 'order__ordered_at', 'id')
+        .values_list('daily_menu_item_id', 'order__ordered_at', 'quantity')
+    )
+    if not rows:
+        return {}
+    ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    quantities = np.fromiter((row[2] for row in rows), dtype=np.int64, count=len(rows))
+
+    # Running total of plates within each menu item's run of rows
+    totals = np.cumsum(quantities)
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    offsets = np.repeat(np.r_[0, totals[starts[1:] - 1]], np.diff(np.r_[starts, len(ids)]))
+    running = totals - offsets
+
+    capacity = np.fromiter((available[i] for i in ids), dtype=np.int64, count=len(ids))
+    hits = np.flatnonzero(running >= capacity)
+    hit_ids, first = np.unique(ids[hits], return_index=True)
+    return {int(item_id): rows[hits[index]][1] for item_id, index in zip(hit_ids, first)}
+
+
+@transaction.atomic
+def close_meals(menus, now=None):
+    """Snapshot final utilization for each menu and mark it closed"""
+    now = now or timezone.now()
+    menus = list(menus.select_related('meal_period').select_for_update(of=('self',)))
+    if not menus:
+        return 0
+    menu_by_id = {menu.pk: menu for menu in menus}
+
+    items = list(DailyMenuItem.objects.filter(daily_menu__in=menus).values_list(
+        'id', 'daily_menu_id', 'food_item_id', 'total_plates_available', 'plates_ordered'
+    ))
+    served = dict(
+        OrderItem.objects.filter(daily_menu_item__daily_menu__in=menus, order__status='served')
+        .values_list('daily_menu_item_id').annotate(quantity=Sum('quantity')).order_by()
+    )
+    sold_out = _sold_out_times([item[0] for item in items], {item[0]: item[3] for item in items})
+
+    snapshots = []
+    for item_id, menu_id, food_item_id, available, ordered in items:
+        menu = menu_by_id[menu_id]
+        sold_out_at = sold_out.get(item_id)
+        minutes = None
+        if sold_out_at:
+            opened = timezone.make_aware(datetime.combine(menu.date, menu.meal_period.ordering_start_time))
+            minutes = max(0, int((sold_out_at - opened).total_seconds() // 60))
+        snapshots.append(MealCloseSnapshot(
+            daily_menu_item_id=item_id,
+            date=menu.date,
+            meal_period_id=menu.meal_period_id,
+            food_item_id=food_item_id,
+            plates_available=available,
+            plates_ordered=ordered,
+            plates_served=served.get(item_id, 0),
+            sold_out_at=sold_out_at,
+            sold_out_minutes=minutes,
+            closed_at=now,
+        ))
+    # Re-closing a menu refreshes its snapshots instead of duplicating them
+    MealCloseSnapshot.objects.bulk_create(
+        snapshots,
+        update_conflicts=True,
+        unique_fields=['daily_menu_item'],
+        update_fields=[
+            'plates_available', 'plates_ordered', 'plates_served',
+            'sold_out_at', 'sold_out_minutes', 'closed_at',
+        ],
+    )
+    DailyMenu.objects.filter(pk__in=menu_by_id).update(closed_at=now)
+    publish(DailyMenu)
+    return len(menus)
+
+
+def close_due_meals(now=None):
+    """Close every menu whose serving window has ended"""
+    return close_meals(due_for_close(now), now)
+
+
+def start_meal_closer(interval):
+    """Start the in-process end-of-meal close thread"""
+    return start_worker('meal-closer', close_due_meals, interval)
+
+
+def _group_sum(groups, values, size):
+    return np.bincount(groups, weights=values, minlength=size)
+
+
+def compute_waste_analytics(rows):
+    """
+    Per (food item, meal period) metrics from snapshot rows.
+
+    rows are (food_item_id, meal_period_id, available, ordered, served,
+    sold_out_minutes or None) tuples; everything is computed with array
+    operations over all rows at once.
+    """
+    if not rows:
+        return []
+    data = np.array(
+        [row[:5] + (np.nan if row[5] is None else row[5],) for row in rows],
+        dtype=float,
+    )
+    keys, groups = np.unique(data[:, :2].astype(np.int64), axis=0, return_inverse=True)
+    groups = groups.ravel()
+    size = len(keys)
+    available, ordered, served, minutes = data[:, 2], data[:, 3], data[:, 4], data[:, 5]
+    sold_out = ~np.isnan(minutes)
+
+    meals = np.bincount(groups, minlength=size)
+    available_sum = _group_sum(groups, available, size)
+    served_sum = _group_sum(groups, served, size)
+    leftover_sum = _group_sum(groups, available - served, size)
+    sold_out_count = _group_sum(groups, sold_out.astype(float), size)
+    minutes_sum = _group_sum(groups, np.where(sold_out, minutes, 0), size)
+    # Surplus only means something when the item did not sell out
+    surplus_sum = _group_sum(groups, np.where(sold_out, 0, available - ordered), size)
+    not_sold_out = meals - sold_out_count
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        waste_rate = np.where(available_sum > 0, leftover_sum / available_sum, 0)
+        utilization = np.where(available_sum > 0, served_sum / available_sum, 0)
+        sell_out_rate = sold_out_count / meals
+        sell_out_minutes = np.where(sold_out_count > 0, minutes_sum / sold_out_count, np.nan)
+        avg_surplus = np.where(not_sold_out > 0, surplus_sum / not_sold_out, 0)
+
+    return [
+        {
+            'food_item_id': int(keys[i, 0]),
+            'meal_period_id': int(keys[i, 1]),
+            'meals': int(meals[i]),
+            'plates_available': int(available_sum[i]),
+            'plates_served': int(served_sum[i]),
+            'plates_left': int(leftover_sum[i]),
+            'waste_rate': round(float(waste_rate[i]), 4),
+            'utilization': round(float(utilization[i]), 4),
+            'sell_out_rate': round(float(sell_out_rate[i]), 4),
+            'avg_sell_out_minutes': None if np.isnan(sell_out_minutes[i]) else round(float(sell_out_minutes[i]), 1),
+            'avg_surplus_plates': round(float(avg_surplus[i]), 1),
+        }
+        for i in range(size)
+    ]
+
+
+def waste_analytics(start=None, end=None):
+    """
+    Waste/utilization per food item and meal period, cached until the next close.
+
+    start/end are inclusive dates. Without an end, the range runs to the end
+    of the current semester; without a start, from the start of the semester
+    `end` falls in.
+    """
+    end = end or period_range('semester', timezone.localdate())[1]
+    start = start or period_range('semester', end)[0]
+    snapshots = MealCloseSnapshot.objects.filter(date__gte=start, date__lte=end)
+    last_close = snapshots.aggregate(last=Max('closed_at'))['last']
+    key = f'{ANALYTICS_CACHE_PREFIX}:{start}:{end}:{last_close.timestamp() if last_close else 0}'
+    results = cache.get(key)
+    if results is not None:
+        return results
+
+    results = compute_waste_analytics(list(snapshots.values_list(
+        'food_item_id', 'meal_period_id', 'plates_available', 'plates_ordered',
+        'plates_served', 'sold_out_minutes',
+    )))
+    food_items = FoodItem.objects.in_bulk({row['food_item_id'] for row in results})
+    meal_periods = MealPeriod.objects.in_bulk({row['meal_period_id'] for row in results})
+    for row in results:
+        row['food_item'] = food_items[row['food_item_id']].name
+        row['meal_period'] = meal_periods[row['meal_period_id']].get_name_display()
+    results.sort(key=lambda row: (-row['waste_rate'], row['food_item']))
+    cache.set(key, results, None)
+    return results
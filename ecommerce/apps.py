@@ -1,6 +1,31 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class EcommerceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ecommerce'
+
+    def ready(self):
+        from .invalidation import connect_signals
+        connect_signals()
+
+        interval = getattr(settings, 'ORDER_EXPIRY_SWEEP_INTERVAL', None)
+        if interval:
+            from .expiry import start_sweeper
+            start_sweeper(interval)
+
+        interval = getattr(settings, 'OUTBOX_DRAIN_INTERVAL', None)
+        if interval:
+            from .outbox import start_outbox_worker
+            start_outbox_worker(interval)
+
+        interval = getattr(settings, 'SMS_DISPATCH_INTERVAL', None)
+        if interval:
+            from .sms import start_sms_dispatcher
+            start_sms_dispatcher(interval)
+
+        interval = getattr(settings, 'MEAL_CLOSE_INTERVAL', None)
+        if interval:
+            from .analytics import start_meal_closer
+            start_meal_closer(interval)
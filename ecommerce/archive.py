@@ -0,0 +1,222 @@
+"""
+Order data lifecycle: moving closed meal periods into cold storage.
+
+Only today's menu is hot, yet orders, items and M-Pesa transactions pile up
+forever in the same tables. Orders whose meal period closed more than N days
+ago are copied into the Archived* tables and removed from the hot tables in
+batches, each batch in its own transaction. An order's items, M-Pesa
+transactions and status events are copied row for row; its receipt is kept
+as the type, delivery flag and recipient on the ArchivedOrder. Their events
+leave the change feed, whose readers are long past them by then.
+
+Native Postgres range partitioning is not used: partitioned tables cannot
+carry the global unique keys we rely on (order_code, checkout_request_id)
+unless the partition key is part of them, and nothing can hold a foreign key
+into them on Django 4.2. Archive tables behave the same on Postgres and
+SQLite and keep the hot tables small, which is what matters for the indexes.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import (
+    Order, OrderItem, MPesaTransaction, OrderReceipt, OrderEvent,
+    OutboxEmail, StudentProfile, ArchivedOrder, ArchivedOrderItem, ArchivedMPesaTransaction,
+    ArchivedOrderEvent
+)
+
+
+DEFAULT_ARCHIVE_AFTER_DAYS = 30
+DEFAULT_BATCH_SIZE = 500
+
+SPANNING_ORDER_FIELDS = [
+    'id', 'order_code', 'status', 'total_amount', 'items_summary', 'item_count',
+    'daily_menu_id', 'user_id', 'ordered_at', 'confirmed_at', 'served_at',
+]
+
+
+def archive_cutoff(older_than_days=DEFAULT_ARCHIVE_AFTER_DAYS):
+    """Menus dated strictly before this date are eligible for archival"""
+    return timezone.now().date() - timedelta(days=older_than_days)
+
+
+def archivable_orders(older_than_days=DEFAULT_ARCHIVE_AFTER_DAYS):
+    """Hot orders belonging to meal periods closed before the cutoff"""
+    return Order.objects.filter(daily_menu__date__lt=archive_cutoff(older_than_days))
+
+
+@transaction.atomic
+def _archive_batch(order_ids):
+    """Copy one batch of orders (and children) to cold storage, then delete"""
+    orders = list(
+        Order.objects.filter(id__in=order_ids).select_related('daily_menu')
+    )
+    receipts = {
+        receipt.order_id: receipt
+        for receipt in OrderReceipt.objects.filter(order_id__in=order_ids)
+    }
+
+    archived_orders = []
+    for order in orders:
+        receipt = receipts.get(order.id)
+        archived_orders.append(ArchivedOrder(
+            id=order.id,
+            order_code=order.order_code,
+            user_id=order.user_id,
+            student_profile_id=order.student_profile_id,
+            guest_registration_number=order.guest_registration_number,
+            guest_name=order.guest_name,
+            guest_phone=order.guest_phone,
+            daily_menu_id=order.daily_menu_id,
+            menu_date=order.daily_menu.date,
+            total_amount=order.total_amount,
+            status=order.status,
+            items_summary=order.items_summary,
+            item_count=order.item_count,
+            mpesa_transaction_id=order.mpesa_transaction_id,
+            mpesa_receipt_number=order.mpesa_receipt_number,
+            mpesa_phone_number=order.mpesa_phone_number,
+            payment_date=order.payment_date,
+            receipt_type=receipt.receipt_type if receipt else '',
+            receipt_sent=receipt.is_sent if receipt else False,
+            receipt_email=(receipt.recipient_email or '') if receipt else '',
+            receipt_phone=(receipt.recipient_phone or '') if receipt else '',
+            ordered_at=order.ordered_at,
+            confirmed_at=order.confirmed_at,
+            served_at=order.served_at,
+            expires_at=order.expires_at,
+        ))
+
+    archived_items = [
+        ArchivedOrderItem(
+            id=item['id'],
+            order_id=item['order_id'],
+            food_item_id=item['food_item_id'],
+            food_item_name=item['food_item__name'],
+            quantity=item['quantity'],
+            price_per_plate=item['price_per_plate'],
+            subtotal=item['subtotal'],
+            created_at=item['created_at'],
+        )
+        for item in OrderItem.objects.filter(order_id__in=order_ids).values(
+            'id', 'order_id', 'food_item_id', 'food_item__name', 'quantity',
+            'price_per_plate', 'subtotal', 'created_at'
+        )
+    ]
+
+    archived_transactions = [
+        ArchivedMPesaTransaction(
+            id=txn.id,
+            order_id=txn.order_id,
+            merchant_request_id=txn.merchant_request_id,
+            checkout_request_id=txn.checkout_request_id,
+            phone_number=txn.phone_number,
+            amount=txn.amount,
+            status=txn.status,
+            mpesa_receipt_number=txn.mpesa_receipt_number,
+            transaction_date=txn.transaction_date,
+            result_code=txn.result_code,
+            result_desc=txn.result_desc,
+            created_at=txn.created_at,
+        )
+        for txn in MPesaTransaction.objects.filter(order_id__in=order_ids)
+    ]
+
+    archived_events = [
+        ArchivedOrderEvent(
+            id=event.id,
+            order_id=event.order_id,
+            order_code=event.order_code,
+            from_status=event.from_status,
+            to_status=event.to_status,
+            created_at=event.created_at,
+        )
+        for event in OrderEvent.objects.filter(order_id__in=order_ids)
+    ]
+
+    ArchivedOrder.objects.bulk_create(archived_orders)
+    ArchivedOrderItem.objects.bulk_create(archived_items)
+    ArchivedMPesaTransaction.objects.bulk_create(archived_transactions)
+    ArchivedOrderEvent.objects.bulk_create(archived_events)
+
+    # Sent mail stays in the outbox log, no longer tied to a hot order
+    OutboxEmail.objects.filter(order_id__in=order_ids).update(order=None)
+    # Children first so the Order delete has nothing left to cascade
+    OrderEvent.objects.filter(order_id__in=order_ids).delete()
+    OrderReceipt.objects.filter(order_id__in=order_ids).delete()
+    MPesaTransaction.objects.filter(order_id__in=order_ids).delete()
+    OrderItem.objects.filter(order_id__in=order_ids).delete()
+    Order.objects.filter(id__in=order_ids).delete()
+
+    return len(archived_orders)
+
+
+def archive_closed_orders(older_than_days=DEFAULT_ARCHIVE_AFTER_DAYS,
+                          batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+    """
+    Move orders of meal periods older than older_than_days into cold storage.
+
+    Returns the number of orders archived (or that would be, for a dry run).
+    """
+    queryset = archivable_orders(older_than_days).order_by('id')
+    if dry_run:
+        return queryset.count()
+
+    archived = 0
+    last_id = 0
+    while True:
+        order_ids = list(
+            queryset.filter(id__gt=last_id).values_list('id', flat=True)[:batch_size]
+        )
+        if not order_ids:
+            break
+        archived += _archive_batch(order_ids)
+        last_id = order_ids[-1]
+    return archived
+
+
+def user_order_querysets(user):
+    """
+    Hot and cold order querysets for one user, for keyset paging.
+
+    Orders placed while logged in carry the user; orders that only carry
+    the student profile (placed as a guest with the student's registration
+    number, or before the account existed) are matched by profile. Each
+    match is its own queryset rather than one OR, so the user's orders keep
+    seeking on the (user, ordered_at, id) index.
+    """
+    try:
+        profile = user.student_profile
+    except StudentProfile.DoesNotExist:
+        profile = None
+
+    querysets = []
+    for model in (Order, ArchivedOrder):
+        orders = model.objects.select_related('daily_menu', 'daily_menu__meal_period')
+        querysets.append(orders.filter(user=user))
+        if profile is not None:
+            querysets.append(orders.filter(student_profile=profile).exclude(user=user))
+    return querysets
+
+
+def find_order(order_code):
+    """The hot order with this code, else its archived copy, else None"""
+    order = Order.objects.filter(order_code=order_code).first()
+    if order is None:
+        order = ArchivedOrder.objects.filter(order_code=order_code).first()
+    return order
+
+
+def spanning_orders(fields=None, **filters):
+    """
+    Values of orders matching filters across hot and cold storage.
+
+    Both tables keep a daily_menu foreign key, so lookups such as
+    daily_menu__date__range or daily_menu__meal_period work on either. The
+    result is a single UNION ALL query.
+    """
+    fields = fields or SPANNING_ORDER_FIELDS
+    hot = Order.objects.filter(**filters).order_by().values(*fields)
+    cold = ArchivedOrder.objects.filter(**filters).order_by().values(*fields)
+    return hot.union(cold, all=True)
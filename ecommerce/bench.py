@@ -0,0 +1,118 @@
+"""
+Helpers shared by the bench_* management commands.
+
+Benchmarks seed their own data and, unless asked to keep it, roll it back at
+the end, so they can be pointed at a scratch copy of the real database.
+"""
+import time
+from contextlib import contextmanager
+from datetime import time as clock, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Category, FoodItem, MealPeriod, DailyMenu, DailyMenuItem, Order, OrderItem
+
+
+class _Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rollback_afterwards(keep=False):
+    """Run the block in a transaction that is rolled back unless keep=True"""
+    try:
+        with transaction.atomic():
+            yield
+            if not keep:
+                raise _Rollback
+    except _Rollback:
+        pass
+
+
+@contextmanager
+def timed(results, name):
+    """Store the wall-clock duration of the block in results[name]"""
+    started = time.perf_counter()
+    yield
+    results[name] = time.perf_counter() - started
+
+
+def seed_bench_menu(date=None, items=5, plates_per_sufuria=50, sufuria_count=10):
+    """An always-open bench meal period and a published menu with `items` items"""
+    meal_period, _ = MealPeriod.objects.get_or_create(
+        name=MealPeriod.SUPPER,
+        defaults={
+            'start_time': clock(0, 0),
+            'end_time': clock(23, 59, 59),
+            'ordering_start_time': clock(0, 0),
+            'ordering_end_time': clock(23, 59, 59),
+            'serving_start_time': clock(0, 0),
+            'serving_end_time': clock(23, 59, 59),
+        }
+    )
+    category, _ = Category.objects.get_or_create(name='Bench')
+    menu, _ = DailyMenu.objects.get_or_create(
+        date=date or timezone.now().date(),
+        meal_period=meal_period,
+        defaults={'is_published': True},
+    )
+    for index in range(items):
+        food_item, _ = FoodItem.objects.get_or_create(
+            category=category,
+            name=f'Bench Food {index}',
+            defaults={'price_per_plate': Decimal('50.00')},
+        )
+        DailyMenuItem.objects.get_or_create(
+            daily_menu=menu,
+            food_item=food_item,
+            defaults={
+                'sufuria_count': sufuria_count,
+                'plates_per_sufuria': plates_per_sufuria,
+            },
+        )
+    return menu
+
+
+def seed_orders(menu, count, batch_size=10000, with_items=True, prefix='B'):
+    """
+    Bulk insert `count` confirmed orders (and one item each) for a menu.
+
+    Inserts in batches so seeding a million rows does not hold them all in
+    memory at once.
+    """
+    menu_items = list(menu.menu_items.select_related('food_item'))
+    expires_at = timezone.now() + timedelta(hours=2)
+    for batch_start in range(0, count, batch_size):
+        orders = []
+        for index in range(batch_start, min(batch_start + batch_size, count)):
+            menu_item = menu_items[index % len(menu_items)]
+            code = f'{prefix}{index:011d}'
+            orders.append(Order(
+                order_code=code,
+                slug=code.lower(),
+                daily_menu=menu,
+                guest_registration_number='SC211-0000-2022',
+                guest_name='Bench Student',
+                total_amount=menu_item.food_item.price_per_plate,
+                status='confirmed',
+                items_summary=menu_item.food_item.name,
+                item_count=1,
+                mpesa_phone_number='254700000000',
+                expires_at=expires_at,
+            ))
+        orders = Order.objects.bulk_create(orders)
+        if not with_items:
+            continue
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                daily_menu_item=menu_items[position % len(menu_items)],
+                food_item=menu_items[position % len(menu_items)].food_item,
+                price_per_plate=order.total_amount,
+                subtotal=order.total_amount,
+                slug=f'{order.slug}-item',
+            )
+            for position, order in enumerate(orders, start=batch_start)
+        ])
@@ -0,0 +1,101 @@
+"""
+Caches of rarely changing rows and of the data every page renders.
+
+LocalCache values live in each process (see invalidation.py); a change saved
+by any worker reaches them within the invalidation poll interval. Cached
+model instances are shared between requests: read them, never modify them.
+
+SingleflightCache values live in the shared Django cache and are computed
+once per key however many requests miss at the same moment (see
+singleflight.py). They back the header data of every page and the home
+page. Stock and order counts among them are not versioned and may lag by
+up to their ttl; add_to_cart and checkout re-check stock anyway.
+"""
+from django.db.models import Count
+
+from .invalidation import LocalCache
+from .models import Category, SubCategory, FoodItem, MealPeriod, DailyMenu, Order
+from .singleflight import SingleflightCache
+
+
+_meal_periods = LocalCache(MealPeriod)
+
+_site_data = SingleflightCache('site', Category, SubCategory, MealPeriod, DailyMenu, ttl=60)
+_home_catalog = SingleflightCache('home-catalog', Category, FoodItem, ttl=300)
+_home_menu = SingleflightCache('home-menu', FoodItem, MealPeriod, DailyMenu, ttl=10)
+
+
+def active_meal_periods():
+    """Active meal periods in start_time order"""
+    return _meal_periods.get('active', lambda: list(MealPeriod.objects.filter(is_active=True)))
+
+
+def meal_period_at(current_time):
+    """The active meal period running at `current_time`, or None"""
+    for period in active_meal_periods():
+        if period.start_time <= current_time <= period.end_time:
+            return period
+    return None
+
+
+def _published_menu(date, meal_period):
+    return DailyMenu.objects.filter(
+        date=date,
+        meal_period=meal_period,
+        is_published=True,
+        is_active=True
+    ).select_related('meal_period').first()
+
+
+def site_data(date, meal_period):
+    """(active categories with subcategories, published menu for `meal_period` on `date`)"""
+    def compute():
+        categories = list(Category.objects.filter(is_active=True).prefetch_related('subcategories'))
+        return categories, _published_menu(date, meal_period) if meal_period else None
+    return _site_data.get(f'{date}:{meal_period.pk if meal_period else 0}', compute)
+
+
+def home_catalog():
+    """Featured categories, item lists and counts shown on the home page"""
+    def compute():
+        return {
+            'featured_categories': list(Category.objects.filter(
+                is_active=True
+            ).annotate(
+                item_count=Count('food_items')
+            ).order_by('display_order')[:8]),
+            # Items with the most orders
+            'best_selling': list(FoodItem.objects.filter(
+                is_active=True,
+                is_available=True
+            ).select_related('category').annotate(
+                order_count=Count('orderitem')
+            ).order_by('-order_count')[:10]),
+            'latest_items': list(FoodItem.objects.filter(
+                is_active=True,
+                is_available=True
+            ).order_by('-created_at')[:10]),
+            # Items appearing in the most menus
+            'popular_items': list(FoodItem.objects.filter(
+                is_active=True,
+                is_available=True
+            ).annotate(
+                menu_count=Count('daily_appearances')
+            ).order_by('-menu_count')[:10]),
+            'total_varieties': FoodItem.objects.filter(is_active=True).count(),
+            'total_orders': Order.objects.filter(status='served').count(),
+        }
+    return _home_catalog.get('all', compute)
+
+
+def home_menu(date, meal_period):
+    """(published menu for `meal_period` on `date`, up to 10 of its items still in stock)"""
+    def compute():
+        todays_menu = _published_menu(date, meal_period)
+        if todays_menu is None:
+            return None, []
+        return todays_menu, list(todays_menu.menu_items.filter(
+            is_available=True,
+            plates_remaining__gt=0
+        ).select_related('food_item__category')[:10])
+    return _home_menu.get(f'{date}:{meal_period.pk}', compute)
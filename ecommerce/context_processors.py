@@ -2,41 +2,20 @@
 Context processors for making data available across all templates
 """
 from django.utils import timezone
-from .models import Category, MealPeriod, DailyMenu
+from .caches import meal_period_at, site_data
 
 
 def site_context(request):
     """
     Make common site data available to all templates
     """
-    # Get all active categories with their subcategories
-    categories = Category.objects.filter(is_active=True).prefetch_related('subcategories')
-    
     # Get current meal period
     current_time = timezone.now().time()
-    current_meal_period = None
-    try:
-        current_meal_period = MealPeriod.objects.filter(
-            is_active=True,
-            start_time__lte=current_time,
-            end_time__gte=current_time
-        ).first()
-    except MealPeriod.DoesNotExist:
-        pass
+    current_meal_period = meal_period_at(current_time)
     
-    # Get today's active menu
+    # Get all active categories with their subcategories, and today's active menu
     today = timezone.now().date()
-    todays_menu = None
-    if current_meal_period:
-        try:
-            todays_menu = DailyMenu.objects.filter(
-                date=today,
-                meal_period=current_meal_period,
-                is_published=True,
-                is_active=True
-            ).first()
-        except DailyMenu.DoesNotExist:
-            pass
+    categories, todays_menu = site_data(today, current_meal_period)
     
     # Get cart count from session
     cart = request.session.get('cart', {})
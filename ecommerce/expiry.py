@@ -0,0 +1,109 @@
+"""
+Order expiry sweeping.
+
+Order.expires_at is set when the order is placed, but nothing used to move
+overdue orders to 'expired'; every check called is_expired() per row instead.
+The sweeper does it in batches: each batch locks a slice of overdue live
+orders (found through a partial index on expires_at), marks them expired
+with one UPDATE and gives their plates back to the menu in the same
+transaction. Each expired order's transition goes to the order change feed.
+
+Orders still unpaid after the order_expiry_hours system setting expire too,
+even if their meal is still being served. They are swept in a separate pass
+so the expires_at pass keeps using its partial index.
+"""
+import logging
+import time
+from dataclasses import dataclass
+
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+
+from .events import record_order_events
+from .models import Order, OrderItem
+from .stock import release_plates
+from .system_settings import get_setting
+from .workers import start_worker
+
+
+logger = logging.getLogger(__name__)
+
+SWEEP_BATCH_SIZE = 1000
+
+
+@dataclass
+class SweepResult:
+    expired: int = 0
+    plates_released: int = 0
+    batches: int = 0
+    duration: float = 0.0
+
+
+def _overdue_filters(now):
+    """One filter per sweep pass: past expires_at, and unpaid for too long"""
+    return [
+        (Q(status__in=Order.LIVE_STATUSES, expires_at__lt=now), 'expires_at'),
+        (Q(status='pending', ordered_at__lt=now - get_setting('order_expiry_hours')), 'ordered_at'),
+    ]
+
+
+def _expire_batch(now, batch_size, overdue, oldest_first):
+    """Expire one batch of `overdue` orders; returns (orders expired, plates released)"""
+    with transaction.atomic():
+        orders = list(
+            Order.objects.filter(overdue)
+            .order_by(oldest_first).select_for_update(skip_locked=True)
+            .values_list('id', 'order_code', 'status')[:batch_size]
+        )
+        if not orders:
+            return 0, 0
+        order_ids = [order_id for order_id, _, _ in orders]
+
+        held = dict(
+            OrderItem.objects.filter(order_id__in=order_ids)
+            .values_list('daily_menu_item_id')
+            .annotate(quantity=Sum('quantity'))
+            .order_by()
+        )
+        release_plates(held)
+
+        expired = Order.objects.filter(id__in=order_ids).update(
+            status='expired',
+            updated_at=now,
+        )
+        record_order_events([
+            (order_id, order_code, status, 'expired') for order_id, order_code, status in orders
+        ])
+        return expired, sum(held.values())
+
+
+def sweep_expired_orders(batch_size=SWEEP_BATCH_SIZE, now=None):
+    """Expire every overdue live order, one batch at a time"""
+    now = now or timezone.now()
+    result = SweepResult()
+    started = time.monotonic()
+    for overdue, oldest_first in _overdue_filters(now):
+        while True:
+            expired, released = _expire_batch(now, batch_size, overdue, oldest_first)
+            if not expired:
+                break
+            result.expired += expired
+            result.plates_released += released
+            result.batches += 1
+    result.duration = time.monotonic() - started
+    return result
+
+
+def _sweep_and_log():
+    result = sweep_expired_orders()
+    if result.expired:
+        logger.info(
+            "Expired %d orders (%d plates released) in %.3fs",
+            result.expired, result.plates_released, result.duration
+        )
+
+
+def start_sweeper(interval):
+    """Start the in-process expiry sweeper thread"""
+    return start_worker('order-expiry-sweeper', _sweep_and_log, interval)
@@ -0,0 +1,158 @@
+"""
+Responsive derivatives of FoodItem images.
+
+Uploaded originals (.jpg, .jfif, .webp, .avif, often several hundred KB)
+used to be served as-is on every product card. When a FoodItem's image
+changes, derivatives at a few widths are generated in WebP and JPEG under a
+content-hashed directory (MEDIA_ROOT/<FOOD_IMAGE_CACHE_DIR>/<sha1[:2]>/<sha1>/,
+fanned out by the first two hex digits), and the hash is stored on the item
+once they are written. The {% food_image %} tag then emits a <picture> with
+srcset so browsers download the smallest file that fits the card. Because
+the directory name is the hash of the source bytes, derivatives never go
+stale and can be cached forever.
+"""
+import hashlib
+import io
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 75, 'method': 4},
+    'jpg': {'format': 'JPEG', 'quality': 80, 'optimize': True, 'progressive': True},
+}
+
+# Uploads are processed off the request thread, one or two at a time
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='food-images')
+
+
+def image_widths():
+    return sorted(settings.FOOD_IMAGE_WIDTHS)
+
+
+def derivative_name(digest, width, ext):
+    """Storage name of one derivative"""
+    return f'{settings.FOOD_IMAGE_CACHE_DIR}/{digest[:2]}/{digest}/{width}.{ext}'
+
+
+def derivative_url(digest, width, ext):
+    return default_storage.url(derivative_name(digest, width, ext))
+
+
+def available_widths(digest, original_width):
+    """Widths generated for an image: never upscaled, at least the smallest"""
+    widths = [width for width in image_widths() if width <= original_width]
+    return widths or image_widths()[:1]
+
+
+def generate_derivatives(name, force=False):
+    """
+    Write every derivative of the stored image `name`.
+
+    Returns (digest, widths). Existing derivatives are reused unless force.
+    """
+    with default_storage.open(name, 'rb') as handle:
+        data = handle.read()
+    digest = hashlib.sha1(data).hexdigest()
+
+    with Image.open(io.BytesIO(data)) as source:
+        source = ImageOps.exif_transpose(source)
+        if source.mode not in ('RGB', 'RGBA'):
+            source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+        widths = available_widths(digest, source.width)
+        for width in widths:
+            if not force and default_storage.exists(derivative_name(digest, width, 'jpg')):
+                continue
+            height = round(source.height * width / source.width)
+            resized = source.resize((width, height), Image.LANCZOS)
+            for ext, options in FORMATS.items():
+                image = resized.convert('RGB') if options['format'] == 'JPEG' else resized
+                buffer = io.BytesIO()
+                image.save(buffer, **options)
+                target = derivative_name(digest, width, ext)
+                if default_storage.exists(target):
+                    default_storage.delete(target)
+                default_storage.save(target, ContentFile(buffer.getvalue()))
+    return digest, widths
+
+
+def process_food_item_image(food_item_id, name, force=False):
+    """Generate derivatives and record the hash if the image is still current"""
+    from .invalidation import publish
+    from .models import FoodItem
+    try:
+        digest, widths = generate_derivatives(name, force=force)
+    except Exception:
+        logger.exception("Could not generate derivatives for %s", name)
+        return None
+    FoodItem.objects.filter(pk=food_item_id, image=name).update(
+        image_digest=digest,
+        image_widths=','.join(str(width) for width in widths),
+    )
+    publish(FoodItem)
+    return digest
+
+
+def schedule_food_item_image(food_item_id, name):
+    """Generate derivatives for a freshly saved image in the background"""
+    return _executor.submit(_process_in_thread, food_item_id, name)
+
+
+def _process_in_thread(food_item_id, name):
+    from django.db import close_old_connections
+    try:
+        return process_food_item_image(food_item_id, name)
+    finally:
+        close_old_connections()
+
+
+def _init_image_worker():
+    # Spawned (non-forked) workers start without configured settings
+    import django
+    django.setup()
+
+
+def _generate_in_process(name, force):
+    try:
+        return name, generate_derivatives(name, force=force)
+    except Exception as e:
+        return name, e
+
+
+def backfill_derivatives(food_items, workers=None, force=False):
+    """
+    Generate derivatives for many items across a process pool.
+
+    Returns (processed, failures) where failures is a list of (name, error).
+    """
+    from .invalidation import publish
+    from .models import FoodItem
+    items = {}
+    for pk, name in food_items.exclude(image='').exclude(image=None).values_list('pk', 'image'):
+        items.setdefault(name, []).append(pk)
+
+    processed = 0
+    failures = []
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_image_worker) as executor:
+        jobs = executor.map(_generate_in_process, list(items), [force] * len(items))
+        for name, outcome in jobs:
+            if isinstance(outcome, Exception):
+                failures.append((name, outcome))
+                continue
+            digest, widths = outcome
+            processed += FoodItem.objects.filter(pk__in=items[name], image=name).update(
+                image_digest=digest,
+                image_widths=','.join(str(width) for width in widths),
+            )
+    if processed:
+        publish(FoodItem)
+    return processed, failures
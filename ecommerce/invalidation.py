@@ -0,0 +1,263 @@
+"""
+Cross-process cache invalidation.
+
+Every gunicorn worker on every node keeps its own LocalCache objects, so a
+save in one worker has to reach all the others. Saving or deleting one of
+INVALIDATING_MODELS bumps that model's CacheVersion row right after the
+write; on Postgres a NOTIFY on CHANNEL goes out with it (when the writing
+transaction commits).
+
+Before a process serves a cached value it checks for changes. On Postgres
+with psycopg2 it polls its own LISTEN connection, which never blocks, and
+re-reads the version table when a notification arrived (and every
+RESYNC_SECONDS regardless). Otherwise it re-reads the version table every
+CACHE_INVALIDATION_POLL_INTERVAL seconds. Caches that depend on a model
+whose version moved are cleared, so a process serves a changed row at most
+one poll interval (or one NOTIFY round trip) late, and the writing process
+clears its own caches as soon as it commits. When the check fails, caches
+are bypassed rather than trusted.
+
+Queryset update() and bulk_create() send no signals: code that changes
+these models that way calls publish() itself.
+"""
+import logging
+import os
+import threading
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from .routers import primary_reads
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'ecommerce_cache'
+RESYNC_SECONDS = 60
+
+# Saves and deletes of these are published. Stock (DailyMenuItem) is not
+# among them: it changes with every checkout and is never cached in-process.
+INVALIDATING_MODELS = [
+    'ecommerce.Category', 'ecommerce.SubCategory', 'ecommerce.FoodItem',
+    'ecommerce.MealPeriod', 'ecommerce.DailyMenu', 'ecommerce.SystemSettings',
+]
+
+
+def topic_for(model):
+    return model._meta.label_lower
+
+
+def published_topics(models):
+    """The topics of `models`, all of which must be in INVALIDATING_MODELS"""
+    for model in models:
+        if model._meta.label not in INVALIDATING_MODELS:
+            raise ValueError(f"{model._meta.label} is not in INVALIDATING_MODELS; its changes are never published")
+    return frozenset(topic_for(model) for model in models)
+
+
+# ==================== PUBLISHING ====================
+
+def publish(*models):
+    """Bump the versions of `models`; inside a transaction the bump commits with it"""
+    from .models import CacheVersion
+    topics = sorted({topic_for(model) for model in models})
+    versions = CacheVersion.objects.using(DEFAULT_DB_ALIAS)
+    for topic in topics:
+        if not versions.filter(topic=topic).update(version=F('version') + 1, updated_at=timezone.now()):
+            # Seeded by the migration; a flushed table starts the row again
+            versions.bulk_create([CacheVersion(topic=topic)], ignore_conflicts=True)
+            versions.filter(topic=topic).update(version=F('version') + 1, updated_at=timezone.now())
+
+    connection = connections[DEFAULT_DB_ALIAS]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [CHANNEL, ','.join(topics)])
+    transaction.on_commit(lambda: bus.changed(topics), using=DEFAULT_DB_ALIAS)
+
+
+def _publish_change(sender, **kwargs):
+    publish(sender)
+
+
+def connect_signals():
+    """Publish saves and deletes of INVALIDATING_MODELS; called from AppConfig.ready()"""
+    for label in INVALIDATING_MODELS:
+        model = apps.get_model(label)
+        post_save.connect(_publish_change, sender=model, dispatch_uid=f'invalidate-save:{label}')
+        post_delete.connect(_publish_change, sender=model, dispatch_uid=f'invalidate-delete:{label}')
+
+
+# ==================== SUBSCRIBING ====================
+
+class InvalidationBus:
+    """This process's view of the cache versions, and the caches to clear when they move"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._caches = []
+        self._stamps = None
+        self._checked_at = None
+        self._listener = None
+        self._listener_pid = None
+        self._listen_unsupported = False
+
+    def register(self, cache):
+        self._caches.append(cache)
+
+    def changed(self, topics):
+        """Clear the caches depending on any of `topics`"""
+        topics = set(topics)
+        for cache in self._caches:
+            if cache.topics & topics:
+                cache.clear()
+
+    def reset(self):
+        """Forget every version seen and every cached value"""
+        with self._lock:
+            self._stamps = self._checked_at = None
+            for cache in self._caches:
+                cache.clear()
+
+    def check(self):
+        """Apply changes published since the last check, if one is due; False if caches can't be trusted"""
+        if not self._lock.acquire(blocking=False):
+            # Another thread is checking right now; what it saw last still holds
+            return self._stamps is not None
+        try:
+            now = time.monotonic()
+            if self._listen():
+                due = self._notified() or self._checked_at is None or now - self._checked_at >= RESYNC_SECONDS
+            else:
+                interval = getattr(settings, 'CACHE_INVALIDATION_POLL_INTERVAL', 2)
+                due = self._checked_at is None or now - self._checked_at >= interval
+            return self._sync(now) if due else True
+        finally:
+            self._lock.release()
+
+    def stamp(self, topics):
+        """A string that changes whenever one of `topics` does; None if changes can't be tracked"""
+        if not topics:
+            return ''
+        if not self.check():
+            return None
+        stamps = self._stamps
+        return '/'.join(
+            f'{stamps[topic][0]}.{stamps[topic][1].timestamp():.6f}' if topic in stamps else '-'
+            for topic in sorted(topics)
+        )
+
+    def _sync(self, now):
+        from .models import CacheVersion
+        try:
+            stamps = {
+                topic: (version, updated_at)
+                for topic, version, updated_at in CacheVersion.objects.using(DEFAULT_DB_ALIAS).values_list(
+                    'topic', 'version', 'updated_at'
+                )
+            }
+        except DatabaseError:
+            logger.warning("Could not read cache versions; bypassing in-process caches", exc_info=True)
+            self._checked_at = None
+            return False
+
+        if self._stamps is None:
+            # Values cached before the first check are of unknown age
+            changed = {topic for cache in self._caches for topic in cache.topics}
+        else:
+            changed = {
+                topic for topic in stamps.keys() | self._stamps.keys()
+                if stamps.get(topic) != self._stamps.get(topic)
+            }
+        if changed:
+            self.changed(changed)
+        self._stamps = stamps
+        self._checked_at = now
+        return True
+
+    def _listen(self):
+        """Make sure this process LISTENs on CHANNEL; False where that isn't possible"""
+        if self._listen_unsupported or connections[DEFAULT_DB_ALIAS].vendor != 'postgresql':
+            return False
+        if self._listener is not None and self._listener_pid == os.getpid():
+            return True
+
+        # A forked worker must not share its parent's socket: open its own
+        listener = connections.create_connection(DEFAULT_DB_ALIAS)
+        try:
+            listener.ensure_connection()
+            if not hasattr(listener.connection, 'poll'):
+                # psycopg 3 has no non-blocking poll; read the version table instead
+                listener.close()
+                self._listen_unsupported = True
+                return False
+            with listener.cursor() as cursor:
+                cursor.execute(f'LISTEN {CHANNEL}')
+        except DatabaseError:
+            logger.warning("Could not LISTEN for cache invalidations; polling instead", exc_info=True)
+            return False
+        self._listener, self._listener_pid = listener, os.getpid()
+        # Changes made while nobody was listening were never notified
+        self._checked_at = None
+        return True
+
+    def _notified(self):
+        """Whether a NOTIFY arrived since the last call (or the connection broke)"""
+        connection = self._listener.connection
+        try:
+            with self._listener.wrap_database_errors:
+                connection.poll()
+        except DatabaseError:
+            logger.warning("Lost the cache invalidation LISTEN connection", exc_info=True)
+            self._listener.close()
+            self._listener = None
+            return True
+        notified = bool(connection.notifies)
+        connection.notifies.clear()
+        return notified
+
+
+bus = InvalidationBus()
+
+
+class LocalCache:
+    """
+    Values computed from `models`, kept in this process until one of them changes.
+
+    Keys are chosen by the caller and should be few; the values are shared
+    by every request the process serves.
+    """
+
+    def __init__(self, *models):
+        self.topics = published_topics(models)
+        self._lock = threading.Lock()
+        self._values = {}
+        self._generation = 0
+        bus.register(self)
+
+    def get(self, key, compute):
+        """The cached value for `key`, computing it from the primary database if needed"""
+        if not bus.check():
+            with primary_reads():
+                return compute()
+        with self._lock:
+            if key in self._values:
+                return self._values[key]
+            generation = self._generation
+        # A replica could still hold rows older than the versions just read
+        with primary_reads():
+            value = compute()
+        with self._lock:
+            # Invalidated while computing: the value may predate the change
+            if generation == self._generation:
+                self._values[key] = value
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._generation += 1
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ecommerce.archive import (
+    DEFAULT_ARCHIVE_AFTER_DAYS, DEFAULT_BATCH_SIZE,
+    archive_closed_orders, archive_cutoff
+)
+
+
+class Command(BaseCommand):
+    help = 'Moves orders, items and M-Pesa transactions of old meal periods into cold storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than-days', type=int, default=DEFAULT_ARCHIVE_AFTER_DAYS,
+            help='Archive meal periods dated more than this many days ago'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Orders moved per transaction'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report how many orders would be archived'
+        )
+
+    def handle(self, *args, **options):
+        older_than_days = options['older_than_days']
+        cutoff = archive_cutoff(older_than_days)
+
+        started = time.monotonic()
+        count = archive_closed_orders(
+            older_than_days=older_than_days,
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+        )
+        elapsed = time.monotonic() - started
+
+        if options['dry_run']:
+            self.stdout.write(f'{count} orders from menus before {cutoff} would be archived')
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'✓ Archived {count} orders from menus before {cutoff} in {elapsed:.2f}s'
+            ))
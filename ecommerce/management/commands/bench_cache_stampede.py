@@ -0,0 +1,99 @@
+import statistics
+import threading
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from ecommerce.singleflight import SingleflightCache
+
+
+class Stampede:
+    """`requests` threads asking for one key at the same instant"""
+
+    def __init__(self, requests, compute_seconds):
+        self.requests = requests
+        self.compute_seconds = compute_seconds
+        self.computations = 0
+        self._count_lock = threading.Lock()
+
+    def compute(self):
+        with self._count_lock:
+            self.computations += 1
+        # Stands in for the menu and catalog queries behind a page
+        time.sleep(self.compute_seconds)
+        return 'page data'
+
+    def run(self, get):
+        """Latencies (seconds) of every request"""
+        barrier = threading.Barrier(self.requests)
+        latencies = []
+
+        def request():
+            barrier.wait()
+            started = time.perf_counter()
+            get(self.compute)
+            latencies.append(time.perf_counter() - started)
+
+        threads = [threading.Thread(target=request) for _ in range(self.requests)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return latencies
+
+
+def plain_get(key, compute):
+    """How a page cache usually reads: get, else compute and set"""
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, 60)
+    return value
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks concurrent misses on one cache key: plain get-or-set against singleflight'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Concurrent requests for the key')
+        parser.add_argument('--compute-ms', type=float, default=200, help='Time to compute the value')
+
+    def handle(self, *args, **options):
+        compute_seconds = options['compute_ms'] / 1000
+        singleflight = SingleflightCache('bench', ttl=60)
+        key = 'bench-stampede'
+        cache_key = f'singleflight:bench:{key}'
+
+        def forget_singleflight():
+            cache.delete_many([cache_key, f'{cache_key}:lock'])
+
+        def expire_singleflight():
+            # The entry outlived its ttl but is still within its stale window
+            value, fresh_until, cost, stamp = cache.get(cache_key)
+            cache.set(cache_key, (value, time.time() - 1, cost, stamp))
+
+        scenarios = [
+            ('cold, plain', lambda: cache.delete(key), lambda compute: plain_get(key, compute)),
+            ('cold, singleflight', forget_singleflight, lambda compute: singleflight.get(key, compute)),
+            ('expired, plain', lambda: cache.delete(key), lambda compute: plain_get(key, compute)),
+            ('expired, singleflight', expire_singleflight, lambda compute: singleflight.get(key, compute)),
+        ]
+        results = {}
+        for name, prepare, get in scenarios:
+            prepare()
+            stampede = Stampede(options['requests'], compute_seconds)
+            latencies = sorted(stampede.run(get))
+            results[name] = stampede.computations
+            self.stdout.write(
+                f'{name:>22}: {stampede.computations:4d} computations, '
+                f'p50 {statistics.median(latencies) * 1000:6.1f}ms, '
+                f'p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:6.1f}ms'
+            )
+
+        cache.delete(key)
+        forget_singleflight()
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ {options['requests']} concurrent misses ran {results['cold, singleflight']} computation(s) "
+            f"with singleflight against {results['cold, plain']} without"
+        ))
@@ -0,0 +1,53 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from ecommerce.bench import rollback_afterwards, seed_bench_menu, seed_orders
+from ecommerce.exports import EXPORTS, stream_export
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the streaming export against a large seeded order table (run on a scratch database)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000000, help='Orders to seed')
+        parser.add_argument('--kind', choices=list(EXPORTS), default='orders')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+        parser.add_argument('--no-gzip', action='store_true')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded rows')
+
+    def handle(self, *args, **options):
+        count = options['orders']
+        with rollback_afterwards(keep=options['keep']):
+            started = time.perf_counter()
+            menu = seed_bench_menu()
+            seed_orders(menu, count, with_items=options['kind'] != 'orders')
+            self.stdout.write(f'Seeded {count} orders in {time.perf_counter() - started:.1f}s')
+
+            chunks = stream_export(
+                options['kind'], options['format'], compress=not options['no_gzip']
+            )
+
+            # Sample traced memory after every chunk; a flat line is the point.
+            # Tracing slows Python down, so the rows/s figure is pessimistic.
+            tracemalloc.start()
+            started = time.perf_counter()
+            total_bytes = 0
+            samples = []
+            for chunk in chunks:
+                total_bytes += len(chunk)
+                samples.append(tracemalloc.get_traced_memory()[0])
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ Exported {count} {options['kind']} rows: {total_bytes / 1e6:.1f} MB in "
+            f"{elapsed:.1f}s ({count / elapsed:,.0f} rows/s)"
+        ))
+        if samples:
+            self.stdout.write(
+                f'  Traced memory: first sample {samples[0] / 1e6:.2f} MB, '
+                f'last sample {samples[-1] / 1e6:.2f} MB, peak {peak / 1e6:.2f} MB'
+            )
@@ -0,0 +1,64 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from ecommerce.bench import rollback_afterwards, seed_bench_menu
+from ecommerce.models import DailyMenuItem
+
+
+def save_style_update(menu_item_id, quantity):
+    """How a stock change used to run: read the row, recompute in Python, rewrite every column"""
+    item = DailyMenuItem.objects.get(pk=menu_item_id)
+    item.plates_ordered += quantity
+    item.total_plates_available = item.sufuria_count * item.plates_per_sufuria
+    item.plates_remaining = item.total_plates_available - item.plates_ordered
+    if item.plates_remaining <= 0:
+        item.is_available = False
+    values = {
+        field.attname: getattr(item, field.attname)
+        for field in DailyMenuItem._meta.concrete_fields if not field.primary_key
+    }
+    DailyMenuItem.objects.filter(pk=menu_item_id).update(**values)
+
+
+def increment_update(menu_item_id, quantity):
+    """A stock change now: one conditional UPDATE of plates_ordered"""
+    DailyMenuItem.objects.filter(
+        pk=menu_item_id, is_available=True, plates_remaining__gte=quantity,
+    ).update(plates_ordered=F('plates_ordered') + quantity)
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks plate stock UPDATEs: full-row save() rewrites against single-column increments'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--updates', type=int, default=20000, help='Stock changes per strategy')
+        parser.add_argument('--items', type=int, default=20, help='Menu items the changes rotate over')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded rows')
+
+    def handle(self, *args, **options):
+        count = options['updates']
+        results = {}
+        with rollback_afterwards(keep=options['keep']):
+            # Enough plates that no item sells out during the run
+            menu = seed_bench_menu(items=options['items'], plates_per_sufuria=count, sufuria_count=2)
+            item_ids = list(menu.menu_items.values_list('pk', flat=True))
+
+            for name, update in (('save() rewrite', save_style_update), ('F() increment', increment_update)):
+                started = time.perf_counter()
+                for index in range(count):
+                    update(item_ids[index % len(item_ids)], 1)
+                results[name] = time.perf_counter() - started
+
+            consistent = not DailyMenuItem.objects.filter(daily_menu=menu).exclude(
+                plates_remaining=F('total_plates_available') - F('plates_ordered')
+            ).exists()
+
+        before, after = results['save() rewrite'], results['F() increment']
+        for name, elapsed in results.items():
+            self.stdout.write(f'{name:>15}: {count} updates in {elapsed:.2f}s ({count / elapsed:,.0f} updates/s)')
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Single-column increments are {before / after:.1f}x faster'
+            + ('' if consistent else ' (but derived columns drifted!)')
+        ))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ecommerce.images import backfill_derivatives
+from ecommerce.models import FoodItem
+
+
+class Command(BaseCommand):
+    help = 'Generates resized WebP/JPEG derivatives for food item images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help='Image processes (default: CPU count)')
+        parser.add_argument('--force', action='store_true', help='Regenerate existing derivatives')
+        parser.add_argument('--missing', action='store_true', help='Only items without derivatives yet')
+
+    def handle(self, *args, **options):
+        food_items = FoodItem.objects.all()
+        if options['missing']:
+            food_items = food_items.filter(image_digest='')
+
+        started = time.monotonic()
+        processed, failures = backfill_derivatives(food_items, options['workers'], options['force'])
+        for name, error in failures:
+            self.stdout.write(self.style.WARNING(f'  {name}: {error}'))
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Built derivatives for {processed} food items in {time.monotonic() - started:.1f}s'
+        ))
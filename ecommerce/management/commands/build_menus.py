@@ -0,0 +1,64 @@
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from ecommerce.menu_builder import apply_templates, clone_menu, clone_previous_day, date_range
+from ecommerce.models import DailyMenu, MealPeriod
+
+
+class Command(BaseCommand):
+    help = 'Schedules daily menus in bulk from weekly templates or by cloning an existing menu'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--start', type=date.fromisoformat,
+            help='First date to build (YYYY-MM-DD); defaults to tomorrow'
+        )
+        parser.add_argument('--days', type=int, default=7, help='Number of days to build')
+        parser.add_argument(
+            '--meal-period', action='append', dest='meal_periods',
+            help='Meal period name to build (repeatable); defaults to all active'
+        )
+        source = parser.add_mutually_exclusive_group()
+        source.add_argument(
+            '--clone-date', type=date.fromisoformat,
+            help='Clone the menus of this date instead of applying templates'
+        )
+        source.add_argument(
+            '--clone-previous-day', action='store_true',
+            help='Clone the menus of the day before --start'
+        )
+        parser.add_argument('--publish', action='store_true', help='Publish the created menus')
+
+    def handle(self, *args, **options):
+        start = options['start'] or timezone.now().date() + timedelta(days=1)
+        dates = date_range(start, options['days'])
+
+        meal_periods = MealPeriod.objects.filter(is_active=True)
+        if options['meal_periods']:
+            meal_periods = meal_periods.filter(name__in=options['meal_periods'])
+        meal_periods = list(meal_periods)
+        if not meal_periods:
+            raise CommandError('No matching active meal periods.')
+
+        started = time.monotonic()
+        if options['clone_date']:
+            menus = []
+            sources = DailyMenu.objects.filter(
+                date=options['clone_date'], meal_period__in=meal_periods
+            ).select_related('meal_period')
+            for source_menu in sources:
+                menus += clone_menu(source_menu, dates, publish=options['publish'])
+        elif options['clone_previous_day']:
+            menus = clone_previous_day(
+                start, options['days'], meal_periods=meal_periods, publish=options['publish']
+            )
+        else:
+            menus = apply_templates(dates, meal_periods, publish=options['publish'])
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Created {len(menus)} menus for {dates[0]} to {dates[-1]} in {elapsed:.3f}s'
+        ))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ecommerce.analytics import close_due_meals
+
+
+class Command(BaseCommand):
+    help = 'Snapshots final plate utilization for meals whose serving time has ended'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', type=int, metavar='SECONDS',
+            help='Keep checking every SECONDS instead of running once'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            closed = close_due_meals()
+            self.stdout.write(self.style.SUCCESS(f'✓ Closed {closed} meals'))
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
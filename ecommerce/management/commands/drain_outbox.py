@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ecommerce.outbox import DRAIN_BATCH_SIZE, drain_all
+
+
+class Command(BaseCommand):
+    help = 'Sends pending outbox emails over one SMTP connection per batch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DRAIN_BATCH_SIZE)
+        parser.add_argument(
+            '--loop', type=int, metavar='SECONDS',
+            help='Keep draining every SECONDS instead of running once'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            result = drain_all(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f'✓ Sent {result.sent} emails, {result.retried} to retry, {result.failed} failed'
+            ))
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
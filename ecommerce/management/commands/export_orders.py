@@ -0,0 +1,48 @@
+import sys
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from ecommerce.exports import EXPORTS, EXPORT_FORMATS, stream_export
+
+
+class Command(BaseCommand):
+    help = 'Streams orders, order items or M-Pesa payments to a CSV/JSONL file (gzipped by default)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=list(EXPORTS), help='What to export')
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--start', type=date.fromisoformat, help='First menu date (YYYY-MM-DD)')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last menu date (YYYY-MM-DD)')
+        parser.add_argument('--meal-period', help='Meal period name, e.g. lunch')
+        parser.add_argument('--status', help='Order status (transaction status for payments)')
+        parser.add_argument('--no-gzip', action='store_true', help='Write uncompressed output')
+        parser.add_argument('--output', '-o', help='Output file; defaults to stdout')
+
+    def handle(self, *args, **options):
+        chunks = stream_export(
+            options['kind'],
+            options['format'],
+            compress=not options['no_gzip'],
+            start=options['start'],
+            end=options['end'],
+            meal_period=options['meal_period'],
+            status=options['status'],
+        )
+
+        started = time.monotonic()
+        written = 0
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+                    written += len(chunk)
+            elapsed = time.monotonic() - started
+            self.stderr.write(self.style.SUCCESS(
+                f"✓ Wrote {written} bytes to {options['output']} in {elapsed:.2f}s"
+            ))
+        else:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ecommerce.onboarding import import_students, read_student_csv
+
+
+class Command(BaseCommand):
+    help = 'Bulk registers students from a CSV (registration_number, first_name, last_name, email, ...)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', help='Path to the intake CSV')
+        parser.add_argument('--workers', type=int, help='Password hashing processes (default: CPU count)')
+        parser.add_argument('--no-welcome', action='store_true', help='Do not queue welcome emails')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        rows = read_student_csv(options['csv_file'])
+        result = import_students(
+            rows,
+            send_welcome=not options['no_welcome'],
+            workers=options['workers'],
+        )
+        elapsed = time.monotonic() - started
+
+        for line_number, registration_number, reason in result.invalid:
+            self.stdout.write(self.style.WARNING(f'  Line {line_number} ({registration_number}): {reason}'))
+        if result.duplicates:
+            self.stdout.write(self.style.WARNING(f'  {len(result.duplicates)} already registered, skipped'))
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Imported {result.created} of {len(rows)} students in {elapsed:.1f}s'
+        ))
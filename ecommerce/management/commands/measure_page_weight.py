@@ -0,0 +1,73 @@
+import os
+import re
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+
+ASSET_RE = re.compile(r'''(?:src|href)=["']([^"']+)["']|srcset=["']([^"']+)["']''')
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures the bytes a page and its static assets cost: as raw files '
+        '(the old DEBUG static view) and as served by WhiteNoise after collectstatic'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/', help='Page to measure (default: /)')
+
+    def static_urls(self, html):
+        urls = []
+        for src, srcset in ASSET_RE.findall(html):
+            candidates = [src] if src else [part.split()[0] for part in srcset.split(',') if part.strip()]
+            for url in candidates:
+                path = urlsplit(url).path
+                if path.startswith(settings.STATIC_URL) and path not in urls:
+                    urls.append(path)
+        return urls
+
+    def handle(self, *args, **options):
+        client = Client()
+        page = client.get(options['path'])
+        html = page.content.decode()
+        # Map hashed names in the page back to their source files
+        originals = {
+            hashed: name
+            for name, hashed in getattr(staticfiles_storage, 'hashed_files', {}).items()
+        }
+
+        before = after = repeat = 0
+        rows = []
+        for url in self.static_urls(html):
+            name = url[len(settings.STATIC_URL):]
+            source = finders.find(originals.get(name, name))
+            raw = os.path.getsize(source) if source else 0
+            response = client.get(url, HTTP_ACCEPT_ENCODING='br, gzip')
+            if response.status_code != 200 or not raw:
+                self.stdout.write(self.style.WARNING(f'  {url}: HTTP {response.status_code}'))
+                continue
+            sent = int(response['Content-Length'])
+            cached = 'immutable' in response.get('Cache-Control', '')
+            before += raw
+            after += sent
+            repeat += 0 if cached else sent
+            rows.append((name, raw, sent, response.get('Content-Encoding', '-'), cached))
+
+        width = max((len(row[0]) for row in rows), default=10)
+        self.stdout.write(f'{"asset":<{width}} {"raw":>10} {"sent":>10}  encoding  immutable')
+        for name, raw, sent, encoding, cached in rows:
+            self.stdout.write(f'{name:<{width}} {raw:>10,} {sent:>10,}  {encoding:<8}  {"yes" if cached else "no"}')
+
+        html_size = len(page.content)
+        self.stdout.write('')
+        self.stdout.write(f'HTML {options["path"]}: {html_size:,} bytes')
+        self.stdout.write(f'Static assets, raw files:        {before:>12,} bytes')
+        self.stdout.write(f'Static assets, first visit:      {after:>12,} bytes')
+        self.stdout.write(f'Static assets, repeat visit:     {repeat:>12,} bytes')
+        if after:
+            self.stdout.write(self.style.SUCCESS(f'✓ First visit transfers {before / after:.1f}x fewer static bytes'))
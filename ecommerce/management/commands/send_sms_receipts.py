@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ecommerce.sms import dispatch_sms_receipts, get_backend
+
+
+class Command(BaseCommand):
+    help = 'Sends pending SMS receipts through the configured gateway in bulk batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Recipients per gateway request (default: SMS_BATCH_SIZE)')
+        parser.add_argument('--rate', type=float, help='Gateway requests per second (default: SMS_RATE_LIMIT)')
+        parser.add_argument(
+            '--loop', type=int, metavar='SECONDS',
+            help='Keep dispatching every SECONDS instead of running once'
+        )
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        while True:
+            result = dispatch_sms_receipts(backend, options['batch_size'], options['rate'])
+            self.stdout.write(self.style.SUCCESS(
+                f'✓ Sent {result.sent} SMS in {result.requests} requests, '
+                f'{result.retried} to retry, {result.failed} failed'
+            ))
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from ecommerce.stress import run_checkout_stress
+
+
+class Command(BaseCommand):
+    help = 'Races concurrent checkouts, payment callbacks and serves for scarce plates, then checks stock invariants'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Threads per stage (checkout, callback, serve)')
+        parser.add_argument('--checkouts', type=int, default=200, help='Checkout attempts in total')
+        parser.add_argument('--items', type=int, default=3, help='Menu items competed for')
+        parser.add_argument('--plates', type=int, default=10, help='Plates per menu item')
+        parser.add_argument('--fail-rate', type=float, default=0.2, help='Share of payments that fail')
+        parser.add_argument('--duplicate-rate', type=float, default=0.3, help='Share of callbacks delivered twice')
+        parser.add_argument('--latency', type=float, default=0.0, help='Seconds the stub Daraja waits per call')
+        parser.add_argument('--seed', type=int, help='Random seed, for a repeatable run')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded menu and orders')
+
+    def handle(self, *args, **options):
+        try:
+            result = run_checkout_stress(
+                workers=options['workers'],
+                checkouts=options['checkouts'],
+                items=options['items'],
+                plates=options['plates'],
+                fail_rate=options['fail_rate'],
+                duplicate_rate=options['duplicate_rate'],
+                latency=options['latency'],
+                seed=options['seed'],
+                keep=options['keep'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(
+            f'Checkouts: {result.attempts} attempted, {result.placed} placed, {result.sold_out} sold out, '
+            f'{result.rejected} rejected, {result.errors} errors'
+        )
+        self.stdout.write(
+            f'Callbacks: {result.callbacks} delivered, {result.duplicate_callbacks} duplicates, '
+            f'{result.callback_retries} retried, {result.callback_errors} gave up'
+        )
+        self.stdout.write(
+            f'Serves: {result.served} of {result.serve_attempts} scans claimed an order, '
+            f'{result.serve_errors} errors'
+        )
+        self.stdout.write(
+            f'Throughput: {result.throughput:,.1f} orders/s over {result.checkout_seconds:.2f}s '
+            f'({result.elapsed:.2f}s in total)'
+        )
+
+        if result.violations:
+            for violation in result.violations:
+                self.stderr.write(self.style.ERROR(f'✗ {violation}'))
+            raise CommandError(f'{len(result.violations)} stock invariant(s) violated')
+        self.stdout.write(self.style.SUCCESS('✓ No oversell, no lost plates, no duplicate serves'))
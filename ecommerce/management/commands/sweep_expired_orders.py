@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from ecommerce.expiry import SWEEP_BATCH_SIZE, sweep_expired_orders
+
+
+class Command(BaseCommand):
+    help = 'Marks live orders past their expiry time as expired and releases their plates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=SWEEP_BATCH_SIZE)
+        parser.add_argument(
+            '--loop', type=int, metavar='SECONDS',
+            help='Keep sweeping every SECONDS instead of running once'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            result = sweep_expired_orders(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f'✓ Expired {result.expired} orders in {result.batches} batches, '
+                f'released {result.plates_released} plates in {result.duration:.3f}s'
+            ))
+            if not options['loop']:
+                break
+            time.sleep(options['loop'])
@@ -0,0 +1,149 @@
+"""
+Bulk menu building: cloning existing menus and applying weekly templates.
+
+Adding a DailyMenu through the admin inline saves one DailyMenuItem at a
+time. Here whole date ranges are planned in memory and written with two
+bulk_create calls, with fill_derived_fields() computing the slugs and stock
+totals up front from rows that were loaded once.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import invalidation
+from .models import DailyMenu, DailyMenuItem, MealPeriod, MenuTemplate
+
+
+def date_range(start, days):
+    """`days` consecutive dates starting at `start`"""
+    return [start + timedelta(days=offset) for offset in range(days)]
+
+
+def _menu_item_specs(menu_items):
+    """(food_item, sufuria_count, plates_per_sufuria) tuples for a menu or template"""
+    return [
+        (item.food_item, item.sufuria_count, item.plates_per_sufuria)
+        for item in menu_items
+    ]
+
+
+@transaction.atomic
+def build_menus(plan, created_by=None, publish=False, notes=None):
+    """
+    Create menus from a plan of (date, meal_period, item_specs) entries.
+
+    item_specs are (food_item, sufuria_count, plates_per_sufuria) tuples.
+    Slots that already have a menu are left untouched. Returns the list of
+    created DailyMenu objects.
+    """
+    if not plan:
+        return []
+
+    existing = set(DailyMenu.objects.filter(
+        date__in={date for date, _, _ in plan},
+        meal_period__in={meal_period.id for _, meal_period, _ in plan},
+    ).values_list('date', 'meal_period_id'))
+
+    menus = []
+    menu_specs = []
+    for date, meal_period, item_specs in plan:
+        if (date, meal_period.id) in existing:
+            continue
+        existing.add((date, meal_period.id))
+        menu = DailyMenu(
+            date=date,
+            meal_period=meal_period,
+            is_active=True,
+            is_published=publish,
+            created_by=created_by,
+            notes=notes,
+        )
+        menu.fill_derived_fields()
+        menus.append(menu)
+        menu_specs.append(item_specs)
+
+    DailyMenu.objects.bulk_create(menus)
+
+    menu_items = []
+    for menu, item_specs in zip(menus, menu_specs):
+        for food_item, sufuria_count, plates_per_sufuria in item_specs:
+            menu_item = DailyMenuItem(
+                daily_menu=menu,
+                food_item=food_item,
+                sufuria_count=sufuria_count,
+                plates_per_sufuria=plates_per_sufuria,
+            )
+            menu_item.fill_derived_fields()
+            menu_items.append(menu_item)
+    DailyMenuItem.objects.bulk_create(menu_items, batch_size=500)
+    # bulk_create sends no post_save for the cache invalidation bus
+    invalidation.publish(DailyMenu)
+
+    return menus
+
+
+def clone_menu(source_menu, dates, meal_periods=None, created_by=None, publish=False):
+    """
+    Copy a menu's items into every date x meal period combination.
+
+    Defaults to the source menu's own meal period. Returns the created menus.
+    """
+    item_specs = _menu_item_specs(source_menu.menu_items.select_related('food_item'))
+    meal_periods = meal_periods or [source_menu.meal_period]
+    plan = [
+        (date, meal_period, item_specs)
+        for date in dates
+        for meal_period in meal_periods
+    ]
+    return build_menus(plan, created_by=created_by, publish=publish, notes=source_menu.notes)
+
+
+def clone_previous_day(date=None, days=1, meal_periods=None, created_by=None, publish=False):
+    """
+    Clone the menus of the day before `date` into `days` days from `date`.
+
+    Defaults to the menus of every meal period.
+    """
+    date = date or timezone.now().date()
+    source_menus = DailyMenu.objects.filter(
+        date=date - timedelta(days=1)
+    ).select_related('meal_period').prefetch_related('menu_items__food_item')
+    if meal_periods is not None:
+        source_menus = source_menus.filter(meal_period__in=meal_periods)
+
+    plan = []
+    for source_menu in source_menus:
+        item_specs = _menu_item_specs(source_menu.menu_items.all())
+        for target in date_range(date, days):
+            plan.append((target, source_menu.meal_period, item_specs))
+    return build_menus(plan, created_by=created_by, publish=publish)
+
+
+def apply_templates(dates, meal_periods=None, templates=None, created_by=None, publish=False):
+    """
+    Schedule menus from weekly templates.
+
+    For each date and meal period the template for that weekday wins, then a
+    template with no weekday. Slots without a matching template are skipped.
+    """
+    if meal_periods is None:
+        meal_periods = list(MealPeriod.objects.filter(is_active=True))
+    if templates is None:
+        templates = MenuTemplate.objects.filter(is_active=True)
+    templates = templates.select_related('meal_period').prefetch_related('items__food_item')
+
+    by_slot = {}
+    for template in templates:
+        by_slot[(template.meal_period_id, template.weekday)] = template
+
+    plan = []
+    for date in dates:
+        for meal_period in meal_periods:
+            template = (
+                by_slot.get((meal_period.id, date.weekday()))
+                or by_slot.get((meal_period.id, None))
+            )
+            if template:
+                plan.append((date, meal_period, _menu_item_specs(template.items.all())))
+    return build_menus(plan, created_by=created_by, publish=publish)
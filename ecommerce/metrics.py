@@ -0,0 +1,262 @@
+"""
+Per-view request metrics.
+
+RequestMetricsMiddleware times every request, counts its database queries
+and their total time on every database alias, replica included (through
+execute_wrapper), and the time spent rendering templates, then files the
+numbers under the view's URL name in in-process histograms. A streaming
+response is measured until its last chunk is sent, so the queries an export
+runs while streaming count too. render_prometheus() exposes the histograms
+in the Prometheus text format for the staff-only /metrics endpoint.
+
+Render time is measured by the TimedDjangoTemplates backend, which the
+TEMPLATES setting must name for it to be recorded.
+
+A request that runs more queries than METRICS_QUERY_BUDGET is logged with
+its most repeated SQL shapes, which is usually an N+1 loop. The
+bookkeeping on the hot path is a few perf_counter() calls, list appends
+and bisects, well under 50µs per request.
+"""
+import logging
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates, Template
+
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Histograms keyed by (metric name, view name)"""
+
+    METRICS = {
+        'http_request_duration_seconds': ('Request latency by view', LATENCY_BUCKETS),
+        'db_queries_per_request': ('Database queries per request by view', QUERY_COUNT_BUCKETS),
+        'db_query_duration_seconds': ('Database time per request by view', LATENCY_BUCKETS),
+        'template_render_duration_seconds': ('Template render time per request by view', LATENCY_BUCKETS),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._responses = Counter()
+
+    def observe(self, view, status, latency, queries, db_time, render_time):
+        with self._lock:
+            histograms = self._histograms.get(view)
+            if histograms is None:
+                histograms = self._histograms[view] = [
+                    Histogram(buckets) for _, buckets in self.METRICS.values()
+                ]
+            histograms[0].observe(latency)
+            histograms[1].observe(queries)
+            histograms[2].observe(db_time)
+            histograms[3].observe(render_time)
+            self._responses[(view, status)] += 1
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._responses.clear()
+
+    def render(self):
+        """Prometheus text exposition of every histogram and response counter"""
+        with self._lock:
+            snapshot = {
+                view: [(list(h.counts), h.sum, h.count) for h in histograms]
+                for view, histograms in self._histograms.items()
+            }
+            responses = dict(self._responses)
+
+        lines = []
+        for index, (name, (help_text, buckets)) in enumerate(self.METRICS.items()):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for view in sorted(snapshot):
+                counts, total, count = snapshot[view][index]
+                label = _escape(view)
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{{view="{label}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{view="{label}",le="+Inf"}} {count}')
+                lines.append(f'{name}_sum{{view="{label}"}} {total:.6f}')
+                lines.append(f'{name}_count{{view="{label}"}} {count}')
+        lines.append('# HELP http_responses_total Responses by view and status code')
+        lines.append('# TYPE http_responses_total counter')
+        for (view, status), count in sorted(responses.items()):
+            lines.append(f'http_responses_total{{view="{_escape(view)}",status="{status}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = Registry()
+
+
+def render_prometheus():
+    return registry.render()
+
+
+# ==================== SQL FINGERPRINTS ====================
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\bIN\s*\([^)]*\)', re.IGNORECASE)
+_SPACE_RE = re.compile(r'\s+')
+_COLUMNS_RE = re.compile(r'^SELECT (DISTINCT )?.*? FROM ', re.IGNORECASE | re.DOTALL)
+
+
+def fingerprint(sql):
+    """SQL with literals collapsed, so the same query shape groups together"""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _IN_LIST_RE.sub('IN (...)', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _COLUMNS_RE.sub(r'SELECT \1... FROM ', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+def top_fingerprints(statements, limit=5):
+    return Counter(fingerprint(sql) for sql in statements).most_common(limit)
+
+
+# ==================== MIDDLEWARE ====================
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time', 'render_time', 'render_depth', 'statements')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.render_depth = 0
+        self.statements = []
+
+
+def _record_query(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_time += time.perf_counter() - started
+        stats.queries += 1
+        stats.statements.append(sql)
+
+
+class TimedTemplate(Template):
+    """A template whose renders add to the current request's render time"""
+
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None or stats.render_depth:
+            # Outside a request, or rendered from inside a timed render
+            return super().render(context, request)
+        stats.render_depth = 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.render_time += time.perf_counter() - started
+            stats.render_depth = 0
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing renders for RequestMetricsMiddleware"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+class RequestMetricsMiddleware:
+    """Record latency, query count, DB time and render time per URL name"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.query_budget = getattr(settings, 'METRICS_QUERY_BUDGET', None)
+
+    def __call__(self, request):
+        stats = RequestStats()
+        started = time.perf_counter()
+        response = _measure(stats, self.get_response, request)
+        if response.streaming:
+            response.streaming_content = self._measure_stream(
+                response.streaming_content, request, response, stats, started
+            )
+        else:
+            self._observe(request, response, stats, started)
+        return response
+
+    def _measure_stream(self, chunks, request, response, stats, started):
+        chunks = iter(chunks)
+        try:
+            while True:
+                chunk = _measure(stats, next, chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            self._observe(request, response, stats, started)
+
+    def _observe(self, request, response, stats, started):
+        latency = time.perf_counter() - started
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        registry.observe(view, response.status_code, latency, stats.queries, stats.db_time, stats.render_time)
+
+        if self.query_budget is not None and stats.queries > self.query_budget:
+            logger.warning(
+                "%s %s (%s) ran %d queries in %.1fms (budget %d). Most repeated: %s",
+                request.method, request.path, view, stats.queries, stats.db_time * 1000,
+                self.query_budget,
+                '; '.join(f'{count}x {sql}' for sql, count in top_fingerprints(stats.statements)),
+            )
+
+
+def _measure(stats, function, *args):
+    """function(*args), with its queries and renders counted into stats"""
+    token = _current.set(stats)
+    try:
+        with ExitStack() as wrappers:
+            for connection in connections.all():
+                wrappers.enter_context(connection.execute_wrapper(_record_query))
+            return function(*args)
+    finally:
+        _current.reset(token)
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:02
+
+from django.db import migrations, models
+
+
+def backfill_items_summary(apps, schema_editor):
+    Order = apps.get_model('ecommerce', 'Order')
+    OrderItem = apps.get_model('ecommerce', 'OrderItem')
+
+    names_by_order = {}
+    for order_id, name in OrderItem.objects.order_by('order_id', 'id').values_list(
+        'order_id', 'food_item__name'
+    ).iterator(chunk_size=2000):
+        names_by_order.setdefault(order_id, []).append(name)
+
+    batch = []
+    for order in Order.objects.only('id').iterator(chunk_size=2000):
+        names = names_by_order.get(order.id, [])
+        summary = ', '.join(names)
+        if len(summary) > 255:
+            summary = summary[:252] + '...'
+        order.items_summary = summary
+        order.item_count = len(names)
+        batch.append(order)
+        if len(batch) >= 500:
+            Order.objects.bulk_update(batch, ['items_summary', 'item_count'])
+            batch = []
+    if batch:
+        Order.objects.bulk_update(batch, ['items_summary', 'item_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='items_summary',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.RunPython(backfill_items_summary, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-ordered_at', '-id'], name='order_user_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:03
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ecommerce', '0002_order_items_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('order_code', models.CharField(max_length=12, unique=True)),
+                ('guest_registration_number', models.CharField(blank=True, max_length=20)),
+                ('guest_name', models.CharField(blank=True, max_length=200)),
+                ('guest_phone', models.CharField(blank=True, max_length=15)),
+                ('menu_date', models.DateField()),
+                ('total_amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending Payment'), ('paid', 'Paid'), ('confirmed', 'Confirmed'), ('ready', 'Ready for Pickup'), ('served', 'Served'), ('expired', 'Expired'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('items_summary', models.CharField(blank=True, max_length=255)),
+                ('item_count', models.PositiveSmallIntegerField(default=0)),
+                ('mpesa_transaction_id', models.CharField(blank=True, max_length=50, null=True)),
+                ('mpesa_receipt_number', models.CharField(blank=True, max_length=50, null=True)),
+                ('mpesa_phone_number', models.CharField(blank=True, max_length=15)),
+                ('payment_date', models.DateTimeField(blank=True, null=True)),
+                ('receipt_type', models.CharField(blank=True, max_length=10)),
+                ('receipt_sent', models.BooleanField(default=False)),
+                ('ordered_at', models.DateTimeField()),
+                ('confirmed_at', models.DateTimeField(blank=True, null=True)),
+                ('served_at', models.DateTimeField(blank=True, null=True)),
+                ('expires_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('daily_menu', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_orders', to='ecommerce.dailymenu')),
+                ('student_profile', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_orders', to='ecommerce.studentprofile')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_orders', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-ordered_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderItem',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('food_item_name', models.CharField(max_length=100)),
+                ('quantity', models.IntegerField(default=1)),
+                ('price_per_plate', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('subtotal', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField()),
+                ('food_item', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_order_items', to='ecommerce.fooditem')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='ecommerce.archivedorder')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedMPesaTransaction',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('merchant_request_id', models.CharField(max_length=100)),
+                ('checkout_request_id', models.CharField(max_length=100, unique=True)),
+                ('phone_number', models.CharField(max_length=15)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('status', models.CharField(choices=[('initiated', 'Initiated'), ('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('mpesa_receipt_number', models.CharField(blank=True, max_length=50, null=True)),
+                ('transaction_date', models.DateTimeField(blank=True, null=True)),
+                ('result_code', models.CharField(blank=True, max_length=10, null=True)),
+                ('result_desc', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField()),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mpesa_transactions', to='ecommerce.archivedorder')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['user', '-ordered_at', '-id'], name='archorder_user_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['menu_date', 'status'], name='archorder_date_status_idx'),
+        ),
+    ]
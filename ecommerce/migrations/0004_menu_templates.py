@@ -0,0 +1,46 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:07
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0003_order_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MenuTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('slug', models.SlugField(blank=True, max_length=120, unique=True)),
+                ('weekday', models.PositiveSmallIntegerField(blank=True, choices=[(0, 'Monday'), (1, 'Tuesday'), (2, 'Wednesday'), (3, 'Thursday'), (4, 'Friday'), (5, 'Saturday'), (6, 'Sunday')], help_text='Day of the weekly rotation this template covers; blank means any day', null=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('notes', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('meal_period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='menu_templates', to='ecommerce.mealperiod')),
+            ],
+            options={
+                'ordering': ['meal_period__start_time', 'weekday', 'name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='MenuTemplateItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sufuria_count', models.IntegerField(help_text='Number of sufurias cooked', validators=[django.core.validators.MinValueValidator(1)])),
+                ('plates_per_sufuria', models.IntegerField(help_text='Estimated plates per sufuria', validators=[django.core.validators.MinValueValidator(1)])),
+                ('food_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='template_appearances', to='ecommerce.fooditem')),
+                ('template', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='ecommerce.menutemplate')),
+            ],
+            options={
+                'ordering': ['food_item__display_order', 'food_item__name'],
+                'unique_together': {('template', 'food_item')},
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0004_menu_templates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'paid', 'confirmed'])), fields=['expires_at'], name='order_live_expiry_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0006_outbox_email'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderreceipt',
+            name='sms_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='orderreceipt',
+            name='sms_error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='orderreceipt',
+            name='sms_message_id',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='orderreceipt',
+            name='sms_next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='orderreceipt',
+            name='sms_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')], max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='orderreceipt',
+            index=models.Index(condition=models.Q(('sms_status', 'pending')), fields=['sms_next_attempt_at'], name='receipt_sms_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0007_receipt_sms'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fooditem',
+            name='image_digest',
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+        migrations.AddField(
+            model_name='fooditem',
+            name='image_widths',
+            field=models.CharField(blank=True, editable=False, max_length=50),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0008_food_item_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('plates_sold', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('plates_cancelled', models.IntegerField(default=0)),
+                ('plates_served', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('food_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='ecommerce.fooditem')),
+                ('meal_period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_rollups', to='ecommerce.mealperiod')),
+            ],
+            options={
+                'verbose_name_plural': 'Daily Sales Rollups',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailysalesrollup',
+            constraint=models.UniqueConstraint(fields=('date', 'meal_period', 'food_item'), name='unique_sales_rollup'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:28
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0009_daily_sales_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailymenu',
+            name='closed_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='When end-of-meal utilization was snapshotted', null=True),
+        ),
+        migrations.CreateModel(
+            name='MealCloseSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('plates_available', models.IntegerField()),
+                ('plates_ordered', models.IntegerField()),
+                ('plates_served', models.IntegerField()),
+                ('sold_out_at', models.DateTimeField(blank=True, null=True)),
+                ('sold_out_minutes', models.IntegerField(blank=True, help_text='Minutes after ordering opened', null=True)),
+                ('closed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('daily_menu_item', models.OneToOneField(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='close_snapshot', to='ecommerce.dailymenuitem')),
+                ('food_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='close_snapshots', to='ecommerce.fooditem')),
+                ('meal_period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='close_snapshots', to='ecommerce.mealperiod')),
+            ],
+            options={
+                'verbose_name_plural': 'Meal Close Snapshots',
+                'ordering': ['-date'],
+                'indexes': [models.Index(fields=['date'], name='closesnap_date_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:46
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('ecommerce', '0010_meal_close_snapshots'),
+    ]
+
+    operations = [
+        # Build the new indexes before dropping the ones they make redundant
+        migrations.AddIndex(
+            model_name='dailymenuitem',
+            index=models.Index(condition=models.Q(('is_available', True), ('plates_remaining__gt', 0)), fields=['daily_menu'], name='menuitem_in_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mpesatransaction',
+            index=models.Index(fields=['status', 'created_at'], name='mpesa_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['daily_menu', 'status'], name='order_menu_status_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='mpesatransaction',
+            name='ecommerce_m_checkou_63f84e_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='mpesatransaction',
+            name='ecommerce_m_merchan_3b1e77_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='order',
+            name='ecommerce_o_order_c_61258e_idx',
+        ),
+        migrations.AlterField(
+            model_name='dailymenuitem',
+            name='daily_menu',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='menu_items', to='ecommerce.dailymenu'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='daily_menu',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='orders', to='ecommerce.dailymenu'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='order_code',
+            field=models.CharField(editable=False, max_length=12, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='user',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='orders', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='order',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='items', to='ecommerce.order'),
+        ),
+    ]
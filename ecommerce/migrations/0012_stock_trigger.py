@@ -0,0 +1,117 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:52
+
+import django.core.validators
+from django.db import migrations, models
+
+
+# Postgres: derive the columns in the row before it is written
+POSTGRES_TRIGGER = """
+CREATE OR REPLACE FUNCTION ecommerce_dailymenuitem_stock() RETURNS trigger AS $$
+BEGIN
+    NEW.total_plates_available := NEW.sufuria_count * NEW.plates_per_sufuria;
+    NEW.plates_remaining := NEW.total_plates_available - NEW.plates_ordered;
+    IF NEW.plates_remaining <= 0 THEN
+        NEW.is_available := FALSE;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS ecommerce_dailymenuitem_stock ON ecommerce_dailymenuitem;
+CREATE TRIGGER ecommerce_dailymenuitem_stock
+    BEFORE INSERT OR UPDATE ON ecommerce_dailymenuitem
+    FOR EACH ROW EXECUTE FUNCTION ecommerce_dailymenuitem_stock();
+"""
+
+POSTGRES_DROP = """
+DROP TRIGGER IF EXISTS ecommerce_dailymenuitem_stock ON ecommerce_dailymenuitem;
+DROP FUNCTION IF EXISTS ecommerce_dailymenuitem_stock();
+"""
+
+# SQLite triggers cannot assign NEW, so they rewrite the row afterwards (the
+# CHECK constraint still applies to that write). Django rebuilds SQLite
+# tables for most schema changes, which drops triggers: a later migration
+# that alters this table must run these statements again.
+SQLITE_DERIVE = """
+    UPDATE ecommerce_dailymenuitem SET
+        total_plates_available = NEW.sufuria_count * NEW.plates_per_sufuria,
+        plates_remaining = NEW.sufuria_count * NEW.plates_per_sufuria - NEW.plates_ordered,
+        is_available = CASE
+            WHEN NEW.sufuria_count * NEW.plates_per_sufuria - NEW.plates_ordered <= 0 THEN 0
+            ELSE NEW.is_available
+        END
+    WHERE id = NEW.id;
+"""
+
+SQLITE_TRIGGERS = [
+    f"CREATE TRIGGER IF NOT EXISTS ecommerce_dailymenuitem_stock_insert "
+    f"AFTER INSERT ON ecommerce_dailymenuitem BEGIN {SQLITE_DERIVE} END",
+    f"CREATE TRIGGER IF NOT EXISTS ecommerce_dailymenuitem_stock_update "
+    f"AFTER UPDATE ON ecommerce_dailymenuitem BEGIN {SQLITE_DERIVE} END",
+]
+
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS ecommerce_dailymenuitem_stock_insert",
+    "DROP TRIGGER IF EXISTS ecommerce_dailymenuitem_stock_update",
+]
+
+# Rows oversold before reservations became atomic would fail the CHECK
+# constraint; cap them at what was cooked (closed meals keep the real
+# figures in their MealCloseSnapshot)
+BACKFILL = [
+    """
+    UPDATE ecommerce_dailymenuitem
+    SET plates_ordered = sufuria_count * plates_per_sufuria
+    WHERE plates_ordered > sufuria_count * plates_per_sufuria
+    """,
+    """
+    UPDATE ecommerce_dailymenuitem SET
+        total_plates_available = sufuria_count * plates_per_sufuria,
+        plates_remaining = sufuria_count * plates_per_sufuria - plates_ordered
+    """,
+]
+
+
+def create_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(POSTGRES_TRIGGER)
+    elif schema_editor.connection.vendor == 'sqlite':
+        for statement in SQLITE_TRIGGERS:
+            schema_editor.execute(statement)
+    else:
+        raise NotImplementedError(f'No stock trigger for {schema_editor.connection.vendor}')
+
+
+def drop_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(POSTGRES_DROP)
+    elif schema_editor.connection.vendor == 'sqlite':
+        for statement in SQLITE_DROP:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0011_index_plan'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dailymenuitem',
+            name='plates_remaining',
+            field=models.IntegerField(default=0, editable=False, validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.AlterField(
+            model_name='dailymenuitem',
+            name='total_plates_available',
+            field=models.IntegerField(default=0, editable=False, validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name='dailymenuitem',
+            constraint=models.CheckConstraint(check=models.Q(('plates_remaining__gte', 0)), name='menuitem_plates_remaining_gte_0'),
+        ),
+        # After the constraint, which rebuilds the table on SQLite
+        migrations.RunPython(create_trigger, drop_trigger),
+    ]
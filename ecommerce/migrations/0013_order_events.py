@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-19 05:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0012_stock_trigger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_code', models.CharField(max_length=12)),
+                ('from_status', models.CharField(choices=[('pending', 'Pending Payment'), ('paid', 'Paid'), ('confirmed', 'Confirmed'), ('ready', 'Ready for Pickup'), ('served', 'Served'), ('expired', 'Expired'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('to_status', models.CharField(choices=[('pending', 'Pending Payment'), ('paid', 'Paid'), ('confirmed', 'Confirmed'), ('ready', 'Ready for Pickup'), ('served', 'Served'), ('expired', 'Expired'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='ecommerce.order')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
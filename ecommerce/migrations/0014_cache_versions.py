@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-19 05:08
+
+from django.db import migrations, models
+
+
+# invalidation.INVALIDATING_MODELS when this migration was written
+TOPICS = [
+    'ecommerce.category', 'ecommerce.subcategory', 'ecommerce.fooditem',
+    'ecommerce.mealperiod', 'ecommerce.dailymenu', 'ecommerce.systemsettings',
+]
+
+
+def seed_versions(apps, schema_editor):
+    CacheVersion = apps.get_model('ecommerce', 'CacheVersion')
+    CacheVersion.objects.bulk_create([CacheVersion(topic=topic) for topic in TOPICS], ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0013_order_events'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheVersion',
+            fields=[
+                ('topic', models.CharField(help_text='Model label, e.g. ecommerce.mealperiod', max_length=100, primary_key=True, serialize=False)),
+                ('version', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(seed_versions, migrations.RunPython.noop),
+    ]
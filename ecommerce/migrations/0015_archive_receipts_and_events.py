@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-19 05:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0014_cache_versions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorder',
+            name='receipt_email',
+            field=models.EmailField(blank=True, max_length=254),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='receipt_phone',
+            field=models.CharField(blank=True, max_length=15),
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderEvent',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('order_code', models.CharField(max_length=12)),
+                ('from_status', models.CharField(choices=[('pending', 'Pending Payment'), ('paid', 'Paid'), ('confirmed', 'Confirmed'), ('ready', 'Ready for Pickup'), ('served', 'Served'), ('expired', 'Expired'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('to_status', models.CharField(choices=[('pending', 'Pending Payment'), ('paid', 'Paid'), ('confirmed', 'Confirmed'), ('ready', 'Ready for Pickup'), ('served', 'Served'), ('expired', 'Expired'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('created_at', models.DateTimeField()),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='ecommerce.archivedorder')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,103 @@
+from importlib import import_module
+
+from django.db import migrations, models
+
+
+PREVIOUS = import_module('ecommerce.migrations.0012_stock_trigger')
+
+# Postgres: derive the columns in the row before it is written. The
+# sold-out switch is undone once plates come back, but only if this
+# trigger threw it: a manual switch-off leaves auto_disabled false.
+POSTGRES_TRIGGER = """
+CREATE OR REPLACE FUNCTION ecommerce_dailymenuitem_stock() RETURNS trigger AS $$
+BEGIN
+    NEW.total_plates_available := NEW.sufuria_count * NEW.plates_per_sufuria;
+    NEW.plates_remaining := NEW.total_plates_available - NEW.plates_ordered;
+    IF NEW.plates_remaining <= 0 THEN
+        NEW.auto_disabled := NEW.auto_disabled OR NEW.is_available;
+        NEW.is_available := FALSE;
+    ELSIF NEW.auto_disabled THEN
+        NEW.is_available := TRUE;
+        NEW.auto_disabled := FALSE;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS ecommerce_dailymenuitem_stock ON ecommerce_dailymenuitem;
+CREATE TRIGGER ecommerce_dailymenuitem_stock
+    BEFORE INSERT OR UPDATE ON ecommerce_dailymenuitem
+    FOR EACH ROW EXECUTE FUNCTION ecommerce_dailymenuitem_stock();
+"""
+
+# SQLite: the same rules in an AFTER trigger rewriting the row (see 0012).
+# A later migration that rebuilds this table drops these triggers and must
+# run these statements again.
+SQLITE_REMAINING = "NEW.sufuria_count * NEW.plates_per_sufuria - NEW.plates_ordered"
+SQLITE_DERIVE = f"""
+    UPDATE ecommerce_dailymenuitem SET
+        total_plates_available = NEW.sufuria_count * NEW.plates_per_sufuria,
+        plates_remaining = {SQLITE_REMAINING},
+        is_available = CASE
+            WHEN {SQLITE_REMAINING} <= 0 THEN 0
+            WHEN NEW.auto_disabled THEN 1
+            ELSE NEW.is_available
+        END,
+        auto_disabled = CASE
+            WHEN {SQLITE_REMAINING} <= 0 THEN NEW.auto_disabled OR NEW.is_available
+            ELSE 0
+        END
+    WHERE id = NEW.id;
+"""
+
+SQLITE_TRIGGERS = [
+    f"CREATE TRIGGER IF NOT EXISTS ecommerce_dailymenuitem_stock_insert "
+    f"AFTER INSERT ON ecommerce_dailymenuitem BEGIN {SQLITE_DERIVE} END",
+    f"CREATE TRIGGER IF NOT EXISTS ecommerce_dailymenuitem_stock_update "
+    f"AFTER UPDATE ON ecommerce_dailymenuitem BEGIN {SQLITE_DERIVE} END",
+]
+
+# Sold-out rows switched off before this migration can't be told apart from
+# manual switch-offs; treat them as sold out so released plates reopen them
+BACKFILL = """
+    UPDATE ecommerce_dailymenuitem
+    SET auto_disabled = TRUE
+    WHERE is_available = FALSE AND plates_remaining <= 0
+"""
+
+
+def install(schema_editor, postgres_trigger, sqlite_triggers):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(postgres_trigger)
+    elif vendor == 'sqlite':
+        for statement in PREVIOUS.SQLITE_DROP + sqlite_triggers:
+            schema_editor.execute(statement)
+    else:
+        raise NotImplementedError(f'No stock trigger for {vendor}')
+
+
+def create_trigger(apps, schema_editor):
+    install(schema_editor, POSTGRES_TRIGGER, SQLITE_TRIGGERS)
+
+
+def restore_trigger(apps, schema_editor):
+    install(schema_editor, PREVIOUS.POSTGRES_TRIGGER, PREVIOUS.SQLITE_TRIGGERS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ecommerce', '0015_archive_receipts_and_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailymenuitem',
+            name='auto_disabled',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunSQL(BACKFILL, migrations.RunSQL.noop),
+        # Unapplied first: the column can't be dropped while a trigger reads it
+        migrations.RunPython(create_trigger, restore_trigger),
+    ]
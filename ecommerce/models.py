@@ -1,12 +1,31 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.utils.text import slugify
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, RegexValidator
 import uuid
 from datetime import datetime, time, timedelta
 
 
+def _related_value(instance, field_name, attr):
+    """
+    `attr` of a related object the caller already assigned or loaded, else
+    of the row the foreign key points at, read with one values_list query.
+
+    Slugs are derived through this so save() never lazy loads a whole
+    relation, and fill_derived_fields() gives bulk_create() rows the same
+    values; assign the related objects when filling many rows.
+    """
+    field = instance._meta.get_field(field_name)
+    related = field.get_cached_value(instance, None)
+    if related is not None:
+        return getattr(related, attr)
+    return field.related_model._base_manager.values_list(attr, flat=True).get(
+        pk=getattr(instance, field.attname)
+    )
+
+
 class Category(models.Model):
     """Food categories like Main Dishes, Side Dishes, Beverages"""
     name = models.CharField(max_length=100, unique=True)
@@ -47,10 +66,13 @@ class SubCategory(models.Model):
         ordering = ['display_order', 'name']
         unique_together = ['category', 'name']
 
-    def save(self, *args, **kwargs):
+    def fill_derived_fields(self):
+        """Set the slug; called by save() and before bulk_create()"""
         if not self.slug:
-            base_slug = slugify(f"{self.category.name}-{self.name}")
-            self.slug = base_slug
+            self.slug = slugify(f"{_related_value(self, 'category', 'name')}-{self.name}")
+
+    def save(self, *args, **kwargs):
+        self.fill_derived_fields()
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -112,6 +134,9 @@ class FoodItem(models.Model):
     description = models.TextField(blank=True, null=True)
     price_per_plate = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
     image = models.ImageField(upload_to='food_items/', blank=True, null=True)
+    # Set by ecommerce.images once resized derivatives of `image` exist
+    image_digest = models.CharField(max_length=40, blank=True, editable=False)
+    image_widths = models.CharField(max_length=50, blank=True, editable=False)
     is_active = models.BooleanField(default=True)
     is_available = models.BooleanField(default=True, help_text="Currently available for ordering")
     display_order = models.IntegerField(default=0)
@@ -122,10 +147,23 @@ class FoodItem(models.Model):
         ordering = ['display_order', 'name']
         unique_together = ['category', 'name']
 
-    def save(self, *args, **kwargs):
+    def fill_derived_fields(self):
+        """Set the slug; called by save() and before bulk_create()"""
         if not self.slug:
-            self.slug = slugify(f"{self.category.slug}-{self.name}")
+            self.slug = slugify(f"{_related_value(self, 'category', 'slug')}-{self.name}")
+
+    def save(self, *args, **kwargs):
+        self.fill_derived_fields()
+        # A new upload invalidates the derivatives until they are regenerated
+        image_changed = bool(self.image) and not self.image._committed
+        if image_changed or not self.image:
+            self.image_digest = ''
+            self.image_widths = ''
         super().save(*args, **kwargs)
+        if image_changed:
+            from .images import schedule_food_item_image
+            pk, name = self.pk, self.image.name
+            transaction.on_commit(lambda: schedule_food_item_image(pk, name))
 
     def __str__(self):
         return f"{self.name} - KES {self.price_per_plate}"
@@ -142,15 +180,20 @@ class DailyMenu(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     notes = models.TextField(blank=True, null=True, help_text="Special notes for this menu")
+    closed_at = models.DateTimeField(null=True, blank=True, editable=False, help_text="When end-of-meal utilization was snapshotted")
 
     class Meta:
         ordering = ['-date', 'meal_period__start_time']
         unique_together = ['date', 'meal_period']
         verbose_name_plural = "Daily Menus"
 
-    def save(self, *args, **kwargs):
+    def fill_derived_fields(self):
+        """Set the slug; called by save() and before bulk_create()"""
         if not self.slug:
-            self.slug = slugify(f"{self.date}-{self.meal_period.name}")
+            self.slug = slugify(f"{self.date}-{_related_value(self, 'meal_period', 'name')}")
+
+    def save(self, *args, **kwargs):
+        self.fill_derived_fields()
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -180,35 +223,79 @@ class DailyMenu(models.Model):
 
 class DailyMenuItem(models.Model):
     """Food items available in a daily menu with quantities"""
-    daily_menu = models.ForeignKey(DailyMenu, on_delete=models.CASCADE, related_name='menu_items')
+    # Served by the (daily_menu, food_item) unique index
+    daily_menu = models.ForeignKey(DailyMenu, on_delete=models.CASCADE, related_name='menu_items', db_index=False)
     food_item = models.ForeignKey(FoodItem, on_delete=models.CASCADE, related_name='daily_appearances')
     sufuria_count = models.IntegerField(validators=[MinValueValidator(1)], help_text="Number of sufurias cooked")
     plates_per_sufuria = models.IntegerField(validators=[MinValueValidator(1)], help_text="Estimated plates per sufuria")
-    total_plates_available = models.IntegerField(validators=[MinValueValidator(0)], editable=False)
+    # total_plates_available, plates_remaining and the sold-out switch of
+    # is_available are maintained by a database trigger (migration 0016), so
+    # a stock change is a single UPDATE of plates_ordered (see stock.py)
+    total_plates_available = models.IntegerField(default=0, validators=[MinValueValidator(0)], editable=False)
     plates_ordered = models.IntegerField(default=0, validators=[MinValueValidator(0)])
-    plates_remaining = models.IntegerField(validators=[MinValueValidator(0)], editable=False)
+    plates_remaining = models.IntegerField(default=0, validators=[MinValueValidator(0)], editable=False)
     is_available = models.BooleanField(default=True)
+    # Set when the trigger switched is_available off at zero plates, so it is
+    # switched back on when plates are released; a manual switch-off stays off
+    auto_disabled = models.BooleanField(default=False, editable=False)
     slug = models.SlugField(max_length=200, unique=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Written only by stock.py and the trigger, never by save()
+    STOCK_FIELDS = ('total_plates_available', 'plates_ordered', 'plates_remaining', 'auto_disabled')
+
     class Meta:
         ordering = ['food_item__display_order', 'food_item__name']
         unique_together = ['daily_menu', 'food_item']
+        indexes = [
+            # The orderable items of a menu; sold out rows drop out of it
+            models.Index(
+                fields=['daily_menu'],
+                name='menuitem_in_stock_idx',
+                condition=models.Q(is_available=True, plates_remaining__gt=0),
+            ),
+        ]
+        constraints = [
+            models.CheckConstraint(check=models.Q(plates_remaining__gte=0), name='menuitem_plates_remaining_gte_0'),
+        ]
+
+    def clean(self):
+        if self.sufuria_count and self.plates_per_sufuria and self.plates_ordered:
+            if self.sufuria_count * self.plates_per_sufuria < self.plates_ordered:
+                raise ValidationError(
+                    f"{self.plates_ordered} plates are already ordered; cook at least that many."
+                )
+
+    def fill_derived_fields(self):
+        """Set the slug and, for a new row, the stock columns the trigger will write"""
+        if not self.slug:
+            self.slug = slugify(
+                f"{_related_value(self, 'daily_menu', 'slug')}-{_related_value(self, 'food_item', 'slug')}"
+            )
+        if self._state.adding:
+            self.total_plates_available = self.sufuria_count * self.plates_per_sufuria
+            self.plates_remaining = self.total_plates_available - self.plates_ordered
+            if self.plates_remaining <= 0 and self.is_available:
+                self.is_available = False
+                self.auto_disabled = True
 
     def save(self, *args, **kwargs):
-        # Calculate total plates
-        self.total_plates_available = self.sufuria_count * self.plates_per_sufuria
-        self.plates_remaining = self.total_plates_available - self.plates_ordered
+        adding = self._state.adding
+        self.fill_derived_fields()
         
-        # Auto-disable if no plates remaining
-        if self.plates_remaining <= 0:
-            self.is_available = False
-        
-        if not self.slug:
-            self.slug = slugify(f"{self.daily_menu.slug}-{self.food_item.slug}")
+        # An edit must not write back a plates_ordered read before the last checkout
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.STOCK_FIELDS
+            ]
         
         super().save(*args, **kwargs)
+        # A new row already holds what the trigger wrote; an edit picks up
+        # reservations made since this instance was read
+        if not adding:
+            self.refresh_from_db(fields=[*self.STOCK_FIELDS, 'is_available'])
 
     def __str__(self):
         return f"{self.daily_menu} - {self.food_item.name} ({self.plates_remaining} remaining)"
@@ -218,6 +305,57 @@ class DailyMenuItem(models.Model):
         return self.is_available and self.plates_remaining >= quantity
 
 
+class MenuTemplate(models.Model):
+    """Reusable menu for a meal period, optionally tied to a weekday rotation"""
+    WEEKDAYS = [
+        (0, 'Monday'),
+        (1, 'Tuesday'),
+        (2, 'Wednesday'),
+        (3, 'Thursday'),
+        (4, 'Friday'),
+        (5, 'Saturday'),
+        (6, 'Sunday'),
+    ]
+
+    name = models.CharField(max_length=100, unique=True)
+    slug = models.SlugField(max_length=120, unique=True, blank=True)
+    meal_period = models.ForeignKey(MealPeriod, on_delete=models.CASCADE, related_name='menu_templates')
+    weekday = models.PositiveSmallIntegerField(
+        choices=WEEKDAYS, null=True, blank=True,
+        help_text="Day of the weekly rotation this template covers; blank means any day"
+    )
+    is_active = models.BooleanField(default=True)
+    notes = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['meal_period__start_time', 'weekday', 'name']
+
+    def save(self, *args, **kwargs):
+        if not self.slug:
+            self.slug = slugify(self.name)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.name
+
+
+class MenuTemplateItem(models.Model):
+    """Food item and quantities cooked for a menu template"""
+    template = models.ForeignKey(MenuTemplate, on_delete=models.CASCADE, related_name='items')
+    food_item = models.ForeignKey(FoodItem, on_delete=models.CASCADE, related_name='template_appearances')
+    sufuria_count = models.IntegerField(validators=[MinValueValidator(1)], help_text="Number of sufurias cooked")
+    plates_per_sufuria = models.IntegerField(validators=[MinValueValidator(1)], help_text="Estimated plates per sufuria")
+
+    class Meta:
+        ordering = ['food_item__display_order', 'food_item__name']
+        unique_together = ['template', 'food_item']
+
+    def __str__(self):
+        return f"{self.template} - {self.food_item.name}"
+
+
 class StudentProfile(models.Model):
     """Student profile with registration number"""
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='student_profile')
@@ -263,12 +401,14 @@ class Order(models.Model):
         ('expired', 'Expired'),
         ('cancelled', 'Cancelled'),
     ]
+    # Statuses that still hold plates and can run past expires_at
+    LIVE_STATUSES = ['pending', 'paid', 'confirmed']
 
-    order_code = models.CharField(max_length=12, unique=True, editable=False, db_index=True)
+    order_code = models.CharField(max_length=12, unique=True, editable=False)
     slug = models.SlugField(max_length=50, unique=True, blank=True)
     
-    # Student info (can be null if guest order)
-    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='orders')
+    # Student info (can be null if guest order); user lookups use order_user_keyset_idx
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='orders', db_index=False)
     student_profile = models.ForeignKey(StudentProfile, on_delete=models.SET_NULL, null=True, blank=True, related_name='orders')
     
     # Guest student info (if not registered)
@@ -276,11 +416,17 @@ class Order(models.Model):
     guest_name = models.CharField(max_length=200, blank=True)
     guest_phone = models.CharField(max_length=15, blank=True)
     
-    daily_menu = models.ForeignKey(DailyMenu, on_delete=models.CASCADE, related_name='orders')
+    # Served by order_menu_status_idx
+    daily_menu = models.ForeignKey(DailyMenu, on_delete=models.CASCADE, related_name='orders', db_index=False)
     
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
     status = models.CharField(max_length=20, choices=ORDER_STATUS, default='pending')
     
+    # Denormalized item summary, written once at placement so order lists
+    # can render without touching OrderItem
+    items_summary = models.CharField(max_length=255, blank=True)
+    item_count = models.PositiveSmallIntegerField(default=0)
+    
     # M-Pesa Integration
     mpesa_transaction_id = models.CharField(max_length=50, blank=True, null=True)
     mpesa_receipt_number = models.CharField(max_length=50, blank=True, null=True)
@@ -301,12 +447,19 @@ class Order(models.Model):
     class Meta:
         ordering = ['-ordered_at']
         indexes = [
-            models.Index(fields=['order_code']),
             models.Index(fields=['status', 'daily_menu']),
+            models.Index(fields=['daily_menu', 'status'], name='order_menu_status_idx'),
             models.Index(fields=['guest_registration_number']),
+            models.Index(fields=['user', '-ordered_at', '-id'], name='order_user_keyset_idx'),
+            models.Index(
+                fields=['expires_at'],
+                name='order_live_expiry_idx',
+                condition=models.Q(status__in=['pending', 'paid', 'confirmed']),
+            ),
         ]
 
-    def save(self, *args, **kwargs):
+    def fill_derived_fields(self):
+        """Set the order code, slug and expiry; called by save() and before bulk_create()"""
         if not self.order_code:
             self.order_code = self.generate_order_code()
         
@@ -315,18 +468,64 @@ class Order(models.Model):
         
         # Set expiration time based on meal period serving end time
         if not self.expires_at:
-            meal_end_time = datetime.combine(
-                self.daily_menu.date,
-                self.daily_menu.meal_period.serving_end_time
-            )
-            self.expires_at = timezone.make_aware(meal_end_time)
+            daily_menu = self._meta.get_field('daily_menu').get_cached_value(self, None)
+            if daily_menu is not None and daily_menu._meta.get_field('meal_period').is_cached(daily_menu):
+                date, serving_end_time = daily_menu.date, daily_menu.meal_period.serving_end_time
+            else:
+                # One query for both, rather than lazy loading the menu and then its period
+                date, serving_end_time = DailyMenu.objects.values_list(
+                    'date', 'meal_period__serving_end_time'
+                ).get(pk=self.daily_menu_id)
+            self.expires_at = timezone.make_aware(datetime.combine(date, serving_end_time))
+
+    def save(self, *args, **kwargs):
+        self.fill_derived_fields()
         
-        super().save(*args, **kwargs)
+        if not hasattr(self, '_loaded_status') and self.pk is not None:
+            # Loaded without its status (.only(), .defer()) or built with the
+            # pk of a stored order: compare with the stored row instead
+            stored = Order.objects.filter(pk=self.pk).values_list('status', 'payment_date').first()
+            if stored is not None:
+                self._loaded_status, self._loaded_payment_date = stored
+        
+        # Status changes move the order's plates between sales rollup columns
+        # and append to the order change feed
+        old_status = getattr(self, '_loaded_status', None)
+        if old_status is None or old_status == self.status:
+            super().save(*args, **kwargs)
+        else:
+            # Scored with the payment state the old status had
+            was_paid = getattr(self, '_loaded_payment_date', self.payment_date) is not None
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                from .events import record_order_event
+                from .rollups import record_status_change
+                record_status_change(self, old_status, self.status, was_paid)
+                record_order_event(self, old_status, self.status)
+        self._loaded_status = self.status
+        self._loaded_payment_date = self.payment_date
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'status' in field_names:
+            instance._loaded_status = values[field_names.index('status')]
+        if 'payment_date' in field_names:
+            instance._loaded_payment_date = values[field_names.index('payment_date')]
+        return instance
 
     def __str__(self):
         student_id = self.get_student_identifier()
         return f"Order {self.order_code} - {student_id} - {self.status}"
 
+    @staticmethod
+    def summarize_items(names):
+        """Build the compact items summary stored on the order"""
+        summary = ', '.join(names)
+        if len(summary) > 255:
+            summary = summary[:252] + '...'
+        return summary
+
     @staticmethod
     def generate_order_code():
         """Generate unique 12-character order code"""
@@ -340,6 +539,12 @@ class Order(models.Model):
 
     def is_expired(self):
         """Check if order has expired"""
+        if self.status == 'expired':
+            return True
+        if self.status == 'pending' and self.ordered_at:
+            from .system_settings import get_setting
+            if timezone.now() > self.ordered_at + get_setting('order_expiry_hours'):
+                return True
         return timezone.now() > self.expires_at and self.status not in ['served', 'cancelled']
 
     def can_be_served(self):
@@ -349,16 +554,37 @@ class Order(models.Model):
         return self.status == 'confirmed' and self.daily_menu.meal_period.is_serving_time()
 
     def mark_as_served(self, served_by_user):
-        """Mark order as served"""
-        self.status = 'served'
-        self.served_at = timezone.now()
+        """
+        Mark a confirmed order as served; False if it no longer was confirmed.
+
+        The status flips in a conditional UPDATE, so two attendants scanning
+        the same code at once serve it exactly once.
+        """
+        from .events import record_order_event
+        from .rollups import record_status_change
+        now = timezone.now()
+        with transaction.atomic():
+            claimed = Order.objects.filter(pk=self.pk, status='confirmed').update(
+                status='served',
+                served_at=now,
+                served_by=served_by_user,
+                updated_at=now,
+            )
+            if claimed:
+                record_status_change(self, 'confirmed', 'served')
+                record_order_event(self, 'confirmed', 'served')
+        if not claimed:
+            return False
+        self.status = self._loaded_status = 'served'
+        self.served_at = now
         self.served_by = served_by_user
-        self.save()
+        return True
 
 
 class OrderItem(models.Model):
     """Individual items in an order (limited to 1 per food item)"""
-    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
+    # Served by the (order, food_item) unique index
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items', db_index=False)
     daily_menu_item = models.ForeignKey(DailyMenuItem, on_delete=models.CASCADE, related_name='order_items')
     food_item = models.ForeignKey(FoodItem, on_delete=models.CASCADE)
     quantity = models.IntegerField(default=1, validators=[MinValueValidator(1)])
@@ -370,12 +596,17 @@ class OrderItem(models.Model):
     class Meta:
         unique_together = ['order', 'food_item']
 
-    def save(self, *args, **kwargs):
+    def fill_derived_fields(self):
+        """Set the subtotal and slug; called by save() and before bulk_create()"""
         self.subtotal = self.quantity * self.price_per_plate
         
         if not self.slug:
-            self.slug = slugify(f"{self.order.order_code}-{self.food_item.slug}")
-        
+            self.slug = slugify(
+                f"{_related_value(self, 'order', 'order_code')}-{_related_value(self, 'food_item', 'slug')}"
+            )
+
+    def save(self, *args, **kwargs):
+        self.fill_derived_fields()
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -409,13 +640,19 @@ class MPesaTransaction(models.Model):
     class Meta:
         ordering = ['-created_at']
         indexes = [
-            models.Index(fields=['checkout_request_id']),
-            models.Index(fields=['merchant_request_id']),
+            # Reconciliation looks for transactions stuck in a status
+            models.Index(fields=['status', 'created_at'], name='mpesa_status_created_idx'),
         ]
 
-    def save(self, *args, **kwargs):
+    def fill_derived_fields(self):
+        """Set the slug; called by save() and before bulk_create()"""
         if not self.slug:
-            self.slug = slugify(f"{self.order.order_code}-{self.checkout_request_id[:20]}")
+            self.slug = slugify(
+                f"{_related_value(self, 'order', 'order_code')}-{self.checkout_request_id[:20]}"
+            )
+
+    def save(self, *args, **kwargs):
+        self.fill_derived_fields()
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -439,18 +676,99 @@ class OrderReceipt(models.Model):
     slug = models.SlugField(max_length=50, unique=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # SMS delivery, driven by ecommerce.sms.dispatch_sms_receipts
+    SMS_STATUS = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+    sms_status = models.CharField(max_length=10, choices=SMS_STATUS, blank=True)
+    sms_attempts = models.PositiveSmallIntegerField(default=0)
+    sms_next_attempt_at = models.DateTimeField(null=True, blank=True)
+    sms_message_id = models.CharField(max_length=100, blank=True)
+    sms_error = models.TextField(blank=True)
+
     class Meta:
         ordering = ['-sent_at']
+        indexes = [
+            models.Index(
+                fields=['sms_next_attempt_at'],
+                name='receipt_sms_pending_idx',
+                condition=models.Q(sms_status='pending'),
+            ),
+        ]
 
-    def save(self, *args, **kwargs):
+    def fill_derived_fields(self):
+        """Set the slug; called by save() and before bulk_create()"""
         if not self.slug:
-            self.slug = slugify(f"receipt-{self.order.order_code}")
+            self.slug = slugify(f"receipt-{_related_value(self, 'order', 'order_code')}")
+
+    def save(self, *args, **kwargs):
+        self.fill_derived_fields()
         super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Receipt for {self.order.order_code}"
 
 
+class OrderEvent(models.Model):
+    """One order status transition; the id is the change feed's cursor (see events.py)"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='events')
+    order_code = models.CharField(max_length=12)
+    from_status = models.CharField(max_length=20, choices=Order.ORDER_STATUS)
+    to_status = models.CharField(max_length=20, choices=Order.ORDER_STATUS)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"#{self.pk} {self.order_code}: {self.from_status} -> {self.to_status}"
+
+
+class OutboxEmail(models.Model):
+    """Email written in the same transaction as the change that caused it"""
+    KIND_CHOICES = [
+        ('receipt', 'Order Receipt'),
+        ('welcome', 'Welcome'),
+        ('contact', 'Contact Form'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True, blank=True, related_name='outbox_emails')
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=255)
+    recipients = models.TextField(help_text="Comma-separated addresses")
+    reply_to = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name_plural = "Outbox Emails"
+        indexes = [
+            models.Index(
+                fields=['next_attempt_at'],
+                name='outbox_pending_idx',
+                condition=models.Q(status='pending'),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} to {self.recipients} - {self.status}"
+
+
 class MessStaff(models.Model):
     """IT staff and mess attendants"""
     STAFF_ROLES = [
@@ -494,4 +812,177 @@ class SystemSettings(models.Model):
         verbose_name_plural = "System Settings"
 
     def __str__(self):
-        return f"{self.key}: {self.value[:50]}"
\ No newline at end of file
+        return f"{self.key}: {self.value[:50]}"
+
+    def clean(self):
+        """Reject values the typed accessor could not read"""
+        from .system_settings import validate_setting
+        validate_setting(self.key, self.value)
+
+
+class CacheVersion(models.Model):
+    """Change counter per cached model, bumped on every save and delete (see invalidation.py)"""
+    topic = models.CharField(max_length=100, primary_key=True, help_text="Model label, e.g. ecommerce.mealperiod")
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.topic} v{self.version}"
+
+class ArchivedOrder(models.Model):
+    """Cold copy of an order whose meal period closed long ago"""
+    # Keeps the original primary key so hot and cold rows never collide
+    id = models.BigIntegerField(primary_key=True)
+    order_code = models.CharField(max_length=12, unique=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='archived_orders')
+    student_profile = models.ForeignKey(StudentProfile, on_delete=models.SET_NULL, null=True, blank=True, related_name='archived_orders')
+    guest_registration_number = models.CharField(max_length=20, blank=True)
+    guest_name = models.CharField(max_length=200, blank=True)
+    guest_phone = models.CharField(max_length=15, blank=True)
+    daily_menu = models.ForeignKey(DailyMenu, on_delete=models.SET_NULL, null=True, related_name='archived_orders')
+    menu_date = models.DateField()
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=20, choices=Order.ORDER_STATUS)
+    items_summary = models.CharField(max_length=255, blank=True)
+    item_count = models.PositiveSmallIntegerField(default=0)
+    mpesa_transaction_id = models.CharField(max_length=50, blank=True, null=True)
+    mpesa_receipt_number = models.CharField(max_length=50, blank=True, null=True)
+    mpesa_phone_number = models.CharField(max_length=15, blank=True)
+    payment_date = models.DateTimeField(null=True, blank=True)
+    receipt_type = models.CharField(max_length=10, blank=True)
+    receipt_sent = models.BooleanField(default=False)
+    receipt_email = models.EmailField(blank=True)
+    receipt_phone = models.CharField(max_length=15, blank=True)
+    ordered_at = models.DateTimeField()
+    confirmed_at = models.DateTimeField(null=True, blank=True)
+    served_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-ordered_at']
+        indexes = [
+            models.Index(fields=['user', '-ordered_at', '-id'], name='archorder_user_keyset_idx'),
+            models.Index(fields=['menu_date', 'status'], name='archorder_date_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived order {self.order_code} - {self.status}"
+
+    def get_student_identifier(self):
+        """Get student registration number"""
+        if self.student_profile_id:
+            return self.student_profile.registration_number
+        return self.guest_registration_number or 'Guest'
+
+    def is_expired(self):
+        """Archived orders belong to closed meal periods"""
+        return self.status not in ['served', 'cancelled']
+
+    def can_be_served(self):
+        """Archived orders belong to closed meal periods"""
+        return False
+
+
+class ArchivedOrderItem(models.Model):
+    """Cold copy of an order item"""
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='items')
+    food_item = models.ForeignKey(FoodItem, on_delete=models.SET_NULL, null=True, related_name='archived_order_items')
+    food_item_name = models.CharField(max_length=100)
+    quantity = models.IntegerField(default=1)
+    price_per_plate = models.DecimalField(max_digits=10, decimal_places=2)
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.food_item_name} x{self.quantity} - {self.order_id}"
+
+
+class ArchivedOrderEvent(models.Model):
+    """Cold copy of an order status transition"""
+    # Keeps the original id so the history still reads in feed order
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='events')
+    order_code = models.CharField(max_length=12)
+    from_status = models.CharField(max_length=20, choices=Order.ORDER_STATUS)
+    to_status = models.CharField(max_length=20, choices=Order.ORDER_STATUS)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"#{self.pk} {self.order_code}: {self.from_status} -> {self.to_status}"
+
+
+class ArchivedMPesaTransaction(models.Model):
+    """Cold copy of an M-Pesa transaction"""
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='mpesa_transactions')
+    merchant_request_id = models.CharField(max_length=100)
+    checkout_request_id = models.CharField(max_length=100, unique=True)
+    phone_number = models.CharField(max_length=15)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=20, choices=MPesaTransaction.TRANSACTION_STATUS)
+    mpesa_receipt_number = models.CharField(max_length=50, blank=True, null=True)
+    transaction_date = models.DateTimeField(null=True, blank=True)
+    result_code = models.CharField(max_length=10, blank=True, null=True)
+    result_desc = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Archived MPesa {self.merchant_request_id} - {self.status}"
+
+
+class DailySalesRollup(models.Model):
+    """Plates and revenue per date x meal period x food item"""
+    date = models.DateField()
+    meal_period = models.ForeignKey(MealPeriod, on_delete=models.CASCADE, related_name='sales_rollups')
+    food_item = models.ForeignKey(FoodItem, on_delete=models.CASCADE, related_name='sales_rollups')
+    plates_sold = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    plates_cancelled = models.IntegerField(default=0)
+    plates_served = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-date']
+        verbose_name_plural = "Daily Sales Rollups"
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'meal_period', 'food_item'], name='unique_sales_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.meal_period_id} {self.food_item_id}: {self.plates_sold} sold"
+
+
+class MealCloseSnapshot(models.Model):
+    """Final utilization of one menu item, taken when its meal closes"""
+    daily_menu_item = models.OneToOneField(DailyMenuItem, on_delete=models.SET_NULL, null=True, related_name='close_snapshot')
+    date = models.DateField()
+    meal_period = models.ForeignKey(MealPeriod, on_delete=models.CASCADE, related_name='close_snapshots')
+    food_item = models.ForeignKey(FoodItem, on_delete=models.CASCADE, related_name='close_snapshots')
+    plates_available = models.IntegerField()
+    plates_ordered = models.IntegerField()
+    plates_served = models.IntegerField()
+    sold_out_at = models.DateTimeField(null=True, blank=True)
+    sold_out_minutes = models.IntegerField(null=True, blank=True, help_text="Minutes after ordering opened")
+    closed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['-date']
+        verbose_name_plural = "Meal Close Snapshots"
+        indexes = [
+            models.Index(fields=['date'], name='closesnap_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.food_item_id}: {self.plates_served}/{self.plates_available} served"
+
+    @property
+    def plates_left(self):
+        return self.plates_available - self.plates_served
@@ -0,0 +1,241 @@
+"""
+Bulk student onboarding from a CSV of registration numbers.
+
+Registering thousands of first-years through the register view costs a
+password hash, three existence checks, two INSERTs and an SMTP round trip
+per student. The importer instead validates the whole file in one pass,
+checks for existing students with a single query, hashes passwords in a
+process pool (PBKDF2 is CPU-bound and holds the GIL) and inserts users and
+profiles with bulk_create in chunks. Welcome emails are written to the
+outbox in the same transaction and sent by the outbox worker.
+
+Students without a password in the file get an unusable one and a link to
+set their own in the welcome email. Passwords never go into an email: the
+outbox keeps every body it sends.
+"""
+import csv
+import io
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.auth.tokens import default_token_generator
+from django.db import transaction
+from django.db.models import Q
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from django.utils.text import slugify
+
+from .models import StudentProfile
+from .outbox import enqueue_emails
+
+
+IMPORT_CHUNK_SIZE = 1000
+# The admin page hashes inside the request; a whole intake belongs in the command
+ADMIN_IMPORT_WORKERS = 2
+CSV_COLUMNS = [
+    'registration_number', 'first_name', 'last_name', 'email',
+    'phone_number', 'course', 'year_of_study', 'username', 'password',
+]
+
+# Same pattern the model field validates with, compiled once for the file
+REGISTRATION_NUMBER_RE = re.compile(
+    StudentProfile._meta.get_field('registration_number').validators[0].regex.pattern
+)
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    invalid: list = field(default_factory=list)
+    duplicates: list = field(default_factory=list)
+
+
+def read_student_csv(source):
+    """Rows of a student CSV (path, text or binary file) as normalized dicts"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, newline='', encoding='utf-8-sig') as handle:
+            return read_student_csv(handle)
+    if isinstance(source.read(0), bytes):
+        source = io.TextIOWrapper(source, encoding='utf-8-sig', newline='')
+
+    rows = []
+    for row in csv.DictReader(source):
+        rows.append({
+            column: (row.get(column) or '').strip()
+            for column in CSV_COLUMNS
+        })
+    return rows
+
+
+def validate_rows(rows):
+    """
+    Split rows into (valid, invalid) in one pass over the file.
+
+    Invalid entries are (line_number, registration_number, reason).
+    """
+    valid = []
+    invalid = []
+    seen = set()
+    seen_usernames = set()
+    seen_emails = set()
+    for line_number, row in enumerate(rows, start=2):
+        row['registration_number'] = row['registration_number'].upper()
+        registration_number = row['registration_number']
+        row['username'] = row['username'] or registration_number.lower()
+
+        if not REGISTRATION_NUMBER_RE.match(registration_number):
+            invalid.append((line_number, registration_number, 'Invalid registration number format'))
+        elif not row['email']:
+            invalid.append((line_number, registration_number, 'Missing email'))
+        elif row['year_of_study'] and not row['year_of_study'].isdigit():
+            invalid.append((line_number, registration_number, 'Year of study must be a number'))
+        elif registration_number in seen:
+            invalid.append((line_number, registration_number, 'Repeated in file'))
+        elif row['username'] in seen_usernames:
+            invalid.append((line_number, registration_number, 'Username repeated in file'))
+        elif row['email'] in seen_emails:
+            invalid.append((line_number, registration_number, 'Email repeated in file'))
+        else:
+            seen.add(registration_number)
+            seen_usernames.add(row['username'])
+            seen_emails.add(row['email'])
+            valid.append(row)
+    return valid, invalid
+
+
+def split_existing(rows):
+    """
+    Split rows into (new, duplicates) with one query against users/profiles.
+    """
+    registration_numbers = {row['registration_number'] for row in rows}
+    usernames = {row['username'] for row in rows}
+    emails = {row['email'] for row in rows}
+
+    taken_registration_numbers = set()
+    taken_usernames = set()
+    taken_emails = set()
+    existing = User.objects.filter(
+        Q(username__in=usernames)
+        | Q(email__in=emails)
+        | Q(student_profile__registration_number__in=registration_numbers)
+    ).values_list('username', 'email', 'student_profile__registration_number')
+    for username, email, registration_number in existing:
+        taken_usernames.add(username)
+        taken_emails.add(email)
+        taken_registration_numbers.add(registration_number)
+
+    new = []
+    duplicates = []
+    for row in rows:
+        if (row['registration_number'] in taken_registration_numbers
+                or row['username'] in taken_usernames
+                or row['email'] in taken_emails):
+            duplicates.append(row['registration_number'])
+        else:
+            new.append(row)
+    return new, duplicates
+
+
+def _init_hash_worker():
+    # Spawned (non-forked) workers start without configured settings
+    import django
+    django.setup()
+
+
+def hash_passwords(passwords, workers=None):
+    """Hash passwords across a process pool, preserving order"""
+    if len(passwords) < 50 or workers == 1:
+        return [make_password(password) for password in passwords]
+    workers = workers or os.cpu_count()
+    chunksize = max(1, len(passwords) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_hash_worker) as executor:
+        return list(executor.map(make_password, passwords, chunksize=chunksize))
+
+
+def password_reset_url(user, site_url=None):
+    """Absolute one-time link for `user` to set a password"""
+    site_url = site_url or getattr(settings, 'SITE_URL', 'http://localhost:8000')
+    path = reverse('password_reset_confirm', kwargs={
+        'uidb64': urlsafe_base64_encode(force_bytes(user.pk)),
+        'token': default_token_generator.make_token(user),
+    })
+    return site_url.rstrip('/') + path
+
+
+def welcome_email(first_name, registration_number, username, email, set_password_url=None):
+    """(subject, body, recipients) of the welcome email for a new student"""
+    body = (
+        f'Hello {first_name},\n\nYour account has been created successfully!\n\n'
+        f'Registration Number: {registration_number}\nUsername: {username}\n'
+    )
+    if set_password_url:
+        body += f'\nSet your password here before you login:\n{set_password_url}\n'
+    body += (
+        '\nYou can now login and order your meals.\n\n'
+        'Best regards,\nMuranga University Mess Team'
+    )
+    return 'Welcome to Muranga University Mess System', body, [email]
+
+
+def _new_user(row, password):
+    user = User(
+        username=row['username'],
+        email=row['email'],
+        first_name=row['first_name'],
+        last_name=row['last_name'],
+        password=password,
+    )
+    if password is None:
+        user.set_unusable_password()
+    return user
+
+
+def import_students(rows, send_welcome=True, workers=None, chunk_size=IMPORT_CHUNK_SIZE, site_url=None):
+    """Validate, dedupe and bulk create users and student profiles"""
+    result = ImportResult()
+    valid, result.invalid = validate_rows(rows)
+    new, result.duplicates = split_existing(valid)
+    if not new:
+        return result
+
+    # Only passwords given in the file are hashed; the rest are set by the student
+    hashed = iter(hash_passwords([row['password'] for row in new if row['password']], workers=workers))
+    passwords = [next(hashed) if row['password'] else None for row in new]
+
+    messages = []
+    with transaction.atomic():
+        for start in range(0, len(new), chunk_size):
+            chunk = new[start:start + chunk_size]
+            users = User.objects.bulk_create([
+                _new_user(row, password)
+                for row, password in zip(chunk, passwords[start:start + chunk_size])
+            ])
+            StudentProfile.objects.bulk_create([
+                StudentProfile(
+                    user=user,
+                    registration_number=row['registration_number'],
+                    phone_number=row['phone_number'],
+                    course=row['course'],
+                    year_of_study=int(row['year_of_study']) if row['year_of_study'] else None,
+                    slug=slugify(row['registration_number']),
+                )
+                for user, row in zip(users, chunk)
+            ])
+            result.created += len(users)
+
+            if send_welcome:
+                messages += [
+                    welcome_email(
+                        row['first_name'], row['registration_number'], row['username'], row['email'],
+                        None if user.has_usable_password() else password_reset_url(user, site_url)
+                    )
+                    for user, row in zip(users, chunk)
+                ]
+        enqueue_emails('welcome', messages)
+    return result
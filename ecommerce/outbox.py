@@ -0,0 +1,192 @@
+"""
+Transactional email outbox.
+
+Views used to call send_mail inline, opening a fresh SMTP connection to Gmail
+inside the request (or inside the M-Pesa callback). Now they write an
+OutboxEmail row in the same transaction as the change that triggered the
+email, so the email exists if and only if the change committed, and the
+request never waits on the mail server. drain_outbox() later sends pending
+rows over a single SMTP connection per batch, retrying failures with
+exponential backoff.
+"""
+import logging
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import OutboxEmail, OrderReceipt
+from .workers import start_worker
+
+
+logger = logging.getLogger(__name__)
+
+DRAIN_BATCH_SIZE = 50
+MAX_ATTEMPTS = 6
+RETRY_BASE_SECONDS = 60
+
+
+@dataclass
+class DrainResult:
+    sent: int = 0
+    retried: int = 0
+    failed: int = 0
+
+
+def enqueue_email(kind, subject, body, recipients, html_body='', order=None,
+                  from_email=None, reply_to=''):
+    """Write an email to the outbox; call inside the business transaction"""
+    return OutboxEmail.objects.create(**_outbox_fields(
+        kind, subject, body, recipients, html_body, order, from_email, reply_to
+    ))
+
+
+def enqueue_emails(kind, messages):
+    """Bulk write (subject, body, recipients) messages of one kind to the outbox"""
+    return OutboxEmail.objects.bulk_create([
+        OutboxEmail(**_outbox_fields(kind, subject, body, recipients))
+        for subject, body, recipients in messages
+    ], batch_size=1000)
+
+
+def _outbox_fields(kind, subject, body, recipients, html_body='', order=None,
+                   from_email=None, reply_to=''):
+    return {
+        'kind': kind,
+        'order': order,
+        'subject': subject,
+        'body': body,
+        'html_body': html_body,
+        'from_email': from_email or settings.DEFAULT_FROM_EMAIL,
+        'recipients': ','.join(recipients),
+        'reply_to': reply_to,
+    }
+
+
+def _build_message(email, connection):
+    message = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email,
+        to=email.recipients.split(','),
+        reply_to=[email.reply_to] if email.reply_to else None,
+        connection=connection,
+    )
+    if email.html_body:
+        message.attach_alternative(email.html_body, 'text/html')
+    return message
+
+
+def retry_delay(attempts):
+    """Backoff before the next attempt: 1, 2, 4, 8... minutes"""
+    return timedelta(seconds=RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+
+
+def _record_failure(email, error, now, result):
+    email.last_error = str(error)
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = 'failed'
+        result.failed += 1
+    else:
+        email.next_attempt_at = now + retry_delay(email.attempts)
+        result.retried += 1
+
+
+def drain_outbox(batch_size=DRAIN_BATCH_SIZE):
+    """Send one batch of due emails over a single connection"""
+    result = DrainResult()
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            OutboxEmail.objects.filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at')
+            .select_for_update(skip_locked=True)[:batch_size]
+        )
+        if not emails:
+            return result
+
+        sent_receipts = []
+        connection = get_connection()
+        try:
+            try:
+                connection.open()
+            except Exception as e:
+                # Mail server unreachable: every email in the batch failed an attempt
+                logger.warning("Could not connect to the mail server: %s", e)
+                for email in emails:
+                    email.attempts += 1
+                    _record_failure(email, e, now, result)
+                emails_to_send = []
+            else:
+                emails_to_send = emails
+            for email in emails_to_send:
+                email.attempts += 1
+                try:
+                    connection.send_messages([_build_message(email, connection)])
+                except Exception as e:
+                    _record_failure(email, e, now, result)
+                else:
+                    email.status = 'sent'
+                    email.sent_at = timezone.now()
+                    email.last_error = ''
+                    result.sent += 1
+                    if email.kind == 'receipt' and email.order_id:
+                        sent_receipts.append(email.order_id)
+        finally:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+        OutboxEmail.objects.bulk_update(
+            emails, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at']
+        )
+    if sent_receipts:
+        complete_receipts(sent_receipts)
+    return result
+
+
+def complete_receipts(order_ids):
+    """
+    Mark the receipts of `order_ids` sent once every channel they use delivered.
+
+    Both the outbox drain and the SMS dispatcher run this after committing
+    their own delivery, as one conditional UPDATE: an email-and-SMS receipt
+    is completed by whichever of the two commits last, as it sees both.
+    """
+    emailed = Exists(OutboxEmail.objects.filter(order_id=OuterRef('order_id'), kind='receipt', status='sent'))
+    return OrderReceipt.objects.filter(order_id__in=order_ids, is_sent=False).filter(
+        Q(receipt_type='email') & emailed
+        | Q(receipt_type='sms', sms_status='sent')
+        | Q(receipt_type='both', sms_status='sent') & emailed
+    ).update(is_sent=True, sent_at=timezone.now())
+
+
+def drain_all(batch_size=DRAIN_BATCH_SIZE):
+    """Drain batches until nothing due is left"""
+    total = DrainResult()
+    while True:
+        result = drain_outbox(batch_size)
+        total.sent += result.sent
+        total.retried += result.retried
+        total.failed += result.failed
+        if not (result.sent or result.retried or result.failed):
+            return total
+
+
+def _drain_and_log():
+    result = drain_all()
+    if result.sent or result.retried or result.failed:
+        logger.info(
+            "Outbox: %d sent, %d retrying, %d failed",
+            result.sent, result.retried, result.failed
+        )
+
+
+def start_outbox_worker(interval):
+    """Start the in-process outbox drain thread"""
+    return start_worker('email-outbox', _drain_and_log, interval)
@@ -0,0 +1,110 @@
+"""
+Keyset (cursor) pagination helpers.
+
+Offset pagination gets slower the further back a student scrolls because the
+database still has to walk every skipped row. Keyset pagination instead
+remembers the last row of the previous page and seeks straight to it using a
+composite index, so every page costs the same regardless of history length.
+"""
+import base64
+from datetime import datetime
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+def encode_cursor(ordered_at, pk):
+    """Encode the (ordered_at, id) position of a row into an opaque cursor"""
+    raw = f"{ordered_at.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor back into (ordered_at, id); returns None if invalid"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode()
+        ordered_at, pk = raw.rsplit('|', 1)
+        return datetime.fromisoformat(ordered_at), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def keyset_page(querysets, cursor=None, page_size=20):
+    """
+    Return one page of rows ordered newest first on (ordered_at, id).
+
+    Accepts a single queryset or a list of them (e.g. hot and archived
+    orders); each is seeked independently on its own index and the results
+    are merged. Fetches page_size + 1 rows so we know whether another page
+    exists without a separate COUNT query. Returns (rows, next_cursor).
+    """
+    if not isinstance(querysets, (list, tuple)):
+        querysets = [querysets]
+
+    position = decode_cursor(cursor)
+    rows = []
+    for queryset in querysets:
+        queryset = queryset.order_by('-ordered_at', '-id')
+        if position:
+            ordered_at, pk = position
+            queryset = queryset.filter(
+                Q(ordered_at__lt=ordered_at) | Q(ordered_at=ordered_at, id__lt=pk)
+            )
+        rows.extend(queryset[:page_size + 1])
+
+    if len(querysets) > 1:
+        rows.sort(key=lambda row: (row.ordered_at, row.pk), reverse=True)
+        rows = rows[:page_size + 1]
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.ordered_at, last.pk)
+    return rows, next_cursor
+
+
+def estimated_row_count(model, using='default'):
+    """
+    Planner estimate of a table's row count, or None if unavailable.
+
+    Only Postgres keeps a cheap estimate (pg_class.reltuples, refreshed by
+    autovacuum/ANALYZE); other backends return None.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+            [model._meta.db_table]
+        )
+        row = cursor.fetchone()
+    if not row or row[0] < 0:
+        return None
+    return row[0]
+
+
+class ApproximateCountPaginator(Paginator):
+    """
+    Paginator that avoids COUNT(*) on big unfiltered tables.
+
+    Unfiltered listings use the planner's row estimate once the table is
+    larger than `threshold`; filtered listings (search, list_filter) are
+    usually selective enough to count exactly.
+    """
+    threshold = 10000
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            estimate = estimated_row_count(self.object_list.model, self.object_list.db)
+            if estimate is not None and estimate >= self.threshold:
+                return estimate
+        return super().count
@@ -0,0 +1,197 @@
+"""
+Daily sales rollups and the reports built on them.
+
+DailySalesRollup keeps plates sold, revenue, cancelled and served plates per
+date x meal period x food item. Order.save() calls record_status_change()
+in the same transaction whenever an order's status changes, so the rollups
+move with every confirmation, cancellation and serve instead of being
+recomputed from Order/OrderItem on every report. rebuild_rollups()
+recomputes a date range from scratch (live and archived orders) and can be
+run any number of times.
+"""
+import csv
+import io
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, IntegerField, Q, Sum, Value, When
+
+from .models import ArchivedOrderItem, DailySalesRollup, DailyMenu, OrderItem
+
+
+SOLD_STATUSES = ['confirmed', 'ready', 'served']
+SEMESTER_START_MONTHS = (1, 5, 9)
+REPORT_GROUPINGS = {
+    'day': ['date'],
+    'meal_period': ['meal_period__name'],
+    'food_item': ['food_item__name'],
+    'day_meal_period': ['date', 'meal_period__name'],
+}
+REPORT_PERIODS = ['week', 'month', 'semester']
+
+
+def contribution(status, paid, quantity, subtotal):
+    """(sold, revenue, cancelled, served) an order item adds in a given status"""
+    # A paid order that expired uncollected is still a sale
+    sold = status in SOLD_STATUSES or (status == 'expired' and paid)
+    return (
+        quantity if sold else 0,
+        subtotal if sold else Decimal('0'),
+        quantity if status == 'cancelled' else 0,
+        quantity if status == 'served' else 0,
+    )
+
+
+def _apply_deltas(deltas):
+    """Add {(date, meal_period_id, food_item_id): (sold, revenue, cancelled, served)}"""
+    deltas = {key: delta for key, delta in deltas.items() if any(delta)}
+    if not deltas:
+        return
+    DailySalesRollup.objects.bulk_create([
+        DailySalesRollup(date=day, meal_period_id=meal_period_id, food_item_id=food_item_id)
+        for day, meal_period_id, food_item_id in deltas
+    ], ignore_conflicts=True)
+    for (day, meal_period_id, food_item_id), (sold, revenue, cancelled, served) in deltas.items():
+        DailySalesRollup.objects.filter(
+            date=day, meal_period_id=meal_period_id, food_item_id=food_item_id
+        ).update(
+            plates_sold=F('plates_sold') + sold,
+            revenue=F('revenue') + revenue,
+            plates_cancelled=F('plates_cancelled') + cancelled,
+            plates_served=F('plates_served') + served,
+        )
+
+
+def record_status_change(order, old_status, new_status, was_paid=None):
+    """
+    Move an order's plates between rollup columns; call inside its transaction.
+
+    `was_paid` is whether the order was paid before the change (default:
+    whether it is now). A late payment of an expired order pays and confirms
+    it in one save, and only counts as a sale if the old status is scored
+    as unpaid.
+    """
+    paid = order.payment_date is not None
+    was_paid = paid if was_paid is None else was_paid
+    day, meal_period_id = DailyMenu.objects.filter(pk=order.daily_menu_id).values_list(
+        'date', 'meal_period_id'
+    ).get()
+
+    deltas = defaultdict(lambda: (0, Decimal('0'), 0, 0))
+    for food_item_id, quantity, subtotal in order.items.values_list('food_item_id', 'quantity', 'subtotal'):
+        new = contribution(new_status, paid, quantity, subtotal)
+        old = contribution(old_status, was_paid, quantity, subtotal)
+        key = (day, meal_period_id, food_item_id)
+        deltas[key] = tuple(total + n - o for total, n, o in zip(deltas[key], new, old))
+    _apply_deltas(deltas)
+
+
+def _rollup_rows(queryset, date_field, meal_period_field):
+    """Aggregate order items into rollup rows keyed like _apply_deltas"""
+    sold = Q(order__status__in=SOLD_STATUSES) | Q(order__status='expired', order__payment_date__isnull=False)
+    rows = queryset.filter(
+        **{f'{meal_period_field}__isnull': False, 'food_item__isnull': False}
+    ).values(
+        day=F(date_field),
+        meal_period_id_=F(meal_period_field),
+        food_item_id_=F('food_item_id'),
+    ).annotate(
+        sold=Sum(Case(When(sold, then='quantity'), default=Value(0), output_field=IntegerField())),
+        revenue=Sum(Case(When(sold, then='subtotal'), default=Value(0), output_field=DecimalField())),
+        cancelled=Sum(Case(When(order__status='cancelled', then='quantity'), default=Value(0), output_field=IntegerField())),
+        served=Sum(Case(When(order__status='served', then='quantity'), default=Value(0), output_field=IntegerField())),
+    ).order_by()
+    for row in rows:
+        key = (row['day'], row['meal_period_id_'], row['food_item_id_'])
+        yield key, (row['sold'], row['revenue'] or Decimal('0'), row['cancelled'], row['served'])
+
+
+@transaction.atomic
+def rebuild_rollups(start=None, end=None):
+    """Recompute rollups for [start, end] from live and archived orders"""
+    live = OrderItem.objects.all()
+    archived = ArchivedOrderItem.objects.all()
+    existing = DailySalesRollup.objects.all()
+    if start:
+        live = live.filter(order__daily_menu__date__gte=start)
+        archived = archived.filter(order__menu_date__gte=start)
+        existing = existing.filter(date__gte=start)
+    if end:
+        live = live.filter(order__daily_menu__date__lte=end)
+        archived = archived.filter(order__menu_date__lte=end)
+        existing = existing.filter(date__lte=end)
+
+    totals = defaultdict(lambda: (0, Decimal('0'), 0, 0))
+    sources = [
+        _rollup_rows(live, 'order__daily_menu__date', 'order__daily_menu__meal_period_id'),
+        _rollup_rows(archived, 'order__menu_date', 'order__daily_menu__meal_period_id'),
+    ]
+    for source in sources:
+        for key, values in source:
+            totals[key] = tuple(a + b for a, b in zip(totals[key], values))
+
+    existing.delete()
+    DailySalesRollup.objects.bulk_create([
+        DailySalesRollup(
+            date=day, meal_period_id=meal_period_id, food_item_id=food_item_id,
+            plates_sold=sold, revenue=revenue, plates_cancelled=cancelled, plates_served=served,
+        )
+        for (day, meal_period_id, food_item_id), (sold, revenue, cancelled, served) in totals.items()
+        if any((sold, cancelled))
+    ], batch_size=1000)
+    return len(totals)
+
+
+def period_range(period, on=None):
+    """(start, end) dates of the week, month or semester containing `on`"""
+    on = on or date.today()
+    if period == 'week':
+        start = on - timedelta(days=on.weekday())
+        return start, start + timedelta(days=6)
+    if period == 'month':
+        start = on.replace(day=1)
+        next_month = (start + timedelta(days=32)).replace(day=1)
+        return start, next_month - timedelta(days=1)
+    if period == 'semester':
+        month = max(m for m in SEMESTER_START_MONTHS if m <= on.month)
+        start = on.replace(month=month, day=1)
+        following = [m for m in SEMESTER_START_MONTHS if m > month]
+        if following:
+            end = on.replace(month=following[0], day=1)
+        else:
+            end = date(on.year + 1, SEMESTER_START_MONTHS[0], 1)
+        return start, end - timedelta(days=1)
+    raise ValueError(f"Unknown period: {period}")
+
+
+def sales_report(start, end, group_by='food_item', meal_period=None):
+    """Report rows summed from the rollups, plus a totals row"""
+    rollups = DailySalesRollup.objects.filter(date__gte=start, date__lte=end)
+    if meal_period:
+        rollups = rollups.filter(meal_period__name=meal_period)
+    columns = REPORT_GROUPINGS[group_by]
+    measures = {
+        'plates_sold': Sum('plates_sold'),
+        'revenue': Sum('revenue'),
+        'plates_cancelled': Sum('plates_cancelled'),
+        'plates_served': Sum('plates_served'),
+    }
+    rows = list(rollups.values(*columns).annotate(**measures).order_by(*columns))
+    totals = rollups.aggregate(**measures)
+    return rows, {key: value or 0 for key, value in totals.items()}
+
+
+def report_csv(rows, totals, group_by):
+    """CSV text for a report"""
+    columns = REPORT_GROUPINGS[group_by] + ['plates_sold', 'revenue', 'plates_cancelled', 'plates_served']
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column.replace('__name', '') for column in columns])
+    for row in rows:
+        writer.writerow([row[column] for column in columns])
+    writer.writerow(['TOTAL'] + [''] * (len(REPORT_GROUPINGS[group_by]) - 1) + [
+        totals['plates_sold'], totals['revenue'], totals['plates_cancelled'], totals['plates_served'],
+    ])
+    return buffer.getvalue()
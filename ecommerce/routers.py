@@ -0,0 +1,202 @@
+"""
+Read-replica routing.
+
+Browse pages and reports (REPLICA_READ_VIEWS) read the mess tables from the
+REPLICA_DATABASE alias; everything else, every write, and all sessions and
+auth lookups stay on the primary. ReplicaRoutingMiddleware decides per
+request and PrimaryReplicaRouter follows that decision, the same
+ContextVar handoff the metrics and tracing middleware use.
+
+Two things send a replica-eligible request back to the primary:
+
+- the replica lagging more than REPLICA_MAX_LAG_SECONDS behind (checked at
+  most every REPLICA_LAG_CHECK_INTERVAL seconds per process), and
+- a pin cookie set for REPLICA_STICKY_SECONDS after any write, so a student
+  who just placed an order sees their own plates taken on the next page.
+
+Without a replica alias in DATABASES every read goes to the primary.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = 'db_primary_until'
+SAFE_METHODS = ('GET', 'HEAD')
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+def replica_alias():
+    """The replica's alias, or None when no replica is configured"""
+    alias = getattr(settings, 'REPLICA_DATABASE', 'replica')
+    return alias if alias in settings.DATABASES else None
+
+
+@contextmanager
+def primary_reads():
+    """Read from the primary inside this block, even on a replica-routed request"""
+    token = _replica_reads.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """Send the mess app's reads to the replica when the request allows it"""
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get() and model._meta.app_label == 'ecommerce':
+            # Reads inside a transaction on the primary must see its writes
+            if not connections[DEFAULT_DB_ALIAS].in_atomic_block:
+                return replica_alias() or DEFAULT_DB_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica is a copy of the primary, so rows relate across them
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == replica_alias():
+            return False
+        return None
+
+
+# ==================== REPLICATION LAG ====================
+
+_LAG_SQL = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+_lag_lock = threading.Lock()
+_lag_checked_at = None
+_lag = None
+
+
+def measure_replica_lag(alias):
+    """
+    Seconds the replica is behind the primary, or None if it can't be reached.
+
+    Postgres standbys report the age of the last replayed transaction (0 when
+    fully caught up). Other databases, or an alias that actually points at
+    the primary, count as caught up.
+    """
+    connection = connections[alias]
+    try:
+        if connection.vendor != 'postgresql':
+            connection.ensure_connection()
+            return 0.0
+        with connection.cursor() as cursor:
+            cursor.execute(_LAG_SQL)
+            lag = cursor.fetchone()[0]
+        return float(lag or 0)
+    except DatabaseError:
+        logger.warning("Replica %s is unreachable; reading from the primary", alias, exc_info=True)
+        return None
+
+
+def replica_lag(alias):
+    """Cached measure_replica_lag(), refreshed every REPLICA_LAG_CHECK_INTERVAL seconds"""
+    global _lag_checked_at, _lag
+    interval = getattr(settings, 'REPLICA_LAG_CHECK_INTERVAL', 10)
+    with _lag_lock:
+        now = time.monotonic()
+        if _lag_checked_at is None or now - _lag_checked_at >= interval:
+            _lag = measure_replica_lag(alias)
+            _lag_checked_at = now
+            max_lag = getattr(settings, 'REPLICA_MAX_LAG_SECONDS', 5)
+            if _lag is not None and _lag > max_lag:
+                logger.warning("Replica %s is %.1fs behind (tolerance %ss); reading from the primary",
+                               alias, _lag, max_lag)
+        return _lag
+
+
+def reset_replica_lag():
+    """Forget the cached lag so the next request measures it again"""
+    global _lag_checked_at, _lag
+    with _lag_lock:
+        _lag_checked_at = _lag = None
+
+
+def replica_is_fresh(alias):
+    lag = replica_lag(alias)
+    return lag is not None and lag <= getattr(settings, 'REPLICA_MAX_LAG_SECONDS', 5)
+
+
+# ==================== MIDDLEWARE ====================
+
+def _is_pinned(request):
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def _stream_from_replica(chunks):
+    """Keep a streaming response's lazy queries on the replica"""
+    iterator = iter(chunks)
+    while True:
+        token = _replica_reads.set(True)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _replica_reads.reset(token)
+        yield chunk
+
+
+class ReplicaRoutingMiddleware:
+    """Route REPLICA_READ_VIEWS to the replica unless the client wrote recently"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.read_views = frozenset(getattr(settings, 'REPLICA_READ_VIEWS', ()))
+        self.sticky_seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 15)
+
+    def __call__(self, request):
+        token = _replica_reads.set(False)
+        try:
+            response = self.get_response(request)
+            on_replica = _replica_reads.get()
+        finally:
+            _replica_reads.reset(token)
+
+        if on_replica and response.streaming:
+            response.streaming_content = _stream_from_replica(response.streaming_content)
+
+        if request.method not in SAFE_METHODS and response.status_code < 400 and replica_alias():
+            response.set_cookie(
+                PIN_COOKIE,
+                str(int(time.time()) + self.sticky_seconds),
+                max_age=self.sticky_seconds,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        alias = replica_alias()
+        if (
+            alias
+            and request.method in SAFE_METHODS
+            and request.resolver_match.view_name in self.read_views
+            and not _is_pinned(request)
+            and replica_is_fresh(alias)
+        ):
+            _replica_reads.set(True)
+        return None
@@ -0,0 +1,118 @@
+"""
+Stampede protection for values kept in the shared Django cache.
+
+When ordering opens, hundreds of students load the same pages within a
+second. A plain get-or-compute cache recomputes a missing or just
+invalidated entry once per waiting request. A SingleflightCache computes
+each key once:
+
+- Each entry records when it stops being fresh, what it cost to compute,
+  and the CacheVersion stamp of the models it was built from (see
+  invalidation.py).
+- A fresh entry with the current stamp is served as is. Close to expiry, a
+  request may volunteer to recompute it early, with a probability that
+  grows as expiry nears and with the compute cost ("XFetch"), so a busy key
+  is usually refreshed before it ever goes stale.
+- A stale or outdated entry is served to everyone except the one request
+  that wins a lock key (cache.add()), which recomputes it. The entry stays
+  in the cache for `stale_ttl` seconds past its ttl for this.
+- A missing entry is computed by the lock winner; the others poll for its
+  result and only compute it themselves if it hasn't come within
+  SINGLEFLIGHT_LOCK_TIMEOUT seconds.
+
+The lock only spans workers if CACHES points at a shared backend (Redis,
+memcached). With the default per-process local memory cache, each worker
+computes a key once.
+"""
+import math
+import random
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .invalidation import bus, published_topics
+from .routers import primary_reads
+
+
+CACHE_PREFIX = 'singleflight'
+WAIT_POLL_SECONDS = 0.02
+
+
+class SingleflightCache:
+    """
+    Values computed from `models`, shared through the Django cache.
+
+    Values must pickle; evaluate querysets into lists. Changes to models not
+    listed are only picked up when an entry's ttl runs out.
+    """
+
+    def __init__(self, name, *models, ttl, stale_ttl=None, beta=1.0):
+        self.name = name
+        self.topics = published_topics(models)
+        self.ttl = ttl
+        self.stale_ttl = ttl if stale_ttl is None else stale_ttl
+        self.beta = beta
+
+    def get(self, key, compute):
+        """The cached value for `key`, computing it at most once at a time"""
+        stamp = bus.stamp(self.topics)
+        if stamp is None:
+            # Changes can't be tracked right now, so no entry can be trusted
+            with primary_reads():
+                return compute()
+
+        cache_key = f'{CACHE_PREFIX}:{self.name}:{key}'
+        entry = cache.get(cache_key)
+        if entry is None:
+            return self._fill(cache_key, compute, stamp)
+
+        value, fresh_until, cost, entry_stamp = entry
+        if entry_stamp == stamp and not self._refresh_early(fresh_until, cost):
+            return value
+        token = self._lock(cache_key)
+        if token is None:
+            # Someone else is already recomputing; serve what there is meanwhile
+            return value
+        return self._compute(cache_key, compute, stamp, token)
+
+    def _refresh_early(self, fresh_until, cost):
+        # -log(U) is exponential with mean 1: most requests wait, one goes
+        # early, more likely the closer expiry is and the costlier the value
+        return time.time() - cost * self.beta * math.log(1.0 - random.random()) >= fresh_until
+
+    def _fill(self, cache_key, compute, stamp):
+        deadline = time.monotonic() + getattr(settings, 'SINGLEFLIGHT_LOCK_TIMEOUT', 10)
+        while True:
+            token = self._lock(cache_key)
+            if token is not None:
+                return self._compute(cache_key, compute, stamp, token)
+            time.sleep(WAIT_POLL_SECONDS)
+            entry = cache.get(cache_key)
+            if entry is not None:
+                return entry[0]
+            if time.monotonic() >= deadline:
+                # The lock holder is stuck or died; don't wait on it any longer
+                with primary_reads():
+                    return compute()
+
+    def _lock(self, cache_key):
+        """A token if this caller now holds the key's lock, else None"""
+        token = uuid.uuid4().hex
+        timeout = getattr(settings, 'SINGLEFLIGHT_LOCK_TIMEOUT', 10)
+        return token if cache.add(f'{cache_key}:lock', token, timeout) else None
+
+    def _compute(self, cache_key, compute, stamp, token):
+        try:
+            started = time.monotonic()
+            # A replica could still hold rows older than the stamp just read
+            with primary_reads():
+                value = compute()
+            cost = time.monotonic() - started
+            cache.set(cache_key, (value, time.time() + self.ttl, cost, stamp), self.ttl + self.stale_ttl)
+            return value
+        finally:
+            # Best effort: a lock that outlived its timeout may be someone else's now
+            if cache.get(f'{cache_key}:lock') == token:
+                cache.delete(f'{cache_key}:lock')
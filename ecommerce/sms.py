@@ -0,0 +1,263 @@
+"""
+SMS receipts.
+
+Most students never open the receipt email, but every order carries the
+M-Pesa phone number that paid for it. send_order_receipt marks the order's
+OrderReceipt as pending SMS; dispatch_sms_receipts() later picks up pending
+receipts, groups them into gateway bulk-send requests of up to
+SMS_BATCH_SIZE recipients, paces the requests to SMS_RATE_LIMIT per second
+and retries failures with the same backoff as the email outbox.
+
+No row lock is held while talking to the gateway. A dispatcher claims due
+receipts by pushing their next attempt CLAIM_SECONDS ahead and commits;
+other dispatchers skip them until then, and they come due again if this
+one dies before recording the results. An email-and-SMS receipt is marked
+sent by outbox.complete_receipts(), run after both deliveries commit.
+
+Gateways are pluggable in the same way as Django email backends: point
+SMS_BACKEND at a class with a send_messages(messages) method.
+"""
+import json
+import logging
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import OrderReceipt
+from .outbox import MAX_ATTEMPTS, complete_receipts, retry_delay
+from .workers import start_worker
+
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_LIMIT = 1000
+# Longer than sending DISPATCH_LIMIT receipts takes at the slowest rate
+CLAIM_SECONDS = 600
+
+
+@dataclass
+class SMSMessage:
+    to: str
+    text: str
+    reference: str
+
+
+@dataclass
+class SMSResult:
+    reference: str
+    sent: bool
+    message_id: str = ''
+    error: str = ''
+
+
+@dataclass
+class DispatchResult:
+    sent: int = 0
+    retried: int = 0
+    failed: int = 0
+    requests: int = 0
+
+
+# ==================== BACKENDS ====================
+
+class BaseSMSBackend:
+    """Sends a batch of messages in one gateway call"""
+
+    def send_messages(self, messages):
+        """Return one SMSResult per message; raise if the whole call failed"""
+        raise NotImplementedError
+
+
+class ConsoleBackend(BaseSMSBackend):
+    """Writes messages to stdout (development)"""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self._lock = threading.Lock()
+
+    def send_messages(self, messages):
+        with self._lock:
+            for message in messages:
+                self.stream.write(f'SMS to {message.to} [{message.reference}]: {message.text}\n')
+            self.stream.flush()
+        return [SMSResult(message.reference, True) for message in messages]
+
+
+class FileBackend(BaseSMSBackend):
+    """Appends messages as JSON lines to SMS_FILE_PATH"""
+
+    def __init__(self, path=None):
+        self.path = path or settings.SMS_FILE_PATH
+
+    def send_messages(self, messages):
+        with open(self.path, 'a', encoding='utf-8') as handle:
+            for message in messages:
+                handle.write(json.dumps(message.__dict__) + '\n')
+        return [SMSResult(message.reference, True) for message in messages]
+
+
+class HttpBackend(BaseSMSBackend):
+    """
+    JSON bulk-send gateway.
+
+    POSTs {"sender", "messages": [{"to", "text", "reference"}]} to
+    SMS_GATEWAY_URL and expects {"results": [{"reference", "status",
+    "message_id", "error"}]} back, status being "sent" or "failed".
+    """
+
+    def __init__(self, url=None, api_key=None, sender=None, timeout=30):
+        self.url = url or settings.SMS_GATEWAY_URL
+        self.api_key = api_key if api_key is not None else settings.SMS_API_KEY
+        self.sender = sender or settings.SMS_SENDER_ID
+        self.timeout = timeout
+        self.session = requests.Session()
+        if self.api_key:
+            self.session.headers['Authorization'] = f'Bearer {self.api_key}'
+
+    def send_messages(self, messages):
+        response = self.session.post(self.url, json={
+            'sender': self.sender,
+            'messages': [message.__dict__ for message in messages],
+        }, timeout=self.timeout)
+        response.raise_for_status()
+
+        results = {item.get('reference'): item for item in response.json().get('results', [])}
+        outcomes = []
+        for message in messages:
+            item = results.get(message.reference)
+            if item is None:
+                outcomes.append(SMSResult(message.reference, False, error='No result from gateway'))
+            else:
+                outcomes.append(SMSResult(
+                    message.reference,
+                    item.get('status') == 'sent',
+                    item.get('message_id') or '',
+                    item.get('error') or '',
+                ))
+        return outcomes
+
+
+def get_backend(path=None):
+    """Instantiate the configured SMS backend"""
+    return import_string(path or settings.SMS_BACKEND)()
+
+
+# ==================== DISPATCH ====================
+
+class RateLimiter:
+    """Spaces calls at least 1/per_second seconds apart"""
+
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second if per_second else 0
+        self.next_at = 0.0
+
+    def wait(self):
+        now = time.monotonic()
+        if now < self.next_at:
+            time.sleep(self.next_at - now)
+            now = self.next_at
+        self.next_at = now + self.interval
+
+
+def normalize_phone(phone_number):
+    """254712345678 / 0712345678 -> +254712345678"""
+    digits = ''.join(c for c in phone_number if c.isdigit())
+    if digits.startswith('0'):
+        digits = '254' + digits[1:]
+    return '+' + digits
+
+
+def receipt_sms_text(order):
+    """Short receipt text; stays within one or two SMS segments"""
+    return (
+        f'Muranga Mess: order {order.order_code} confirmed. '
+        f'{order.items_summary[:60]} KES {order.total_amount:.0f}. '
+        f'Show this code at the counter.'
+    )
+
+
+def _apply_result(receipt, result, now):
+    receipt.sms_attempts += 1
+    if result.sent:
+        receipt.sms_status = 'sent'
+        receipt.sms_message_id = result.message_id
+        receipt.sms_error = ''
+        receipt.sent_at = now
+        return 'sent'
+    receipt.sms_error = result.error
+    if receipt.sms_attempts >= MAX_ATTEMPTS:
+        receipt.sms_status = 'failed'
+        return 'failed'
+    receipt.sms_next_attempt_at = now + retry_delay(receipt.sms_attempts)
+    return 'retried'
+
+
+def claim_due_receipts(limit=DISPATCH_LIMIT):
+    """Due pending SMS receipts, held back from other dispatchers for CLAIM_SECONDS"""
+    now = timezone.now()
+    with transaction.atomic():
+        receipts = list(
+            OrderReceipt.objects.filter(sms_status='pending', sms_next_attempt_at__lte=now)
+            .select_related('order')
+            .order_by('sms_next_attempt_at')
+            .select_for_update(skip_locked=True, of=('self',))[:limit]
+        )
+        OrderReceipt.objects.filter(pk__in=[receipt.pk for receipt in receipts]).update(
+            sms_next_attempt_at=now + timedelta(seconds=CLAIM_SECONDS)
+        )
+    return receipts
+
+
+def dispatch_sms_receipts(backend=None, batch_size=None, rate_limit=None, limit=DISPATCH_LIMIT):
+    """Send due SMS receipts in gateway batches; returns a DispatchResult"""
+    backend = backend or get_backend()
+    batch_size = batch_size or settings.SMS_BATCH_SIZE
+    limiter = RateLimiter(rate_limit if rate_limit is not None else settings.SMS_RATE_LIMIT)
+    result = DispatchResult()
+
+    receipts = claim_due_receipts(limit)
+    for start in range(0, len(receipts), batch_size):
+        batch = {str(receipt.pk): receipt for receipt in receipts[start:start + batch_size]}
+        messages = [
+            SMSMessage(normalize_phone(receipt.recipient_phone), receipt_sms_text(receipt.order), reference)
+            for reference, receipt in batch.items()
+        ]
+        limiter.wait()
+        result.requests += 1
+        try:
+            outcomes = backend.send_messages(messages)
+        except Exception as e:
+            outcomes = [SMSResult(message.reference, False, error=str(e)) for message in messages]
+        now = timezone.now()
+        for outcome in outcomes:
+            status = _apply_result(batch[outcome.reference], outcome, now)
+            setattr(result, status, getattr(result, status) + 1)
+
+        # Recorded per batch, so a crash later on doesn't resend this one
+        OrderReceipt.objects.bulk_update(list(batch.values()), [
+            'sms_status', 'sms_attempts', 'sms_next_attempt_at', 'sms_message_id', 'sms_error', 'sent_at',
+        ])
+        complete_receipts([receipt.order_id for receipt in batch.values() if receipt.sms_status == 'sent'])
+    return result
+
+
+def _dispatch_and_log():
+    result = dispatch_sms_receipts()
+    if result.requests:
+        logger.info(
+            "SMS receipts: %d sent, %d retrying, %d failed in %d requests",
+            result.sent, result.retried, result.failed, result.requests
+        )
+
+
+def start_sms_dispatcher(interval):
+    """Start the in-process SMS dispatch thread"""
+    return start_worker('sms-receipts', _dispatch_and_log, interval)
@@ -0,0 +1,57 @@
+"""
+Plate stock movements.
+
+Checkouts used to read a DailyMenuItem, add to plates_ordered in Python and
+save() it back, so two concurrent checkouts could both see the last plate
+and one increment would overwrite the other. Every stock movement is now a
+single UPDATE of plates_ordered with F() expressions: reserve_plates() only
+succeeds where enough plates remain (the database re-checks the condition
+on the locked row), and release_plates() hands plates back in one
+statement. The database trigger from migration 0016 derives
+plates_remaining, switches is_available off at zero and back on once
+released plates make an item it switched off orderable again, and the
+plates_remaining >= 0 CHECK constraint backs up the condition.
+"""
+from django.db.models import Case, F, When
+
+from .models import DailyMenuItem
+
+
+class OutOfStock(Exception):
+    """A menu item no longer has the plates a checkout asked for"""
+
+    def __init__(self, menu_item_id):
+        super().__init__(menu_item_id)
+        self.menu_item_id = menu_item_id
+
+
+def reserve_plates(quantities):
+    """
+    Take {menu_item_id: quantity} plates, all or nothing.
+
+    Raises OutOfStock for the first item that cannot cover its quantity;
+    call inside a transaction so the items reserved before it roll back.
+    Items are updated in id order so concurrent checkouts lock rows in the
+    same order and cannot deadlock.
+    """
+    for menu_item_id, quantity in sorted(quantities.items()):
+        reserved = DailyMenuItem.objects.filter(
+            id=menu_item_id,
+            is_available=True,
+            plates_remaining__gte=quantity,
+        ).update(plates_ordered=F('plates_ordered') + quantity)
+        if not reserved:
+            raise OutOfStock(menu_item_id)
+
+
+def release_plates(quantities):
+    """Give {menu_item_id: quantity} plates back in one UPDATE"""
+    quantities = {item_id: quantity for item_id, quantity in quantities.items() if quantity}
+    if not quantities:
+        return
+    DailyMenuItem.objects.filter(id__in=quantities).update(
+        plates_ordered=Case(
+            *[When(id=item_id, then=F('plates_ordered') - quantity)
+              for item_id, quantity in quantities.items()]
+        ),
+    )
@@ -0,0 +1,367 @@
+"""
+Concurrent checkout stress harness.
+
+run_checkout_stress() drives the real place_order and mpesa_callback views
+(through the test client, so middleware and sessions are included) from
+many threads at once against a few menu items with only a handful of
+plates each. A local stub Daraja server answers the OAuth and STK push
+calls. Checkout threads feed callback threads, and some callbacks are
+delivered twice the way Daraja retries them. Callback threads feed serve
+threads, which scan every confirmed order twice. Afterwards the stock,
+rollups and order change feed are checked against the orders that actually
+exist.
+
+It needs a database that several connections can share: Postgres or a
+file-backed SQLite database, never the in-memory one.
+"""
+import json
+import queue
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+
+from django.db import DatabaseError, connection, connections
+from django.db.models import Sum
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .bench import seed_bench_menu
+from .models import Category, DailyMenu, DailySalesRollup, Order, OrderEvent, OrderItem
+
+
+# Statuses whose plates are still counted in plates_ordered
+HOLDING_STATUSES = Order.LIVE_STATUSES + ['ready', 'served']
+CALLBACK_RETRIES = 5
+
+
+class StubDaraja:
+    """Local stand-in for the Daraja OAuth and STK push endpoints"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.pushes = 0
+        sequence = count(1)
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def reply(self, payload):
+                if stub.latency:
+                    time.sleep(stub.latency)
+                body = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self.reply({'access_token': 'stub-token', 'expires_in': '3599'})
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers['Content-Length']))
+                number = next(sequence)
+                stub.pushes += 1
+                self.reply({
+                    'ResponseCode': '0',
+                    'MerchantRequestID': f'stub-merchant-{number}',
+                    'CheckoutRequestID': f'ws_CO_stub_{number}',
+                    'CustomerMessage': 'Success. Request accepted for processing',
+                })
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@dataclass
+class StressResult:
+    attempts: int = 0
+    placed: int = 0
+    sold_out: int = 0
+    rejected: int = 0
+    errors: int = 0
+    callbacks: int = 0
+    duplicate_callbacks: int = 0
+    callback_retries: int = 0
+    callback_errors: int = 0
+    serve_attempts: int = 0
+    served: int = 0
+    serve_errors: int = 0
+    checkout_seconds: float = 0.0
+    elapsed: float = 0.0
+    violations: list = field(default_factory=list)
+
+    @property
+    def throughput(self):
+        """Orders placed per second while checkouts were running"""
+        return self.placed / self.checkout_seconds if self.checkout_seconds else 0.0
+
+
+def _cart(menu_items, rng, max_items):
+    chosen = rng.sample(menu_items, rng.randint(1, min(max_items, len(menu_items))))
+    return {
+        str(item.pk): {
+            'menu_item_id': item.pk,
+            'food_item_id': item.food_item_id,
+            'food_item_name': item.food_item.name,
+            'food_item_slug': item.food_item.slug,
+            'price': str(item.food_item.price_per_plate),
+            'quantity': 1,
+            'subtotal': str(item.food_item.price_per_plate),
+            'daily_menu_id': item.daily_menu_id,
+        }
+        for item in chosen
+    }
+
+
+def _callback_body(checkout_request_id, paid):
+    callback = {
+        'MerchantRequestID': 'stub-merchant',
+        'CheckoutRequestID': checkout_request_id,
+        'ResultCode': 0 if paid else 1032,
+        'ResultDesc': 'The service request is processed successfully.' if paid else 'Request cancelled by user',
+    }
+    if paid:
+        callback['CallbackMetadata'] = {'Item': [
+            {'Name': 'MpesaReceiptNumber', 'Value': f'S{checkout_request_id[-9:].upper()}'},
+            {'Name': 'PhoneNumber', 'Value': 254700000000},
+        ]}
+    return json.dumps({'Body': {'stkCallback': callback}})
+
+
+def check_invariants(menu, serve_claims):
+    """Violated invariants, as readable strings (empty when stock is sound)"""
+    violations = []
+    live = dict(
+        OrderItem.objects.filter(order__daily_menu=menu, order__status__in=HOLDING_STATUSES)
+        .values_list('daily_menu_item_id').annotate(plates=Sum('quantity')).order_by()
+    )
+    for item in menu.menu_items.select_related('food_item'):
+        name = item.food_item.name
+        if item.plates_ordered != live.get(item.pk, 0):
+            violations.append(
+                f'{name}: plates_ordered={item.plates_ordered} but live orders hold {live.get(item.pk, 0)}'
+            )
+        if item.plates_remaining < 0:
+            violations.append(f'{name}: plates_remaining={item.plates_remaining}')
+        if item.plates_remaining != item.total_plates_available - item.plates_ordered:
+            violations.append(
+                f'{name}: plates_remaining={item.plates_remaining} != '
+                f'{item.total_plates_available} - {item.plates_ordered}'
+            )
+
+    for order_code, claims in serve_claims.items():
+        if claims > 1:
+            violations.append(f'Order {order_code} was served {claims} times')
+
+    served = OrderItem.objects.filter(order__daily_menu=menu, order__status='served').aggregate(
+        plates=Sum('quantity')
+    )['plates'] or 0
+    rolled_up = DailySalesRollup.objects.filter(
+        date=menu.date, meal_period=menu.meal_period
+    ).aggregate(plates=Sum('plates_served'))['plates'] or 0
+    if served != rolled_up:
+        violations.append(f'Served plates: {served} in orders but {rolled_up} in the sales rollups')
+
+    sold = OrderItem.objects.filter(
+        order__daily_menu=menu, order__status__in=['confirmed', 'ready', 'served']
+    ).aggregate(plates=Sum('quantity'))['plates'] or 0
+    rolled_up = DailySalesRollup.objects.filter(
+        date=menu.date, meal_period=menu.meal_period
+    ).aggregate(plates=Sum('plates_sold'))['plates'] or 0
+    if sold != rolled_up:
+        violations.append(f'Sold plates: {sold} in orders but {rolled_up} in the sales rollups')
+
+    # Each order's last change feed event leaves it where it is
+    fed_status = dict(
+        OrderEvent.objects.filter(order__daily_menu=menu).order_by('id').values_list('order_id', 'to_status')
+    )
+    for order_id, order_code, status in Order.objects.filter(daily_menu=menu).values_list('id', 'order_code', 'status'):
+        if fed_status.get(order_id, 'pending') != status:
+            violations.append(
+                f'Order {order_code} is {status} but the change feed last said {fed_status.get(order_id, "pending")}'
+            )
+    return violations
+
+
+def run_checkout_stress(workers=8, checkouts=200, items=3, plates=10, max_cart=2,
+                        fail_rate=0.2, duplicate_rate=0.3, latency=0.0, seed=None, keep=False):
+    """
+    Race `checkouts` checkouts from `workers` threads for `items` menu items
+    of `plates` plates each, then check the invariants.
+
+    The menu lives on a date ten years out, so it cannot collide with real
+    menus; it is deleted afterwards unless keep=True.
+    """
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+        raise ValueError('The stress run needs a shared database; in-memory SQLite is per connection.')
+
+    rng = random.Random(seed)
+    result = StressResult()
+    bench_date = timezone.now().date() + timedelta(days=3650)
+    created_category = not Category.objects.filter(name='Bench').exists()
+    DailyMenu.objects.filter(date=bench_date).delete()
+    DailySalesRollup.objects.filter(date=bench_date).delete()
+    menu = seed_bench_menu(date=bench_date, items=items, plates_per_sufuria=plates, sufuria_count=1)
+    menu_items = list(menu.menu_items.select_related('food_item'))
+
+    lock = threading.Lock()
+    serve_claims = Counter()
+    delivered = set()
+    callbacks = queue.Queue()
+    serves = queue.Queue()
+    remaining = iter(range(checkouts))
+    start = threading.Barrier(workers * 3)
+
+    def tally(**counts):
+        with lock:
+            for name, value in counts.items():
+                setattr(result, name, getattr(result, name) + value)
+
+    def checkout_worker(worker_rng):
+        client = Client()
+        try:
+            start.wait()
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        return
+                try:
+                    session = client.session
+                    session['cart'] = _cart(menu_items, worker_rng, max_cart)
+                    session.save()
+                    response = client.post(reverse('place_order'), {
+                        'phone_number': '254700000000',
+                        'registration_number': 'SC211-0000-2022',
+                        'full_name': 'Stress Student',
+                    })
+                except DatabaseError:
+                    # SQLite's "database is locked" outside the view's own handler
+                    tally(attempts=1, errors=1)
+                    continue
+                payload = response.json()
+                if response.status_code == 200:
+                    tally(attempts=1, placed=1)
+                    paid = worker_rng.random() >= fail_rate
+                    deliveries = 2 if worker_rng.random() < duplicate_rate else 1
+                    for _ in range(deliveries):
+                        callbacks.put((payload['order_code'], payload['checkout_request_id'], paid))
+                elif response.status_code == 409 or 'no longer available' in payload['message']:
+                    tally(attempts=1, sold_out=1)
+                elif response.status_code < 500:
+                    tally(attempts=1, rejected=1)
+                else:
+                    tally(attempts=1, errors=1)
+        finally:
+            connections.close_all()
+
+    def callback_worker():
+        client = Client()
+        try:
+            start.wait()
+            while True:
+                job = callbacks.get()
+                if job is None:
+                    return
+                order_code, checkout_request_id, paid = job
+                body = _callback_body(checkout_request_id, paid)
+                for attempt in range(CALLBACK_RETRIES):
+                    try:
+                        response = client.post(reverse('mpesa_callback'), body, content_type='application/json')
+                        if response.json()['ResultCode'] == 0:
+                            break
+                    except DatabaseError:
+                        pass
+                    # Daraja retries failed callbacks; so do we
+                    tally(callback_retries=1)
+                    time.sleep(0.05 * (attempt + 1))
+                else:
+                    tally(callback_errors=1)
+                    continue
+                with lock:
+                    if order_code in delivered:
+                        result.duplicate_callbacks += 1
+                    else:
+                        result.callbacks += 1
+                        delivered.add(order_code)
+                if paid:
+                    # Two attendants scan every paid order at the same time
+                    serves.put(order_code)
+                    serves.put(order_code)
+        finally:
+            connections.close_all()
+
+    def serve_worker():
+        try:
+            start.wait()
+            while True:
+                order_code = serves.get()
+                if order_code is None:
+                    return
+                tally(serve_attempts=1)
+                try:
+                    order = Order.objects.get(order_code=order_code)
+                    claimed = order.status == 'confirmed' and order.mark_as_served(None)
+                except DatabaseError:
+                    tally(serve_errors=1)
+                    continue
+                if claimed:
+                    with lock:
+                        result.served += 1
+                        serve_claims[order_code] += 1
+        finally:
+            connections.close_all()
+
+    def spawn(target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        return thread
+
+    try:
+        with StubDaraja(latency) as daraja, override_settings(
+            MPESA_AUTH_URL=f'{daraja.url}/oauth',
+            MPESA_STK_PUSH_URL=f'{daraja.url}/stkpush',
+        ):
+            started = time.perf_counter()
+            checkout_threads = [spawn(checkout_worker, random.Random(rng.random())) for _ in range(workers)]
+            callback_threads = [spawn(callback_worker) for _ in range(workers)]
+            serve_threads = [spawn(serve_worker) for _ in range(workers)]
+
+            for thread in checkout_threads:
+                thread.join()
+            result.checkout_seconds = time.perf_counter() - started
+            for _ in callback_threads:
+                callbacks.put(None)
+            for thread in callback_threads:
+                thread.join()
+            for _ in serve_threads:
+                serves.put(None)
+            for thread in serve_threads:
+                thread.join()
+            result.elapsed = time.perf_counter() - started
+
+        result.violations = check_invariants(menu, serve_claims)
+    finally:
+        if not keep:
+            menu.delete()
+            DailySalesRollup.objects.filter(date=bench_date).delete()
+            if created_category:
+                Category.objects.filter(name='Bench').delete()
+    return result
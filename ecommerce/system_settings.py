@@ -0,0 +1,96 @@
+"""
+Typed access to the SystemSettings table.
+
+Admins edit settings as text rows; the code reads them through
+get_setting(), which returns the value coerced to the setting's type, or
+its default when the row is missing, inactive or unparseable. All active
+rows are loaded and coerced together into a LocalCache, so after the first
+read a lookup costs no query until a SystemSettings row is saved (see
+invalidation.py).
+
+Only keys registered in SETTINGS can be read. Rows for other keys (the
+M-Pesa credentials, the mess location) are kept for reference only.
+"""
+import logging
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Any, Callable
+
+from django.core.exceptions import ValidationError
+
+from .invalidation import LocalCache
+from .models import SystemSettings
+
+
+logger = logging.getLogger(__name__)
+
+
+def to_bool(value):
+    normalised = value.strip().lower()
+    if normalised in ('1', 'true', 'yes', 'on'):
+        return True
+    if normalised in ('0', 'false', 'no', 'off'):
+        return False
+    raise ValueError(f"{value!r} is not a yes/no value")
+
+
+def to_positive_int(value):
+    number = int(value.strip())
+    if number < 1:
+        raise ValueError(f"{value!r} is not a positive whole number")
+    return number
+
+
+def to_hours(value):
+    hours = float(value.strip())
+    if hours <= 0:
+        raise ValueError(f"{value!r} is not a positive number of hours")
+    return timedelta(hours=hours)
+
+
+@dataclass(frozen=True)
+class Setting:
+    key: str
+    coerce: Callable[[str], Any]
+    default: Any
+
+
+SETTINGS = {
+    setting.key: setting for setting in [
+        Setting('max_plates_per_item', to_positive_int, 1),
+        Setting('enable_guest_orders', to_bool, True),
+        Setting('order_expiry_hours', to_hours, timedelta(hours=24)),
+    ]
+}
+
+
+def validate_setting(key, value):
+    """Raise ValidationError if `value` can't be read as registered setting `key`"""
+    setting = SETTINGS.get(key)
+    if setting is None:
+        return
+    try:
+        setting.coerce(value)
+    except ValueError as e:
+        raise ValidationError({'value': str(e)})
+
+
+def _load():
+    values = {key: setting.default for key, setting in SETTINGS.items()}
+    rows = SystemSettings.objects.filter(is_active=True, key__in=SETTINGS).values_list('key', 'value')
+    for key, value in rows:
+        try:
+            values[key] = SETTINGS[key].coerce(value)
+        except ValueError:
+            logger.warning("Ignoring system setting %s=%r; using the default %r", key, value, values[key])
+    return values
+
+
+_values = LocalCache(SystemSettings)
+
+
+def get_setting(key):
+    """The current value of registered setting `key`"""
+    if key not in SETTINGS:
+        raise KeyError(f"Unknown system setting {key!r}")
+    return _values.get('active', _load)[key]
@@ -0,0 +1,43 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from ecommerce.images import derivative_url
+
+
+register = template.Library()
+
+# Matches the product grid: row-cols-1 / sm-2 / md-3 / lg-4 / xl-5
+DEFAULT_SIZES = (
+    '(max-width: 575px) 100vw, (max-width: 767px) 50vw, '
+    '(max-width: 991px) 33vw, (max-width: 1199px) 25vw, 20vw'
+)
+
+
+@register.simple_tag
+def food_image(food_item, sizes=DEFAULT_SIZES, **attrs):
+    """
+    <picture> with WebP and JPEG srcsets for a FoodItem image.
+
+    Falls back to the original upload until derivatives have been generated.
+    Extra keyword arguments become <img> attributes (class="tab-image").
+    """
+    extra = format_html_join('', ' {}="{}"', attrs.items())
+    if not food_item.image_digest:
+        return format_html(
+            '<img src="{}" alt="{}" loading="lazy"{}>',
+            food_item.image.url, food_item.name, extra
+        )
+
+    widths = [int(width) for width in food_item.image_widths.split(',')]
+    digest = food_item.image_digest
+
+    def srcset(ext):
+        return ', '.join(f'{derivative_url(digest, width, ext)} {width}w' for width in widths)
+
+    fallback = widths[len(widths) // 2]
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" alt="{}" loading="lazy" decoding="async"{}></picture>',
+        srcset('webp'), sizes,
+        derivative_url(digest, fallback, 'jpg'), srcset('jpg'), sizes, food_item.name, extra
+    )
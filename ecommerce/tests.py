@@ -1,3 +1,2305 @@
-from django.test import TestCase
+import csv
+import gzip
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time as clock
+from datetime import time, timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, IntegrityError, connection, connections, transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.template import engines
+from django.template.base import Template
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.text import slugify
+from PIL import Image
+
+from . import invalidation, urls
+from .analytics import _sold_out_times, compute_waste_analytics, waste_analytics
+from .archive import archive_closed_orders, spanning_orders, user_order_querysets
+from .caches import active_meal_periods, site_data
+from .events import read_order_events, wait_for_order_events
+from .expiry import sweep_expired_orders
+from .exports import export_rows, gzip_stream, stream_export
+from .images import derivative_name, process_food_item_image
+from .invalidation import bus
+from .menu_builder import apply_templates, build_menus, clone_menu, clone_previous_day, date_range
+from .metrics import RequestMetricsMiddleware, registry
+from .models import (
+    Category, SubCategory, FoodItem, MealPeriod, DailyMenu, DailyMenuItem, DailySalesRollup,
+    StudentProfile, Order, OrderItem, OrderReceipt, MPesaTransaction, MessStaff, CacheVersion, SystemSettings,
+    OrderEvent, OutboxEmail, MealCloseSnapshot, MenuTemplate, MenuTemplateItem, ArchivedOrder, ArchivedOrderItem, ArchivedMPesaTransaction, ArchivedOrderEvent
+)
+from .onboarding import ADMIN_IMPORT_WORKERS, import_students, read_student_csv
+from .outbox import MAX_ATTEMPTS, drain_outbox, enqueue_email, retry_delay
+from .pagination import keyset_page
+from .rollups import period_range, rebuild_rollups, report_csv, sales_report
+from .routers import PIN_COOKIE, replica_alias, reset_replica_lag
+from .singleflight import SingleflightCache
+from .sms import BaseSMSBackend, HttpBackend, SMSResult, dispatch_sms_receipts
+from .stock import OutOfStock, release_plates, reserve_plates
+from .storage import StaticFilesStorage
+from .stress import run_checkout_stress
+from .system_settings import get_setting
+from .tracing import SpanBuffer, buffer as trace_buffer, phase_summary, span, trace
+
+
+# Tests roll back their writes, cache version bumps included, so in-process
+# caches re-check the versions on every read instead of every few seconds
+_fresh_caches = override_settings(CACHE_INVALIDATION_POLL_INTERVAL=0)
+
+
+def setUpModule():
+    _fresh_caches.enable()
+    bus.reset()
+    cache.clear()
+
+
+def tearDownModule():
+    _fresh_caches.disable()
+
+
+def create_menu_fixture(date=None, item_count=5):
+    """A lunch menu with a few food items, built the normal way"""
+    lunch = MealPeriod.objects.create(
+        name='lunch',
+        start_time=time(0, 0),
+        end_time=time(23, 59),
+        ordering_start_time=time(0, 0),
+        ordering_end_time=time(23, 59),
+        serving_start_time=time(0, 0),
+        serving_end_time=time(23, 59),
+    )
+    category = Category.objects.create(name='Main Dishes')
+    SubCategory.objects.create(category=category, name='Rice Dishes')
+    menu = DailyMenu.objects.create(
+        date=date or timezone.now().date(),
+        meal_period=lunch,
+        is_published=True,
+    )
+    for index in range(item_count):
+        food_item = FoodItem.objects.create(
+            category=category,
+            name=f'Food {index}',
+            price_per_plate=Decimal('50.00'),
+        )
+        DailyMenuItem.objects.create(
+            daily_menu=menu,
+            food_item=food_item,
+            sufuria_count=10,
+            plates_per_sufuria=50,
+        )
+    return menu
+
+
+def bulk_create_orders(menu, count, students=None, batch_size=2000):
+    """Insert `count` orders with one item each, bypassing save()"""
+    menu_items = list(menu.menu_items.select_related('food_item'))
+    students = students or [None]
+    expires_at = timezone.now() + timedelta(hours=2)
+    orders = []
+    for index in range(count):
+        student = students[index % len(students)]
+        code = f'T{index:011d}'
+        orders.append(Order(
+            order_code=code,
+            slug=code.lower(),
+            user=student.user if student else None,
+            student_profile=student,
+            guest_registration_number='' if student else 'SC211-9999-2022',
+            daily_menu=menu,
+            total_amount=Decimal('50.00'),
+            status='confirmed',
+            items_summary=menu_items[index % len(menu_items)].food_item.name,
+            item_count=1,
+            expires_at=expires_at,
+        ))
+    orders = Order.objects.bulk_create(orders, batch_size=batch_size)
+
+    items = []
+    for index, order in enumerate(orders):
+        menu_item = menu_items[index % len(menu_items)]
+        item = OrderItem(
+            order=order,
+            daily_menu_item=menu_item,
+            food_item=menu_item.food_item,
+            price_per_plate=menu_item.food_item.price_per_plate,
+        )
+        item.fill_derived_fields()
+        items.append(item)
+    OrderItem.objects.bulk_create(items, batch_size=batch_size)
+    return orders
+
+
+class AdminChangelistQueryTests(TestCase):
+    """Changelist pages must cost a fixed number of queries at any table size"""
+    ROWS = 10000
+    # Session, auth, site_context and list_filter choices account for most
+    # of this; a per-row query would blow it on the first 100-row page
+    QUERY_BUDGET = 15
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = User.objects.create_superuser('admin', 'admin@mut.ac.ke', 'admin123')
+        cls.menu = create_menu_fixture()
+        students = []
+        for index in range(20):
+            user = User.objects.create_user(f'student{index}', password='student123')
+            students.append(StudentProfile.objects.create(
+                user=user,
+                registration_number=f'SC211-{index:04d}-2022',
+            ))
+        bulk_create_orders(cls.menu, cls.ROWS, students=students)
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def assertChangelistWithinBudget(self, model_name):
+        url = reverse(f'admin:ecommerce_{model_name}_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(
+            len(queries), self.QUERY_BUDGET,
+            f'{model_name} changelist ran {len(queries)} queries:\n'
+            + '\n'.join(query['sql'] for query in queries.captured_queries)
+        )
+
+    def test_order_changelist(self):
+        self.assertChangelistWithinBudget('order')
+
+    def test_orderitem_changelist(self):
+        self.assertChangelistWithinBudget('orderitem')
+
+    def test_studentprofile_changelist(self):
+        self.assertChangelistWithinBudget('studentprofile')
+
+    def test_dailymenu_changelist(self):
+        self.assertChangelistWithinBudget('dailymenu')
+
+    def test_dailymenuitem_changelist(self):
+        self.assertChangelistWithinBudget('dailymenuitem')
+
+    def test_category_changelist(self):
+        self.assertChangelistWithinBudget('category')
+
+    def test_fooditem_changelist(self):
+        self.assertChangelistWithinBudget('fooditem')
+
+
+# Page templates that are not part of this tree render as a bare base.html
+# page, so the layout and context processor queries are still counted
+STAND_IN_TEMPLATES = {
+    name: "{% extends 'base.html' %}"
+    for name in [
+        'accounts/login.html', 'accounts/register.html', 'mess/about.html',
+        'mess/cart.html', 'mess/category_detail.html', 'mess/category_list.html',
+        'mess/checkout.html', 'mess/contact.html', 'mess/my_orders.html',
+        'mess/order_detail.html', 'mess/order_success.html', 'mess/privacy.html',
+        'mess/product_detail.html', 'mess/product_list.html', 'mess/search_results.html',
+        'mess/staff_dashboard.html', 'mess/terms.html', 'mess/verify_order.html',
+    ]
+}
+
+VIEW_TEMPLATES = [{
+    **settings.TEMPLATES[0],
+    'APP_DIRS': False,
+    'OPTIONS': {
+        **settings.TEMPLATES[0]['OPTIONS'],
+        'loaders': [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+            ('django.template.loaders.locmem.Loader', STAND_IN_TEMPLATES),
+        ],
+    },
+}]
+
+# Hard query ceilings per URL and visitor. Each row is
+# (url name, url kwargs, method, body, {role: max queries}); kwargs are
+# formatted with the seeded fixture ids. A view that starts running more
+# queries fails here with its SQL listed; raise a budget only on purpose.
+# Status changes count one more on Postgres, which locks the order change
+# feed before appending to it.
+VIEW_QUERY_BUDGETS = [
+    # Home & products
+    ('index', {}, 'get', None, {'anonymous': 21, 'student': 22}),
+    ('product_list', {}, 'get', None, {'anonymous': 12, 'student': 13}),
+    ('product_detail', {'slug': '{food_slug}'}, 'get', None, {'anonymous': 15, 'student': 16}),
+    ('category_list', {}, 'get', None, {'anonymous': 9, 'student': 10}),
+    ('category_detail', {'slug': '{category_slug}'}, 'get', None, {'anonymous': 13, 'student': 14}),
+    ('search', {}, 'get', {'q': 'Food 1'}, {'anonymous': 11, 'student': 12}),
+    # Authentication
+    ('register', {}, 'get', None, {'anonymous': 9, 'student': 5}),
+    ('login', {}, 'get', None, {'anonymous': 9, 'student': 5}),
+    ('logout', {}, 'get', None, {'anonymous': 3, 'student': 4}),
+    # Cart
+    ('cart', {}, 'get', None, {'anonymous': 10, 'student': 11}),
+    ('add_to_cart', {}, 'json', {'menu_item_id': '{spare_menu_item}', 'quantity': 1}, {'anonymous': 8, 'student': 8}),
+    ('update_cart', {}, 'json', {'menu_item_id': '{cart_menu_item}'}, {'anonymous': 4, 'student': 4}),
+    ('remove_from_cart', {}, 'json', {'menu_item_id': '{cart_menu_item}'}, {'anonymous': 4, 'student': 4}),
+    ('clear_cart', {}, 'get', None, {'anonymous': 4, 'student': 4}),
+    ('cart_count', {}, 'get', None, {'anonymous': 4, 'student': 4}),
+    # Checkout & orders
+    ('checkout', {}, 'get', None, {'anonymous': 10, 'student': 12}),
+    ('place_order', {}, 'post', {
+        'phone_number': '254712345678', 'registration_number': 'SC211-0001-2022', 'full_name': 'Test Student',
+    }, {'anonymous': 19, 'student': 21}),
+    ('order_success', {'order_code': '{order_code}'}, 'get', None, {'anonymous': 10, 'student': 12}),
+    ('order_detail', {'order_code': '{order_code}'}, 'get', None, {'anonymous': 10, 'student': 14}),
+    ('my_orders', {}, 'get', None, {'anonymous': 4, 'student': 12}),
+    # M-Pesa
+    ('mpesa_callback', {}, 'json', {'Body': {'stkCallback': {
+        'MerchantRequestID': 'merchant-1', 'CheckoutRequestID': '{checkout_request_id}',
+        'ResultCode': 0, 'ResultDesc': 'Success',
+        'CallbackMetadata': {'Item': [{'Name': 'MpesaReceiptNumber', 'Value': 'QX12345678'}]},
+    }}}, {'anonymous': 19}),
+    ('check_payment_status', {'order_code': '{order_code}'}, 'get', None, {'anonymous': 5, 'student': 5}),
+    # Staff
+    ('staff_dashboard', {}, 'get', None, {'anonymous': 4, 'student': 6, 'staff': 16}),
+    ('verify_order', {}, 'post', {'order_code': '{order_code}'}, {'anonymous': 4, 'student': 6, 'staff': 23}),
+    ('export_data', {'kind': 'orders'}, 'get', None, {'anonymous': 4, 'student': 5, 'staff': 7}),
+    ('sales_report', {}, 'get', None, {'anonymous': 4, 'student': 5, 'staff': 7}),
+    ('metrics', {}, 'get', None, {'anonymous': 4, 'student': 5, 'staff': 5}),
+    # API
+    ('check_item_availability', {'menu_item_id': '{cart_menu_item}'}, 'get', None, {'anonymous': 7, 'student': 7}),
+    ('meal_period_status', {}, 'get', None, {'anonymous': 5, 'student': 5}),
+    ('order_events', {}, 'get', None, {'anonymous': 4, 'student': 5, 'staff': 6}),
+    # Utility pages
+    ('about', {}, 'get', None, {'anonymous': 9, 'student': 10}),
+    ('contact', {}, 'get', None, {'anonymous': 9, 'student': 10}),
+    ('terms', {}, 'get', None, {'anonymous': 9, 'student': 10}),
+    ('privacy', {}, 'get', None, {'anonymous': 9, 'student': 10}),
+]
+
+
+class StubDarajaResponse:
+    def __init__(self, payload):
+        self.payload = payload
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+def stub_daraja_get(*args, **kwargs):
+    return StubDarajaResponse({'access_token': 'test-token'})
+
+
+def stub_daraja_post(*args, **kwargs):
+    return StubDarajaResponse({
+        'ResponseCode': '0',
+        'MerchantRequestID': 'merchant-2',
+        'CheckoutRequestID': 'ws_CO_test_2',
+    })
+
+
+# Budgets count queries on the primary, and a replica connection could not
+# see this TestCase's uncommitted fixtures anyway. In-process caches keep
+# the production poll interval, so requests are measured with warm caches.
+@override_settings(TEMPLATES=VIEW_TEMPLATES, REPLICA_DATABASE=None, CACHE_INVALIDATION_POLL_INTERVAL=2)
+class ViewQueryBudgetTests(TestCase):
+    """Every URL stays within its query budget against a realistically sized database"""
+    MENU_ITEMS = 300
+    ORDERS = 3000
+    CART_ITEMS = 5
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.menu = create_menu_fixture(item_count=cls.MENU_ITEMS)
+        students = []
+        for index in range(20):
+            user = User.objects.create_user(f'student{index}', password='student123')
+            students.append(StudentProfile.objects.create(
+                user=user,
+                registration_number=f'SC211-{index:04d}-2022',
+            ))
+        cls.student = students[0].user
+        orders = bulk_create_orders(cls.menu, cls.ORDERS, students=students + [None])
+        guest_order = next(order for order in orders if order.user_id is None)
+        student_order = next(order for order in orders if order.user_id == cls.student.pk)
+
+        cls.staff = User.objects.create_user('attendant', password='attendant123', is_staff=True)
+        MessStaff.objects.create(user=cls.staff, role='attendant', employee_id='EMP-001', phone_number='254700000001')
+
+        pending = Order.objects.filter(pk=guest_order.pk)
+        pending.update(status='pending')
+        MPesaTransaction.objects.create(
+            order=guest_order,
+            merchant_request_id='merchant-1',
+            checkout_request_id='ws_CO_test_1',
+            phone_number='254712345678',
+            amount=guest_order.total_amount,
+            status='pending',
+        )
+
+        menu_items = list(cls.menu.menu_items.select_related('food_item__category'))
+        cls.cart = {
+            str(item.pk): {
+                'menu_item_id': item.pk,
+                'food_item_id': item.food_item_id,
+                'food_item_name': item.food_item.name,
+                'food_item_slug': item.food_item.slug,
+                'price': str(item.food_item.price_per_plate),
+                'quantity': 1,
+                'subtotal': str(item.food_item.price_per_plate),
+                'daily_menu_id': cls.menu.pk,
+            }
+            for item in menu_items[:cls.CART_ITEMS]
+        }
+        shared = {
+            'food_slug': menu_items[0].food_item.slug,
+            'category_slug': menu_items[0].food_item.category.slug,
+            'cart_menu_item': menu_items[0].pk,
+            'spare_menu_item': menu_items[-1].pk,
+            'checkout_request_id': 'ws_CO_test_1',
+        }
+        cls.fixture = {
+            'anonymous': {**shared, 'order_code': guest_order.order_code},
+            'student': {**shared, 'order_code': student_order.order_code},
+            'staff': {**shared, 'order_code': student_order.order_code},
+        }
+
+    def setUp(self):
+        # Drop rows cached from other tests' rolled back fixtures, then warm up
+        # the in-process caches; shared cache entries start cold
+        bus.reset()
+        cache.clear()
+        active_meal_periods()
+        get_setting('max_plates_per_item')
+
+    def resolve(self, value, role):
+        if isinstance(value, dict):
+            return {key: self.resolve(item, role) for key, item in value.items()}
+        if isinstance(value, str) and value.startswith('{') and value.endswith('}'):
+            return self.fixture[role][value[1:-1]]
+        return value
+
+    def request(self, role, name, kwargs, method, body):
+        self.client.logout()
+        if role == 'student':
+            self.client.force_login(self.student)
+        elif role == 'staff':
+            self.client.force_login(self.staff)
+        session = self.client.session
+        session['cart'] = self.cart
+        session.save()
+
+        url = reverse(name, kwargs=self.resolve(kwargs, role))
+        body = self.resolve(body, role)
+        # Each request runs in a rolled back savepoint so none sees another's writes
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                if method == 'json':
+                    response = self.client.post(url, json.dumps(body), content_type='application/json')
+                else:
+                    response = getattr(self.client, method)(url, body)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            transaction.set_rollback(True)
+        return response, queries
+
+    def assertViewsWithinBudget(self, role):
+        with mock.patch('ecommerce.views.requests.get', stub_daraja_get), \
+                mock.patch('ecommerce.views.requests.post', stub_daraja_post):
+            for name, kwargs, method, body, budgets in VIEW_QUERY_BUDGETS:
+                if role not in budgets:
+                    continue
+                with self.subTest(view=name, role=role):
+                    response, queries = self.request(role, name, kwargs, method, body)
+                    self.assertNotIn(response.status_code, (404, 500), f'{name} as {role}')
+                    self.assertLessEqual(
+                        len(queries), budgets[role],
+                        f'{name} as {role} ran {len(queries)} queries (budget {budgets[role]}):\n'
+                        + '\n'.join(query['sql'] for query in queries.captured_queries)
+                    )
+
+    def test_every_url_has_a_budget(self):
+        budgeted = {row[0]: row[4] for row in VIEW_QUERY_BUDGETS}
+        for pattern in urls.urlpatterns:
+            self.assertIn(pattern.name, budgeted, f'{pattern.name} has no query budget')
+            self.assertIn('anonymous', budgeted[pattern.name])
+
+    def test_anonymous_budgets(self):
+        self.assertViewsWithinBudget('anonymous')
+
+    def test_student_budgets(self):
+        self.assertViewsWithinBudget('student')
+
+    def test_staff_budgets(self):
+        self.assertViewsWithinBudget('staff')
+
+
+# Tables that grow with every order; small lookup tables are fine to scan
+LARGE_TABLES = {
+    model._meta.db_table for model in (DailyMenu, DailyMenuItem, Order, OrderItem, MPesaTransaction)
+}
+
+
+def full_table_scans(plan):
+    """Large tables a query plan reads in full (SQLite "SCAN t", Postgres "Seq Scan on t")"""
+    return [
+        sqlite_table or postgres_table
+        for sqlite_table, postgres_table in re.findall(r'\bSCAN (\w+)$|Seq Scan on (\w+)', plan, re.MULTILINE)
+        if (sqlite_table or postgres_table) in LARGE_TABLES
+    ]
+
+
+# Hot query shapes, built the way the views, the expiry sweep and payment
+# reconciliation build them
+HOT_QUERIES = [
+    ('todays_menu', lambda f: DailyMenu.objects.filter(
+        date=f.today, meal_period=f.menu.meal_period, is_published=True, is_active=True,
+    )),
+    ('menu_in_stock', lambda f: f.menu.menu_items.filter(is_available=True, plates_remaining__gt=0)),
+    ('my_orders_page', lambda f: user_order_querysets(f.student)[0].order_by('-ordered_at', '-id')[:21]),
+    ('staff_orders_today', lambda f: Order.objects.filter(daily_menu__date=f.today)),
+    ('staff_orders_by_status', lambda f: Order.objects.filter(daily_menu__date=f.today, status='confirmed')),
+    ('order_by_code', lambda f: Order.objects.filter(order_code=f.order_code)),
+    ('callback_transaction', lambda f: MPesaTransaction.objects.filter(checkout_request_id='ws_CO_00000042')),
+    ('merchant_transaction', lambda f: MPesaTransaction.objects.filter(merchant_request_id='merchant-00000042')),
+    ('stale_transactions', lambda f: MPesaTransaction.objects.filter(
+        status='pending', created_at__lt=timezone.now() - timedelta(minutes=5),
+    )),
+    ('expiry_sweep', lambda f: Order.objects.filter(
+        status__in=Order.LIVE_STATUSES, expires_at__lt=timezone.now(),
+    ).order_by('expires_at')),
+]
+
+PARTIAL_INDEXES = {
+    index.name
+    for model in (DailyMenu, DailyMenuItem, Order, OrderItem, MPesaTransaction)
+    for index in model._meta.indexes if index.condition
+}
+
+# SQLite only uses a partial index when it can prove the predicate from the
+# query text, which a bound IN list never does; Postgres plans with the values
+PARTIAL_IN_QUERIES = {'expiry_sweep'}
+
+
+class IndexPlanTests(TestCase):
+    """Hot queries are answered from indexes, not sequential scans"""
+    DAYS = 14
+    ORDERS = 14000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = timezone.now().date()
+        cls.menu = create_menu_fixture(date=cls.today, item_count=40)
+        past_menus = clone_menu(cls.menu, [cls.today - timedelta(days=day) for day in range(1, cls.DAYS)])
+        for menu in past_menus:
+            # Most of a past menu sold out
+            menu.menu_items.filter(pk__in=menu.menu_items.values('pk')[:35]).update(
+                plates_ordered=F('total_plates_available'),
+            )
+
+        user = User.objects.create_user('student', password='student123')
+        cls.student = user
+        student = StudentProfile.objects.create(user=user, registration_number='SC211-0001-2022')
+        orders = bulk_create_orders(cls.menu, cls.ORDERS, students=[student, None, None, None])
+        cls.order_code = orders[-1].order_code
+
+        # Spread the orders over two weeks, mostly settled, like production
+        per_day = cls.ORDERS // cls.DAYS
+        for index, menu in enumerate(past_menus, start=1):
+            Order.objects.filter(pk__in=[order.pk for order in orders[index * per_day:(index + 1) * per_day]]).update(
+                daily_menu=menu, status='served', expires_at=timezone.now() - timedelta(days=index),
+            )
+        MPesaTransaction.objects.bulk_create([
+            MPesaTransaction(
+                order=order,
+                merchant_request_id=f'merchant-{index:08d}',
+                checkout_request_id=f'ws_CO_{index:08d}',
+                phone_number='254712345678',
+                amount=order.total_amount,
+                status='pending' if index % 500 == 0 else 'completed',
+                slug=f'{order.slug}-txn',
+            )
+            for index, order in enumerate(orders)
+        ], batch_size=2000)
+
+        # Let the planner see the real row counts
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def test_hot_queries_use_indexes(self):
+        for name, build in HOT_QUERIES:
+            with self.subTest(query=name):
+                if connection.vendor == 'sqlite' and name in PARTIAL_IN_QUERIES:
+                    self.skipTest('SQLite cannot match a bound IN list to a partial index')
+                plan = build(self).explain()
+                self.assertEqual(full_table_scans(plan), [], f'{name} scans a whole table:\n{plan}')
+
+    def test_no_duplicate_indexes(self):
+        """No plain index repeats the leading columns of another index on its table"""
+        with connection.cursor() as cursor:
+            for table in sorted(LARGE_TABLES):
+                constraints = connection.introspection.get_constraints(cursor, table)
+                indexes = {
+                    name: (tuple(info['columns']), info['unique'])
+                    for name, info in constraints.items()
+                    # Partial indexes and Postgres' LIKE (pattern_ops) copies serve other queries
+                    if (info['index'] or info['unique']) and not info['primary_key']
+                    and name not in PARTIAL_INDEXES and not name.endswith('_like')
+                }
+                for name, (columns, unique) in indexes.items():
+                    if unique:
+                        continue
+                    for other, (other_columns, _) in indexes.items():
+                        if other != name and other_columns[:len(columns)] == columns:
+                            self.fail(f'{table}.{name} {columns} repeats the start of {other} {other_columns}')
+
+
+class StubSMSGateway:
+    """Local HTTP bulk-send gateway recording every request it receives"""
+
+    def __init__(self, fail_numbers=(), status=200):
+        self.requests = []
+        self.fail_numbers = set(fail_numbers)
+        self.status = status
+        gateway = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                gateway.requests.append(payload)
+                body = json.dumps({'results': [
+                    {
+                        'reference': message['reference'],
+                        'status': 'failed' if message['to'] in gateway.fail_numbers else 'sent',
+                        'message_id': f"stub-{message['reference']}",
+                        'error': 'Invalid number' if message['to'] in gateway.fail_numbers else '',
+                    }
+                    for message in payload['messages']
+                ]}).encode()
+                self.send_response(gateway.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/send'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class EmailOutboxTests(TestCase):
+    """Queued emails are delivered, retried with backoff, and given up on"""
+
+    def queue(self, count=2):
+        return [
+            enqueue_email('contact', f'Message {index}', 'Hello', [f'student{index}@example.com'])
+            for index in range(count)
+        ]
+
+    def test_due_emails_are_sent_over_one_connection(self):
+        self.queue()
+        result = drain_outbox()
+        self.assertEqual((result.sent, result.retried, result.failed), (2, 0, 0))
+        self.assertEqual([message.subject for message in mail.outbox], ['Message 0', 'Message 1'])
+        self.assertFalse(OutboxEmail.objects.exclude(status='sent').exists())
+
+    def test_send_failures_back_off(self):
+        self.queue(1)
+        started = timezone.now()
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=OSError('mailbox full')):
+            self.assertEqual(drain_outbox().retried, 1)
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.status, email.attempts, email.last_error), ('pending', 1, 'mailbox full'))
+        self.assertGreaterEqual(email.next_attempt_at, started + retry_delay(1))
+        # Not due again until the backoff passes
+        self.assertEqual(drain_outbox().sent, 0)
+
+    def test_unreachable_server_counts_an_attempt_for_the_batch(self):
+        self.queue()
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open',
+                        side_effect=ConnectionRefusedError('no route')), \
+                self.assertLogs('ecommerce.outbox', 'WARNING'):
+            self.assertEqual(drain_outbox().retried, 2)
+        self.assertEqual(list(OutboxEmail.objects.values_list('attempts', 'status')), [(1, 'pending')] * 2)
+        self.assertFalse(OutboxEmail.objects.filter(next_attempt_at__lte=timezone.now()).exists())
+
+    def test_emails_fail_after_max_attempts(self):
+        self.queue(1)
+        OutboxEmail.objects.update(attempts=MAX_ATTEMPTS - 1)
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages',
+                        side_effect=OSError('mailbox full')):
+            self.assertEqual(drain_outbox().failed, 1)
+        self.assertEqual(OutboxEmail.objects.get().status, 'failed')
+
+
+STUDENT_CSV = """registration_number,first_name,last_name,email,phone_number,course,year_of_study,username,password
+sc211-0001-2024,Amina,Wanjiru,amina@mut.ac.ke,0712000001,BSc IT,1,,
+SC211-0002-2024,Brian,Otieno,brian@mut.ac.ke,0712000002,BSc IT,1,brian,secret123
+SC211-0003-2024,Carol,Njeri,carol@mut.ac.ke,0712000003,BCom,one,,
+SC211-0004,Dan,Kip,dan@mut.ac.ke,0712000004,BCom,1,,
+SC211-0005-2024,Eve,Mumbi,,0712000005,BCom,1,,
+SC211-0001-2024,Amina,Again,amina2@mut.ac.ke,0712000006,BSc IT,1,,
+SC211-0006-2024,Fred,Brian,fred@mut.ac.ke,0712000007,BCom,2,brian,
+SC211-0007-2024,Grace,Achieng,taken@mut.ac.ke,0712000008,BCom,2,,
+SC211-0008-2024,Hassan,Ali,hassan@mut.ac.ke,0712000009,BSc IT,3,,
+SC211-0009-2024,Irene,Chebet,irene@mut.ac.ke,0712000010,BSc IT,3,,
+SC211-0010-2024,Joy,Wambui,irene@mut.ac.ke,0712000011,BCom,1,,
+"""
+
+
+# Hashing cost is not under test
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class StudentImportTests(TestCase):
+    """A CSV intake is validated, deduped and inserted in chunks with welcome emails queued"""
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user('existing', email='taken@mut.ac.ke', password='student123')
+        cls.rows = read_student_csv(io.StringIO(STUDENT_CSV))
+
+    def test_validates_dedupes_and_creates(self):
+        result = import_students(self.rows, workers=1, chunk_size=2)
+        self.assertEqual(result.created, 4)
+        self.assertEqual(result.invalid, [
+            (4, 'SC211-0003-2024', 'Year of study must be a number'),
+            (5, 'SC211-0004', 'Invalid registration number format'),
+            (6, 'SC211-0005-2024', 'Missing email'),
+            (7, 'SC211-0001-2024', 'Repeated in file'),
+            (8, 'SC211-0006-2024', 'Username repeated in file'),
+            (12, 'SC211-0010-2024', 'Email repeated in file'),
+        ])
+        self.assertEqual(User.objects.filter(email='irene@mut.ac.ke').count(), 1)
+        self.assertEqual(result.duplicates, ['SC211-0007-2024'])
+
+        amina = StudentProfile.objects.select_related('user').get(registration_number='SC211-0001-2024')
+        self.assertEqual((amina.user.username, amina.slug, amina.year_of_study), ('sc211-0001-2024', 'sc211-0001-2024', 1))
+        self.assertTrue(User.objects.get(username='brian').check_password('secret123'))
+
+        # A second run finds everyone already registered
+        again = import_students(self.rows, workers=1)
+        self.assertEqual((again.created, len(again.duplicates)), (0, 5))
+
+    def test_inserts_in_chunks(self):
+        with CaptureQueriesContext(connection) as queries:
+            import_students(self.rows, send_welcome=False, workers=1, chunk_size=3)
+        inserts = [query['sql'] for query in queries if query['sql'].startswith('INSERT')]
+        # Four students in chunks of three: two user and two profile inserts
+        self.assertEqual(len(inserts), 4)
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_welcome_emails_are_queued(self):
+        import_students(self.rows, workers=1)
+        emails = {email.recipients: email for email in OutboxEmail.objects.filter(kind='welcome')}
+        self.assertEqual(sorted(emails), ['amina@mut.ac.ke', 'brian@mut.ac.ke', 'hassan@mut.ac.ke', 'irene@mut.ac.ke'])
+        self.assertEqual(len(mail.outbox), 0)
+        # No outbox row, sent or not, ever holds a password
+        self.assertFalse(OutboxEmail.objects.filter(body__icontains='password:').exists())
+        self.assertFalse(OutboxEmail.objects.filter(body__contains='secret123').exists())
+        self.assertNotIn('/password-reset/', emails['brian@mut.ac.ke'].body)
+
+        # Students without one in the file set their own password from the link
+        amina = User.objects.get(username='sc211-0001-2024')
+        self.assertFalse(amina.has_usable_password())
+        link = re.search(r'https://your-domain\.com(/password-reset/\S+)', emails['amina@mut.ac.ke'].body).group(1)
+        response = self.client.get(link, follow=True)
+        self.assertTrue(response.context['validlink'])
+        self.client.post(response.redirect_chain[-1][0], {'new_password1': 'Mess!2024pass', 'new_password2': 'Mess!2024pass'})
+        amina.refresh_from_db()
+        self.assertTrue(amina.check_password('Mess!2024pass'))
+
+    def test_admin_import_hashes_in_a_small_pool(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@mut.ac.ke', 'admin123')
+        self.client.force_login(admin_user)
+        upload = SimpleUploadedFile('intake.csv', STUDENT_CSV.encode(), content_type='text/csv')
+        with mock.patch('ecommerce.admin.import_students', wraps=import_students) as importer:
+            response = self.client.post(reverse('admin:ecommerce_studentprofile_import'),
+                                        {'csv_file': upload, 'send_welcome': 'on'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(importer.call_args.kwargs['workers'], ADMIN_IMPORT_WORKERS)
+        self.assertEqual(response.context['result'].created, 4)
+
+        # Links point at the host the admin was used on
+        email = OutboxEmail.objects.get(recipients='amina@mut.ac.ke')
+        self.assertIn('http://testserver/password-reset/', email.body)
+        response = self.client.get(reverse('admin:ecommerce_outboxemail_change', args=[email.pk]))
+        self.assertNotIn('body', response.context['adminform'].form.fields)
+
+
+class SMSReceiptDispatchTests(TestCase):
+    """Pending SMS receipts go out in rate-limited gateway batches"""
+
+    @classmethod
+    def setUpTestData(cls):
+        menu = create_menu_fixture()
+        orders = bulk_create_orders(menu, 250)
+        cls.receipts = OrderReceipt.objects.bulk_create([
+            OrderReceipt(
+                order=order,
+                receipt_type='sms',
+                recipient_phone=f'2547{index:08d}',
+                slug=f'receipt-{order.slug}',
+                sms_status='pending',
+                sms_next_attempt_at=timezone.now(),
+            )
+            for index, order in enumerate(orders)
+        ])
+
+    def dispatch(self, gateway, **kwargs):
+        backend = HttpBackend(url=gateway.url, api_key='test', sender='TEST')
+        kwargs.setdefault('rate_limit', 0)
+        return dispatch_sms_receipts(backend, **kwargs)
+
+    def test_batches_recipients_per_request(self):
+        with StubSMSGateway() as gateway:
+            result = self.dispatch(gateway, batch_size=100)
+        self.assertEqual(result.requests, 3)
+        self.assertEqual(result.sent, 250)
+        self.assertEqual([len(r['messages']) for r in gateway.requests], [100, 100, 50])
+        self.assertEqual(OrderReceipt.objects.filter(is_sent=True, sms_status='sent').count(), 250)
+
+    def test_failed_recipients_are_retried_later(self):
+        with StubSMSGateway(fail_numbers={'+254700000003'}) as gateway:
+            result = self.dispatch(gateway)
+            self.assertEqual((result.sent, result.retried), (249, 1))
+
+            failed = OrderReceipt.objects.get(recipient_phone='254700000003')
+            self.assertEqual(failed.sms_status, 'pending')
+            self.assertEqual(failed.sms_attempts, 1)
+            self.assertFalse(failed.is_sent)
+            self.assertGreater(failed.sms_next_attempt_at, timezone.now())
+
+            # Nothing is due again until the backoff expires
+            self.assertEqual(self.dispatch(gateway).requests, 0)
+
+    def test_gateway_error_retries_whole_batch(self):
+        with StubSMSGateway(status=503) as gateway:
+            result = self.dispatch(gateway, batch_size=100)
+        self.assertEqual(result.retried, 250)
+        self.assertEqual(OrderReceipt.objects.filter(sms_status='pending', sms_attempts=1).count(), 250)
+
+    def test_requests_are_rate_limited(self):
+        with StubSMSGateway() as gateway:
+            started = clock.monotonic()
+            self.dispatch(gateway, batch_size=50, rate_limit=20)
+            elapsed = clock.monotonic() - started
+        # Five requests at 20/s need at least four 50ms gaps
+        self.assertEqual(len(gateway.requests), 5)
+        self.assertGreaterEqual(elapsed, 0.2)
+
+
+class CallbackSMSBackend(BaseSMSBackend):
+    """Delivers every message after running `during_send`"""
+
+    def __init__(self, during_send):
+        self.during_send = during_send
+
+    def send_messages(self, messages):
+        self.during_send()
+        return [SMSResult(message.reference, True) for message in messages]
+
+
+class ReceiptCompletionTests(TestCase):
+    """An email-and-SMS receipt is sent once both went out, whichever finishes last"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.order = bulk_create_orders(create_menu_fixture(), 1)[0]
+        enqueue_email('receipt', 'Order Receipt', 'Thanks', ['student@mut.ac.ke'], order=cls.order)
+        cls.receipt = OrderReceipt.objects.create(
+            order=cls.order, receipt_type='both', recipient_email='student@mut.ac.ke',
+            recipient_phone='254712345678', sms_status='pending', sms_next_attempt_at=timezone.now(),
+        )
+
+    def assertReceiptSent(self, sent):
+        self.receipt.refresh_from_db()
+        self.assertEqual(self.receipt.is_sent, sent)
+
+    def test_sms_then_email(self):
+        dispatch_sms_receipts(CallbackSMSBackend(lambda: None), rate_limit=0)
+        self.assertReceiptSent(False)
+        drain_outbox()
+        self.assertReceiptSent(True)
+
+    def test_email_then_sms(self):
+        drain_outbox()
+        self.assertReceiptSent(False)
+        dispatch_sms_receipts(CallbackSMSBackend(lambda: None), rate_limit=0)
+        self.assertReceiptSent(True)
+
+    def test_email_sent_while_the_sms_is_in_flight(self):
+        transactions_open = len(connection.atomic_blocks)
+
+        def drain_during_send():
+            # The dispatcher holds no transaction, so no row lock, while it sends
+            self.assertEqual(len(connection.atomic_blocks), transactions_open)
+            # and other dispatchers won't pick the claimed receipt up meanwhile
+            self.assertFalse(OrderReceipt.objects.filter(sms_next_attempt_at__lte=timezone.now()).exists())
+            self.assertEqual(drain_outbox().sent, 1)
+            self.assertReceiptSent(False)
+
+        result = dispatch_sms_receipts(CallbackSMSBackend(drain_during_send), rate_limit=0)
+        self.assertEqual(result.sent, 1)
+        self.assertReceiptSent(True)
+
+
+class StockConsistencyTests(TestCase):
+    """Plates are taken and handed back atomically, and each order is served once"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.menu = create_menu_fixture(item_count=2)
+        cls.plentiful, cls.scarce = cls.menu.menu_items.order_by('pk')
+        DailyMenuItem.objects.filter(pk=cls.scarce.pk).update(plates_remaining=2, plates_ordered=498)
+        # place_order() takes two plates of one item
+        SystemSettings.objects.create(key='max_plates_per_item', value='2')
+
+    def test_reserve_never_oversells(self):
+        reserve_plates({self.scarce.pk: 2})
+        with self.assertRaises(OutOfStock) as raised, transaction.atomic():
+            reserve_plates({self.plentiful.pk: 1, self.scarce.pk: 1})
+        self.assertEqual(raised.exception.menu_item_id, self.scarce.pk)
+
+        plentiful, scarce = self.menu.menu_items.order_by('pk')
+        self.assertEqual((scarce.plates_ordered, scarce.plates_remaining, scarce.is_available), (500, 0, False))
+        # The failed checkout's other item rolled back with it
+        self.assertEqual((plentiful.plates_ordered, plentiful.plates_remaining), (0, 500))
+
+    def test_release_returns_plates(self):
+        reserve_plates({self.plentiful.pk: 3, self.scarce.pk: 1})
+        release_plates({self.plentiful.pk: 3, self.scarce.pk: 1})
+        plentiful, scarce = self.menu.menu_items.order_by('pk')
+        self.assertEqual((plentiful.plates_ordered, plentiful.plates_remaining), (0, 500))
+        self.assertEqual((scarce.plates_ordered, scarce.plates_remaining), (498, 2))
+
+    def test_trigger_derives_stock_columns(self):
+        DailyMenuItem.objects.filter(pk=self.scarce.pk).update(plates_ordered=F('plates_ordered') + 2)
+        scarce = DailyMenuItem.objects.get(pk=self.scarce.pk)
+        self.assertEqual((scarce.plates_remaining, scarce.is_available), (0, False))
+
+        # Cooking another sufuria frees plates without touching plates_ordered
+        scarce.sufuria_count += 1
+        scarce.save()
+        self.assertEqual((scarce.total_plates_available, scarce.plates_ordered, scarce.plates_remaining),
+                         (550, 500, 50))
+
+    def test_released_plates_can_be_reserved_again(self):
+        reserve_plates({self.scarce.pk: 2})
+        scarce = DailyMenuItem.objects.get(pk=self.scarce.pk)
+        self.assertEqual((scarce.plates_remaining, scarce.is_available, scarce.auto_disabled), (0, False, True))
+
+        release_plates({self.scarce.pk: 1})
+        scarce.refresh_from_db()
+        self.assertEqual((scarce.plates_remaining, scarce.is_available, scarce.auto_disabled), (1, True, False))
+        reserve_plates({self.scarce.pk: 1})
+        scarce.refresh_from_db()
+        self.assertEqual((scarce.plates_remaining, scarce.is_available), (0, False))
+
+        # Cooking more reopens a sold out item too, even from a form that showed it off
+        scarce.sufuria_count += 1
+        scarce.save()
+        self.assertEqual((scarce.plates_remaining, scarce.is_available), (50, True))
+
+    def test_manual_switch_off_survives_released_plates(self):
+        DailyMenuItem.objects.filter(pk=self.scarce.pk).update(is_available=False)
+        DailyMenuItem.objects.filter(pk=self.scarce.pk).update(plates_ordered=F('plates_ordered') + 2)
+        release_plates({self.scarce.pk: 2})
+        scarce = DailyMenuItem.objects.get(pk=self.scarce.pk)
+        self.assertEqual((scarce.plates_remaining, scarce.is_available, scarce.auto_disabled), (2, False, False))
+        with self.assertRaises(OutOfStock):
+            reserve_plates({self.scarce.pk: 1})
+
+    def test_check_constraint_rejects_overselling(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            DailyMenuItem.objects.filter(pk=self.scarce.pk).update(plates_ordered=F('plates_ordered') + 3)
+
+    def test_save_keeps_concurrent_reservations(self):
+        stale = DailyMenuItem.objects.get(pk=self.plentiful.pk)
+        reserve_plates({self.plentiful.pk: 4})
+        stale.plates_per_sufuria = 60
+        stale.save()
+        self.assertEqual((stale.plates_ordered, stale.plates_remaining), (4, 596))
+
+    def place_order(self):
+        session = self.client.session
+        session['cart'] = {
+            str(self.plentiful.pk): {
+                'menu_item_id': self.plentiful.pk,
+                'food_item_id': self.plentiful.food_item_id,
+                'food_item_name': self.plentiful.food_item.name,
+                'food_item_slug': self.plentiful.food_item.slug,
+                'price': '50.00',
+                'quantity': 2,
+                'subtotal': '100.00',
+                'daily_menu_id': self.menu.pk,
+            }
+        }
+        session.save()
+        with mock.patch('ecommerce.views.requests.get', stub_daraja_get), \
+                mock.patch('ecommerce.views.requests.post', stub_daraja_post):
+            response = self.client.post(reverse('place_order'), {
+                'phone_number': '254712345678',
+                'registration_number': 'SC211-0001-2022',
+                'full_name': 'Test Student',
+            })
+        self.assertEqual(response.status_code, 200)
+        return Order.objects.get(order_code=response.json()['order_code'])
+
+    def deliver_callback(self, result_code):
+        return self.client.post(reverse('mpesa_callback'), json.dumps({'Body': {'stkCallback': {
+            'MerchantRequestID': 'merchant-2',
+            'CheckoutRequestID': 'ws_CO_test_2',
+            'ResultCode': result_code,
+            'ResultDesc': 'Done',
+        }}}), content_type='application/json')
+
+    def test_checkout_and_callback_traces_carry_the_order_code(self):
+        trace_buffer.clear()
+        order = self.place_order()
+        with mock.patch('ecommerce.views.render_to_string', return_value='Receipt'):
+            self.deliver_callback(0)
+
+        runs = {}
+        for record in trace_buffer.snapshot():
+            runs.setdefault(record.pipeline, set()).add((record.correlation_id, record.order_code))
+        # The STK push and the receipt joined the checkout and callback traces
+        self.assertEqual(set(runs), {'checkout', 'payment_callback'})
+        (checkout_id, checkout_code), = runs['checkout']
+        (callback_id, callback_code), = runs['payment_callback']
+        self.assertEqual((checkout_code, callback_code), (order.order_code, order.order_code))
+        self.assertRegex(checkout_id, r'^[0-9a-f]{12}$')
+        self.assertRegex(callback_id, r'^[0-9a-f]{12}$')
+        self.assertNotEqual(checkout_id, callback_id)
+
+    def test_repeated_failure_callback_releases_plates_once(self):
+        order = self.place_order()
+        self.assertEqual(DailyMenuItem.objects.get(pk=self.plentiful.pk).plates_ordered, 2)
+
+        self.deliver_callback(1032)
+        self.deliver_callback(1032)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'cancelled')
+        plentiful = DailyMenuItem.objects.get(pk=self.plentiful.pk)
+        self.assertEqual((plentiful.plates_ordered, plentiful.plates_remaining), (0, 500))
+
+    def test_receipt_failure_still_confirms_the_payment(self):
+        order = self.place_order()
+        student = User.objects.create_user('paying', email='paying@example.com')
+        Order.objects.filter(pk=order.pk).update(user=student)
+        # The receipt email templates ship with the deployment's theme
+        with mock.patch('ecommerce.views.render_to_string', return_value='Receipt'), \
+                mock.patch('ecommerce.views.OrderReceipt.objects.create', side_effect=IntegrityError('duplicate')), \
+                self.assertLogs('ecommerce.views', 'ERROR'):
+            self.deliver_callback(0)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'confirmed')
+        # The receipt email queued before the failure rolled back with it
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_order_is_served_once(self):
+        order = self.place_order()
+        self.deliver_callback(0)
+        self.deliver_callback(0)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'confirmed')
+
+        # Two attendants loaded the order before either served it
+        first_scan = Order.objects.get(pk=order.pk)
+        second_scan = Order.objects.get(pk=order.pk)
+        self.assertTrue(first_scan.mark_as_served(None))
+        self.assertFalse(second_scan.mark_as_served(None))
+        rollup = DailySalesRollup.objects.get(date=self.menu.date, food_item=self.plentiful.food_item)
+        self.assertEqual((rollup.plates_sold, rollup.plates_served), (2, 2))
+
+
+def place_test_order(menu, quantities):
+    """A pending order for {menu_item: plates}, holding its plates"""
+    order = Order.objects.create(daily_menu=menu, total_amount=sum(
+        item.food_item.price_per_plate * plates for item, plates in quantities.items()
+    ))
+    for item, plates in quantities.items():
+        OrderItem.objects.create(order=order, daily_menu_item=item, food_item=item.food_item,
+                                 quantity=plates, price_per_plate=item.food_item.price_per_plate)
+    reserve_plates({item.pk: plates for item, plates in quantities.items()})
+    return order
+
+
+def rollup_totals():
+    return {
+        (row.date, row.meal_period_id, row.food_item_id):
+            (row.plates_sold, row.revenue, row.plates_cancelled, row.plates_served)
+        for row in DailySalesRollup.objects.all()
+    }
+
+
+class SalesRollupTests(TestCase):
+    """Status changes keep the rollups equal to a rebuild from the orders"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.menu = create_menu_fixture(item_count=2)
+        cls.rice, cls.beans = cls.menu.menu_items.select_related('food_item').order_by('pk')
+
+    def confirm(self, order):
+        order.status = 'confirmed'
+        order.payment_date = order.confirmed_at = timezone.now()
+        order.save()
+
+    def assertMatchesRebuild(self):
+        incremental = rollup_totals()
+        rebuild_rollups()
+        self.assertEqual(incremental, rollup_totals())
+
+    def test_confirm_serve_and_cancel(self):
+        served = place_test_order(self.menu, {self.rice: 2, self.beans: 1})
+        cancelled = place_test_order(self.menu, {self.rice: 1})
+        self.confirm(served)
+        served.mark_as_served(None)
+        cancelled.status = 'cancelled'
+        cancelled.save()
+
+        rice = DailySalesRollup.objects.get(food_item=self.rice.food_item)
+        self.assertEqual((rice.plates_sold, rice.revenue, rice.plates_cancelled, rice.plates_served),
+                         (2, Decimal('100.00'), 1, 2))
+        self.assertMatchesRebuild()
+
+    def test_late_payment_of_an_expired_order_is_a_sale(self):
+        order = place_test_order(self.menu, {self.rice: 1})
+        Order.objects.filter(pk=order.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+        sweep_expired_orders()
+
+        # The payment callback confirms the order the sweep had expired
+        order = Order.objects.get(pk=order.pk)
+        self.assertEqual(order.status, 'expired')
+        self.confirm(order)
+        rice = DailySalesRollup.objects.get(food_item=self.rice.food_item)
+        self.assertEqual((rice.plates_sold, rice.revenue), (1, Decimal('50.00')))
+        self.assertMatchesRebuild()
+
+    def test_paid_order_expiring_uncollected_stays_a_sale(self):
+        order = place_test_order(self.menu, {self.beans: 3})
+        self.confirm(order)
+        order.status = 'expired'
+        order.save()
+        self.assertEqual(DailySalesRollup.objects.get(food_item=self.beans.food_item).plates_sold, 3)
+        self.assertMatchesRebuild()
+
+    def test_report_sums_rollups(self):
+        for plates in (1, 2):
+            self.confirm(place_test_order(self.menu, {self.rice: plates, self.beans: 1}))
+        rows, totals = sales_report(self.menu.date, self.menu.date)
+        self.assertEqual([row['plates_sold'] for row in rows], [3, 2])
+        self.assertEqual((totals['plates_sold'], totals['revenue']), (5, Decimal('250.00')))
+        total_row = report_csv(rows, totals, 'food_item').splitlines()[-1].split(',')
+        self.assertEqual((total_row[0], int(total_row[1]), Decimal(total_row[2])), ('TOTAL', 5, Decimal('250')))
+
+
+class ExpirySweepTests(TestCase):
+    """The sweeper expires overdue orders in batches and gives their plates back"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.menu = create_menu_fixture(item_count=2)
+        cls.rice, cls.beans = cls.menu.menu_items.order_by('pk')
+        cls.full_stock = cls.rice.plates_remaining
+
+    def overdue_order(self, plates=1, **changes):
+        order = place_test_order(self.menu, {self.rice: plates})
+        Order.objects.filter(pk=order.pk).update(**{'expires_at': timezone.now() - timedelta(minutes=1), **changes})
+        return order
+
+    def statuses(self, orders):
+        return list(Order.objects.filter(pk__in=[o.pk for o in orders]).order_by('pk').values_list('status', flat=True))
+
+    def test_past_expires_at_in_batches(self):
+        overdue = [self.overdue_order(plates) for plates in (1, 2, 3, 1, 2)]
+        current = place_test_order(self.menu, {self.rice: 4, self.beans: 1})
+
+        result = sweep_expired_orders(batch_size=2)
+        self.assertEqual((result.expired, result.plates_released, result.batches), (5, 9, 3))
+        self.assertEqual(self.statuses(overdue), ['expired'] * 5)
+        self.assertEqual(self.statuses([current]), ['pending'])
+
+        self.rice.refresh_from_db()
+        self.assertEqual(self.rice.plates_remaining, self.full_stock - 4)
+        events = read_order_events()
+        self.assertEqual(sorted(event.order_code for event in events), sorted(o.order_code for o in overdue))
+        self.assertEqual({(event.from_status, event.to_status) for event in events}, {('pending', 'expired')})
+
+        # Nothing is left to sweep
+        self.assertEqual(sweep_expired_orders().expired, 0)
+
+    def test_unpaid_for_order_expiry_hours(self):
+        ordered_at = timezone.now() - timedelta(hours=25)
+        later = {'expires_at': timezone.now() + timedelta(hours=1), 'ordered_at': ordered_at}
+        unpaid = self.overdue_order(2, **later)
+        paid = self.overdue_order(1, status='confirmed', **later)
+        recent = self.overdue_order(1, expires_at=later['expires_at'])
+
+        result = sweep_expired_orders()
+        self.assertEqual((result.expired, result.plates_released), (1, 2))
+        self.assertEqual(self.statuses([unpaid, paid, recent]), ['expired', 'confirmed', 'pending'])
+        self.assertEqual(read_order_events()[-1].order_code, unpaid.order_code)
+
+    def test_order_expiry_hours_setting(self):
+        SystemSettings.objects.create(key='order_expiry_hours', value='48')
+        unpaid = self.overdue_order(expires_at=timezone.now() + timedelta(hours=1),
+                                    ordered_at=timezone.now() - timedelta(hours=25))
+        self.assertEqual(sweep_expired_orders().expired, 0)
+        self.assertEqual(sweep_expired_orders(now=timezone.now() + timedelta(hours=24)).expired, 1)
+        self.assertEqual(self.statuses([unpaid]), ['expired'])
+
+
+class OrderArchiveTests(TestCase):
+    """Archiving moves closed meal periods to cold storage without losing reads"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.old_menu = create_menu_fixture(date=timezone.now().date() - timedelta(days=40), item_count=2)
+        cls.rice, cls.beans = cls.old_menu.menu_items.select_related('food_item').order_by('pk')
+        cls.user = User.objects.create_user('student1', password='student123')
+        cls.profile = StudentProfile.objects.create(user=cls.user, registration_number='SC211-0001-2022')
+
+        cls.orders = [
+            place_test_order(cls.old_menu, {cls.rice: 2, cls.beans: 1}),
+            place_test_order(cls.old_menu, {cls.rice: 1}),
+            place_test_order(cls.old_menu, {cls.beans: 3}),
+        ]
+        Order.objects.filter(pk__in=[order.pk for order in cls.orders]).update(user=cls.user, student_profile=cls.profile)
+        paid = Order.objects.get(pk=cls.orders[0].pk)
+        paid.status = 'confirmed'
+        paid.payment_date = paid.confirmed_at = timezone.now()
+        paid.mpesa_receipt_number = 'QX12345678'
+        paid.save()
+        MPesaTransaction.objects.create(
+            order=paid, checkout_request_id='ws_CO_archive', phone_number='254712345678',
+            amount=paid.total_amount, status='completed', mpesa_receipt_number='QX12345678',
+        )
+        OrderReceipt.objects.create(order=paid, receipt_type='email', recipient_email='student1@mut.ac.ke', is_sent=True)
+        cls.paid = paid
+
+        # Today's menu stays hot
+        cls.todays_menu = DailyMenu.objects.create(
+            date=timezone.now().date(), meal_period=cls.old_menu.meal_period, is_published=True
+        )
+        cls.todays_item = DailyMenuItem.objects.create(
+            daily_menu=cls.todays_menu, food_item=cls.rice.food_item, sufuria_count=1, plates_per_sufuria=10
+        )
+        cls.hot = place_test_order(cls.todays_menu, {cls.todays_item: 1})
+        Order.objects.filter(pk=cls.hot.pk).update(user=cls.user, student_profile=cls.profile)
+
+    def spanning_totals(self, **filters):
+        rows = spanning_orders(**filters)
+        return sorted(row['order_code'] for row in rows), sum(row['total_amount'] for row in rows)
+
+    def test_archive_moves_closed_orders_with_their_children(self):
+        hot_items = OrderItem.objects.filter(order__daily_menu=self.old_menu).count()
+        hot_events = OrderEvent.objects.filter(order__daily_menu=self.old_menu).count()
+        before = self.spanning_totals(daily_menu=self.old_menu)
+        first_page, _ = keyset_page(user_order_querysets(self.user), page_size=10)
+
+        self.assertEqual(archive_closed_orders(dry_run=True), 3)
+        self.assertEqual(Order.objects.count(), 4)
+        self.assertEqual(archive_closed_orders(batch_size=2), 3)
+
+        self.assertEqual(list(Order.objects.values_list('pk', flat=True)), [self.hot.pk])
+        self.assertEqual(ArchivedOrder.objects.count(), 3)
+        self.assertEqual(ArchivedOrderItem.objects.count(), hot_items)
+        self.assertEqual(ArchivedOrderEvent.objects.count(), hot_events)
+        self.assertEqual(ArchivedMPesaTransaction.objects.get().order_id, self.paid.pk)
+        self.assertFalse(OrderReceipt.objects.exists())
+        self.assertFalse(OrderEvent.objects.filter(order_code=self.paid.order_code).exists())
+
+        archived = ArchivedOrder.objects.get(pk=self.paid.pk)
+        self.assertEqual((archived.receipt_type, archived.receipt_sent, archived.receipt_email),
+                         ('email', True, 'student1@mut.ac.ke'))
+        self.assertEqual([event.to_status for event in archived.events.all()], ['confirmed'])
+        self.assertEqual(self.spanning_totals(daily_menu=self.old_menu), before)
+        self.assertEqual(self.spanning_totals(daily_menu__meal_period=self.old_menu.meal_period)[1],
+                         before[1] + self.hot.total_amount)
+
+        # my_orders reads the same rows, in the same order, from both tables
+        after, _ = keyset_page(user_order_querysets(self.user), page_size=10)
+        self.assertEqual([row.order_code for row in after], [row.order_code for row in first_page])
+        self.assertIsInstance(after[0], Order)
+        self.assertTrue(all(isinstance(row, ArchivedOrder) for row in after[1:]))
+
+    def test_nothing_recent_is_archived(self):
+        self.assertEqual(archive_closed_orders(older_than_days=60), 0)
+        self.assertEqual(Order.objects.count(), 4)
+
+    def place_profile_only_order(self):
+        """An old order carrying the student's profile but no user, like a guest checkout"""
+        order = place_test_order(self.old_menu, {self.beans: 1})
+        Order.objects.filter(pk=order.pk).update(student_profile=self.profile)
+        return order
+
+    def test_keyset_pages_cursor_through_ties_across_the_archive(self):
+        profile_only = self.place_profile_only_order()
+        other = User.objects.create_user('student2', password='student123')
+        stranger = place_test_order(self.old_menu, {self.rice: 1})
+        Order.objects.filter(pk=stranger.pk).update(user=other)
+        # Every order shares one ordered_at, so only the id breaks ties
+        Order.objects.update(ordered_at=timezone.now() - timedelta(days=40))
+        self.assertEqual(archive_closed_orders(), 5)
+
+        codes = []
+        cursor = None
+        while True:
+            page, cursor = keyset_page(user_order_querysets(self.user), cursor=cursor, page_size=2)
+            codes.extend(row.order_code for row in page)
+            if cursor is None:
+                break
+
+        expected = sorted(self.orders + [self.hot, profile_only], key=lambda order: order.pk, reverse=True)
+        self.assertEqual(codes, [order.order_code for order in expected])
+        self.assertNotIn(stranger.order_code, codes)
+
+    @override_settings(TEMPLATES=VIEW_TEMPLATES, REPLICA_DATABASE=None)
+    def test_my_orders_lists_orders_matched_by_profile(self):
+        profile_only = self.place_profile_only_order()
+        self.client.force_login(self.user)
+
+        response = self.client.get(reverse('my_orders'))
+        self.assertIn(profile_only.order_code, [order.order_code for order in response.context['orders']])
+
+        archive_closed_orders()
+        response = self.client.get(reverse('my_orders'))
+        codes = [order.order_code for order in response.context['orders']]
+        self.assertEqual(sorted(codes), sorted(order.order_code for order in self.orders + [self.hot, profile_only]))
+
+    @override_settings(TEMPLATES=VIEW_TEMPLATES)
+    def test_archived_orders_stay_viewable(self):
+        archive_closed_orders()
+        self.client.force_login(self.user)
+        for name in ('order_success', 'order_detail'):
+            response = self.client.get(reverse(name, kwargs={'order_code': self.paid.order_code}))
+            self.assertEqual(response.status_code, 200, name)
+            self.assertEqual(response.context['order'].pk, self.paid.pk)
+            self.assertEqual(len(response.context['order_items']), 2)
+        self.assertFalse(response.context['can_be_served'])
+
+        response = self.client.get(reverse('check_payment_status', kwargs={'order_code': self.paid.order_code}))
+        self.assertEqual(response.json()['mpesa_receipt'], 'QX12345678')
+        self.assertTrue(response.json()['paid'])
+
+        response = self.client.get(reverse('order_detail', kwargs={'order_code': 'NOSUCHCODE'}))
+        self.assertEqual(response.status_code, 404)
+
+
+class ExportTests(TestCase):
+    """Finance exports stream hot and archived rows, filtered, as CSV/JSONL, gzipped or not"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.old_menu = create_menu_fixture(date=timezone.now().date() - timedelta(days=40), item_count=2)
+        rice, beans = cls.old_menu.menu_items.select_related('food_item').order_by('pk')
+        cls.paid = place_test_order(cls.old_menu, {rice: 2, beans: 1})
+        cls.paid.status = 'confirmed'
+        cls.paid.payment_date = cls.paid.confirmed_at = timezone.now()
+        cls.paid.save()
+        MPesaTransaction.objects.create(
+            order=cls.paid, checkout_request_id='ws_CO_export', phone_number='254712345678',
+            amount=cls.paid.total_amount, status='completed', mpesa_receipt_number='QX12345678',
+        )
+        cls.unpaid = place_test_order(cls.old_menu, {beans: 1})
+        archive_closed_orders()
+
+        todays_menu = DailyMenu.objects.create(
+            date=timezone.now().date(), meal_period=cls.old_menu.meal_period, is_published=True
+        )
+        todays_item = DailyMenuItem.objects.create(
+            daily_menu=todays_menu, food_item=rice.food_item, sufuria_count=1, plates_per_sufuria=10
+        )
+        cls.hot = place_test_order(todays_menu, {todays_item: 3})
+        cls.staff = User.objects.create_user('accounts', password='accounts123', is_staff=True)
+
+    def codes(self, kind='orders', **filters):
+        return [row['order_code'] for row in export_rows(kind, **filters)]
+
+    def plain_export(self, kind, fmt):
+        return b''.join(stream_export(kind, fmt, compress=False))
+
+    def test_hot_rows_then_archived(self):
+        self.assertEqual(self.codes(), [self.hot.order_code, self.paid.order_code, self.unpaid.order_code])
+        archived = list(export_rows('orders'))[1]
+        self.assertEqual((archived['menu_date'], archived['meal_period'], archived['total_amount']),
+                         (self.old_menu.date, 'lunch', Decimal('150.00')))
+        self.assertEqual(len(self.codes('order-items')), 4)
+        self.assertEqual(self.codes('payments'), [self.paid.order_code])
+
+    def test_filters_apply_to_both_tables(self):
+        today = timezone.now().date()
+        self.assertEqual(self.codes(start=today), [self.hot.order_code])
+        self.assertEqual(self.codes(end=self.old_menu.date), [self.paid.order_code, self.unpaid.order_code])
+        self.assertEqual(self.codes(status='confirmed'), [self.paid.order_code])
+        self.assertEqual(self.codes('order-items', status='pending', start=today), [self.hot.order_code])
+        self.assertEqual(len(self.codes(meal_period='lunch')), 3)
+        self.assertEqual(self.codes(meal_period='supper'), [])
+
+    def test_csv_and_jsonl(self):
+        rows = list(export_rows('orders'))
+        parsed = list(csv.DictReader(io.StringIO(self.plain_export('orders', 'csv').decode())))
+        self.assertEqual([row['order_code'] for row in parsed], [row['order_code'] for row in rows])
+        self.assertEqual(parsed[1]['total_amount'], '150.00')
+        self.assertEqual(parsed[1]['menu_date'], str(self.old_menu.date))
+
+        lines = [json.loads(line) for line in self.plain_export('orders', 'jsonl').decode().splitlines()]
+        self.assertEqual([line['order_code'] for line in lines], [row['order_code'] for row in rows])
+        self.assertEqual(lines[1]['total_amount'], '150.00')
+
+    def test_gzip_decompresses_to_the_plain_export(self):
+        for fmt in ('csv', 'jsonl'):
+            compressed = b''.join(stream_export('order-items', fmt))
+            self.assertEqual(gzip.decompress(compressed), self.plain_export('order-items', fmt))
+        # Lines split across many flushed blocks still round trip
+        lines = [f'line {index}\n'.encode() for index in range(2000)]
+        self.assertEqual(gzip.decompress(b''.join(gzip_stream(lines, flush_bytes=100))), b''.join(lines))
+
+    # A replica could not see this TestCase's uncommitted fixtures
+    @override_settings(REPLICA_DATABASE=None)
+    def test_export_view_round_trip(self):
+        self.client.force_login(self.staff)
+        url = reverse('export_data', kwargs={'kind': 'orders'})
+        response = self.client.get(url, {'status': 'confirmed', 'end': str(self.old_menu.date)})
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn(f'orders_to-{self.old_menu.date}.csv.gz', response['Content-Disposition'])
+        body = gzip.decompress(b''.join(response.streaming_content)).decode()
+        self.assertEqual([row['order_code'] for row in csv.DictReader(io.StringIO(body))], [self.paid.order_code])
+
+        response = self.client.get(url, {'format': 'jsonl', 'gzip': '0'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(b''.join(response.streaming_content), self.plain_export('orders', 'jsonl'))
+
+        self.assertEqual(self.client.get(url, {'start': '19-10-2026'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('export_data', kwargs={'kind': 'menus'})).status_code, 404)
+
+
+class WasteAnalyticsTests(TestCase):
+    """Sell-out times and waste metrics match figures worked out by hand"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.menu = create_menu_fixture(item_count=2)
+        cls.rice, cls.beans = cls.menu.menu_items.select_related('food_item').order_by('pk')
+
+    def setUp(self):
+        cache.clear()
+
+    def order_at(self, minutes, quantities, status, paid=False):
+        order = place_test_order(self.menu, quantities)
+        ordered_at = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0) + timedelta(minutes=minutes)
+        Order.objects.filter(pk=order.pk).update(
+            status=status, ordered_at=ordered_at, payment_date=ordered_at if paid else None
+        )
+        return ordered_at
+
+    def test_sold_out_at_the_order_taking_the_last_plate(self):
+        self.order_at(1, {self.rice: 5}, 'pending')
+        self.order_at(5, {self.beans: 1}, 'served', paid=True)
+        self.order_at(10, {self.rice: 2}, 'confirmed', paid=True)
+        self.order_at(20, {self.rice: 1}, 'cancelled')
+        last_plate = self.order_at(30, {self.rice: 1}, 'expired', paid=True)
+        self.order_at(40, {self.rice: 1}, 'served', paid=True)
+
+        # Rice: 2 plates at :10, the cancelled and pending ones don't count, the 3rd goes at :30
+        sold_out = _sold_out_times([self.rice.pk, self.beans.pk], {self.rice.pk: 3, self.beans.pk: 5})
+        self.assertEqual(sold_out, {self.rice.pk: last_plate})
+        self.assertEqual(_sold_out_times([self.beans.pk], {self.beans.pk: 1}), {
+            self.beans.pk: timezone.now().replace(hour=12, minute=5, second=0, microsecond=0)
+        })
+
+    def test_metrics_per_food_item_and_meal_period(self):
+        rows = [
+            # (food item, meal period, available, ordered, served, sold out after minutes)
+            (1, 10, 100, 100, 90, 30),
+            (1, 10, 100, 80, 70, None),
+            (2, 10, 50, 10, 10, None),
+            (1, 20, 40, 40, 40, 15),
+            (1, 20, 40, 40, 38, 45),
+        ]
+        results = {(row['food_item_id'], row['meal_period_id']): row for row in compute_waste_analytics(rows)}
+        self.assertEqual(results[1, 10], {
+            'food_item_id': 1, 'meal_period_id': 10, 'meals': 2,
+            'plates_available': 200, 'plates_served': 160, 'plates_left': 40,
+            'waste_rate': 0.2, 'utilization': 0.8, 'sell_out_rate': 0.5,
+            'avg_sell_out_minutes': 30.0, 'avg_surplus_plates': 20.0,
+        })
+        self.assertEqual(
+            (results[2, 10]['waste_rate'], results[2, 10]['avg_sell_out_minutes'], results[2, 10]['avg_surplus_plates']),
+            (0.8, None, 40.0)
+        )
+        self.assertEqual(
+            (results[1, 20]['sell_out_rate'], results[1, 20]['avg_sell_out_minutes'], results[1, 20]['waste_rate']),
+            (1.0, 30.0, 0.025)
+        )
+        self.assertEqual(compute_waste_analytics([]), [])
+
+    def test_a_single_bound_is_honoured(self):
+        semester_start, _ = period_range('semester', timezone.localdate())
+        last_semester = semester_start - timedelta(days=10)
+        for day, served in ((last_semester, 40), (semester_start, 10)):
+            MealCloseSnapshot.objects.create(
+                date=day, meal_period=self.menu.meal_period, food_item=self.rice.food_item,
+                plates_available=50, plates_ordered=served, plates_served=served,
+            )
+
+        def served(**bounds):
+            return [row['plates_served'] for row in waste_analytics(**bounds)]
+
+        self.assertEqual(served(), [10])
+        self.assertEqual(served(start=last_semester), [50])
+        self.assertEqual(served(end=last_semester), [40])
+        self.assertEqual(served(start=semester_start, end=semester_start), [10])
+
+
+@override_settings(TEMPLATES=VIEW_TEMPLATES, REPLICA_DATABASE=None)
+class RequestMetricsTests(TestCase):
+    """The metrics middleware files queries, render time and streamed work under the view"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('attendant', password='attendant123', is_staff=True)
+        menu = create_menu_fixture(item_count=2)
+        bulk_create_orders(menu, 30)
+
+    def setUp(self):
+        registry.reset()
+        self.addCleanup(registry.reset)
+
+    def observed(self, view):
+        """(requests, queries, render seconds) recorded for `view`"""
+        latency, queries, _, render = registry._histograms[view]
+        return latency.count, queries.sum, render.sum
+
+    def test_queries_and_render_time_per_view(self):
+        render = Template.render
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('about')).status_code, 200)
+        requests, query_count, render_time = self.observed('about')
+        self.assertEqual((requests, query_count), (1, len(queries)))
+        self.assertGreater(render_time, 0)
+        # Templates are timed by the backend, not by patching Template
+        self.assertIs(Template.render, render)
+        self.assertIn('http_responses_total{view="about",status="200"} 1', registry.render())
+
+    def test_streamed_export_counted_when_finished(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('export_data', kwargs={'kind': 'order-items'}), {'gzip': '0'})
+        self.assertNotIn('export_data', registry._histograms)
+        with CaptureQueriesContext(connection) as streamed:
+            rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(rows), 31)
+        self.assertTrue(streamed.captured_queries)
+        requests, query_count, _ = self.observed('export_data')
+        self.assertEqual(requests, 1)
+        self.assertGreaterEqual(query_count, len(streamed))
+
+    @override_settings(METRICS_QUERY_BUDGET=1)
+    def test_over_budget_requests_are_logged(self):
+        with self.assertLogs('ecommerce.metrics', 'WARNING') as logs:
+            self.client.get(reverse('product_list'))
+        self.assertIn('(product_list) ran', logs.output[0])
+
+    def test_overhead_per_request(self):
+        request = RequestFactory().get('/')
+        response = HttpResponse()
+        middleware = RequestMetricsMiddleware(lambda request: response)
+
+        def per_request(handler, count=2000):
+            best = float('inf')
+            for _ in range(5):
+                started = clock.perf_counter()
+                for _ in range(count):
+                    handler(request)
+                best = min(best, (clock.perf_counter() - started) / count)
+            return best
+
+        overhead = per_request(middleware) - per_request(lambda request: response)
+        self.assertLess(overhead, 50e-6, f'{overhead * 1e6:.1f}µs per request')
+
+
+class TracingTests(TestCase):
+    """Traces keep one correlation id, tag the order code and feed the span buffer"""
+
+    def setUp(self):
+        trace_buffer.clear()
+        self.addCleanup(trace_buffer.clear)
+
+    def test_ring_buffer_keeps_the_latest_spans(self):
+        ring = SpanBuffer(3)
+        ring.extend(range(2))
+        ring.extend(range(2, 5))
+        self.assertEqual(ring.snapshot(), [2, 3, 4])
+        ring.clear()
+        self.assertEqual(ring.snapshot(), [])
+
+    def test_nested_traces_share_one_id(self):
+        with self.assertLogs('ecommerce.tracing', 'INFO') as logs:
+            with trace('checkout') as outer:
+                correlation_id = outer.correlation_id
+                with span('validate_cart'):
+                    pass
+                with trace('stk_push', order_code='ABC123DEF456') as inner, span('stk_push'):
+                    self.assertIs(inner, outer)
+        self.assertEqual(outer.correlation_id, correlation_id)
+        self.assertEqual(
+            [(record.phase, record.correlation_id, record.order_code) for record in trace_buffer.snapshot()],
+            [(phase, correlation_id, 'ABC123DEF456') for phase in ('validate_cart', 'stk_push', 'total')]
+        )
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual((line['correlation_id'], line['order_code']), (correlation_id, 'ABC123DEF456'))
+        self.assertEqual([phase['phase'] for phase in line['phases']], ['validate_cart', 'stk_push'])
+
+    def test_only_failed_traces_log_at_warning(self):
+        with self.assertNoLogs('ecommerce.tracing', 'WARNING'), trace('receipt', order_code='ABC123DEF456'):
+            pass
+        with self.assertLogs('ecommerce.tracing', 'WARNING') as logs, self.assertRaises(ValueError):
+            with trace('receipt') as failed, span('queue_email'):
+                raise ValueError('no template')
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual((line['correlation_id'], line['error']), (failed.correlation_id, True))
+
+        summary = {row['phase']: row for row in phase_summary()}
+        self.assertEqual((summary['total']['count'], summary['total']['errors']), (2, 1))
+        self.assertEqual((summary['queue_email']['count'], summary['queue_email']['errors']), (1, 1))
+
+
+class DerivedFieldQueryTests(TestCase):
+    """Inserts derive slugs and totals without loading related rows"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.menu = create_menu_fixture(item_count=1)
+        cls.menu_item = cls.menu.menu_items.select_related('food_item').get()
+        cls.category = Category.objects.get()
+
+    # The cache version bump of catalog saves is counted by CacheInvalidationTests
+    @mock.patch('ecommerce.invalidation.publish')
+    def test_each_insert_is_one_query(self, publish):
+        with self.assertNumQueries(1):
+            subcategory = SubCategory.objects.create(category=self.category, name='Stews')
+        with self.assertNumQueries(1):
+            food_item = FoodItem.objects.create(
+                category=self.category, subcategory=subcategory, name='Beef Stew', price_per_plate=Decimal('80.00'),
+            )
+        with self.assertNumQueries(1):
+            menu = DailyMenu.objects.create(date=self.menu.date + timedelta(days=1), meal_period=self.menu.meal_period)
+        with self.assertNumQueries(1):
+            menu_item = DailyMenuItem.objects.create(
+                daily_menu=menu, food_item=food_item, sufuria_count=2, plates_per_sufuria=30,
+            )
+        with self.assertNumQueries(1):
+            order = Order.objects.create(daily_menu=menu, total_amount=Decimal('80.00'))
+        with self.assertNumQueries(1):
+            OrderItem.objects.create(
+                order=order, daily_menu_item=menu_item, food_item=food_item, price_per_plate=Decimal('80.00'),
+            )
+        with self.assertNumQueries(1):
+            MPesaTransaction.objects.create(
+                order=order, merchant_request_id='m-1', checkout_request_id='ws_CO_1',
+                phone_number='254712345678', amount=Decimal('80.00'),
+            )
+        with self.assertNumQueries(1):
+            OrderReceipt.objects.create(order=order, receipt_type='sms')
+
+        self.assertEqual(food_item.slug, 'main-dishes-beef-stew')
+        self.assertEqual(menu_item.slug, f'{menu.slug}-main-dishes-beef-stew')
+        # The stock columns match what the trigger wrote, without reading them back
+        stored = DailyMenuItem.objects.values_list('total_plates_available', 'plates_remaining').get(pk=menu_item.pk)
+        self.assertEqual((menu_item.total_plates_available, menu_item.plates_remaining), stored)
+
+    def test_unloaded_relations_are_read_not_loaded(self):
+        order = Order.objects.create(daily_menu=self.menu, total_amount=Decimal('50.00'))
+        # One values_list lookup per unassigned relation, then the insert
+        with self.assertNumQueries(3):
+            item = OrderItem.objects.create(
+                order_id=order.pk, daily_menu_item_id=self.menu_item.pk,
+                food_item_id=self.menu_item.food_item_id, price_per_plate=Decimal('50.00'),
+            )
+        self.assertEqual(item.slug, slugify(f'{order.order_code}-{self.menu_item.food_item.slug}'))
+        self.assertFalse(OrderItem.order.is_cached(item))
+        with self.assertNumQueries(2):
+            receipt = OrderReceipt.objects.create(order_id=order.pk, receipt_type='sms')
+        self.assertEqual(receipt.slug, slugify(f'receipt-{order.order_code}'))
+        # The expiry needs the menu and its period: one lookup, not two lazy loads
+        with self.assertNumQueries(2):
+            order = Order.objects.create(daily_menu_id=self.menu.pk, total_amount=Decimal('50.00'))
+        self.assertEqual(order.expires_at.date(), self.menu.date)
+
+    def test_bulk_create_matches_save(self):
+        menus = clone_menu(self.menu, [self.menu.date + timedelta(days=7)])
+        cloned = DailyMenuItem.objects.select_related('daily_menu').get(daily_menu=menus[0])
+        self.assertEqual(menus[0].slug, f'{menus[0].date}-lunch')
+        self.assertEqual(cloned.slug, f'{menus[0].slug}-{self.menu_item.food_item.slug}')
+        self.assertEqual(
+            (cloned.total_plates_available, cloned.plates_remaining, cloned.is_available),
+            (self.menu_item.total_plates_available, self.menu_item.plates_remaining, True),
+        )
+
+
+class MenuBuilderTests(TestCase):
+    """Bulk-built menus match saved ones, skip planned slots and publish once"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.menu = create_menu_fixture(item_count=2)
+        cls.lunch = cls.menu.meal_period
+        cls.supper = MealPeriod.objects.create(
+            name='supper',
+            start_time=time(17, 0),
+            end_time=time(20, 0),
+            ordering_start_time=time(16, 0),
+            ordering_end_time=time(19, 30),
+            serving_start_time=time(17, 30),
+            serving_end_time=time(20, 0),
+        )
+        cls.rice, cls.beans = FoodItem.objects.order_by('pk')
+
+    def dailymenu_version(self):
+        return CacheVersion.objects.get(topic='ecommerce.dailymenu').version
+
+    def test_build_skips_existing_slots_and_derives_rows(self):
+        tomorrow = self.menu.date + timedelta(days=1)
+        specs = [(self.rice, 2, 40), (self.beans, 1, 30)]
+        plan = [
+            (self.menu.date, self.lunch, specs),
+            (self.menu.date, self.supper, specs),
+            (tomorrow, self.lunch, specs),
+            # Planned twice: the first entry wins
+            (tomorrow, self.lunch, [(self.rice, 5, 50)]),
+        ]
+        version = self.dailymenu_version()
+        with mock.patch('ecommerce.menu_builder.invalidation.publish', wraps=invalidation.publish) as publish:
+            menus = build_menus(plan, publish=True, notes='Week 3')
+        publish.assert_called_once_with(DailyMenu)
+        self.assertEqual(self.dailymenu_version(), version + 1)
+
+        self.assertEqual([(menu.date, menu.meal_period) for menu in menus],
+                         [(self.menu.date, self.supper), (tomorrow, self.lunch)])
+        self.assertEqual(DailyMenu.objects.count(), 3)
+        # The menu that already existed kept its own items
+        self.assertEqual(self.menu.menu_items.get(food_item=self.rice).sufuria_count, 10)
+
+        stored = DailyMenu.objects.get(pk=menus[1].pk)
+        self.assertEqual((stored.slug, stored.is_published, stored.notes), (f'{tomorrow}-lunch', True, 'Week 3'))
+        rows = list(stored.menu_items.order_by('food_item').values_list(
+            'slug', 'total_plates_available', 'plates_ordered', 'plates_remaining', 'is_available'
+        ))
+        self.assertEqual(rows, [
+            (f'{tomorrow}-lunch-{self.rice.slug}', 80, 0, 80, True),
+            (f'{tomorrow}-lunch-{self.beans.slug}', 30, 0, 30, True),
+        ])
+        self.assertEqual(build_menus([]), [])
+
+    def test_weekday_template_wins_over_any_day(self):
+        monday = self.menu.date + timedelta(days=7 - self.menu.date.weekday())
+        any_day = MenuTemplate.objects.create(name='Lunch any day', meal_period=self.lunch)
+        MenuTemplateItem.objects.create(template=any_day, food_item=self.rice, sufuria_count=1, plates_per_sufuria=50)
+        mondays = MenuTemplate.objects.create(name='Monday lunch', meal_period=self.lunch, weekday=0)
+        MenuTemplateItem.objects.create(template=mondays, food_item=self.beans, sufuria_count=3, plates_per_sufuria=20)
+
+        menus = apply_templates(date_range(monday, 2), meal_periods=[self.lunch, self.supper])
+        # No supper template, so supper is left unplanned
+        self.assertEqual([(menu.date, menu.meal_period) for menu in menus],
+                         [(monday, self.lunch), (monday + timedelta(days=1), self.lunch)])
+        self.assertEqual(
+            [list(menu.menu_items.values_list('food_item__name', 'total_plates_available')) for menu in menus],
+            [[(self.beans.name, 60)], [(self.rice.name, 50)]],
+        )
+
+    def test_clone_previous_day(self):
+        menus = clone_previous_day(self.menu.date + timedelta(days=1), days=3)
+        self.assertEqual([menu.date for menu in menus], date_range(self.menu.date + timedelta(days=1), 3))
+        for menu in menus:
+            self.assertEqual(
+                sorted(menu.menu_items.values_list('food_item', 'sufuria_count', 'plates_per_sufuria')),
+                sorted(self.menu.menu_items.values_list('food_item', 'sufuria_count', 'plates_per_sufuria')),
+            )
+
+    def test_clone_previous_day_keeps_to_the_given_meal_periods(self):
+        supper_menu = DailyMenu.objects.create(date=self.menu.date, meal_period=self.supper)
+        DailyMenuItem.objects.create(daily_menu=supper_menu, food_item=self.beans, sufuria_count=1, plates_per_sufuria=10)
+        tomorrow = self.menu.date + timedelta(days=1)
+
+        call_command('build_menus', '--start', str(tomorrow), '--days', '1',
+                     '--clone-previous-day', '--meal-period', 'lunch', stdout=io.StringIO())
+        self.assertEqual(list(DailyMenu.objects.filter(date=tomorrow).values_list('meal_period', flat=True)),
+                         [self.lunch.pk])
+
+        menus = clone_previous_day(tomorrow, days=2, meal_periods=[self.supper])
+        self.assertEqual([(menu.date, menu.meal_period) for menu in menus],
+                         [(tomorrow, self.supper), (tomorrow + timedelta(days=1), self.supper)])
+
+
+def jpeg_upload(name, width, height):
+    """An in-memory JPEG upload of the given size"""
+    data = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 120, 40)).save(data, 'JPEG')
+    return SimpleUploadedFile(name, data.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(
+    STORAGES={**settings.STORAGES, 'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'}},
+    FOOD_IMAGE_WIDTHS=[160, 320, 640],
+)
+class FoodImageDerivativeTests(TestCase):
+    """Uploads get resized WebP/JPEG derivatives under their content hash"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Main Dishes')
+
+    def upload(self, width, height=300):
+        # Holds back the background job; the tests run it inline
+        with self.captureOnCommitCallbacks():
+            return FoodItem.objects.create(
+                category=self.category, name='Pilau', price_per_plate=Decimal('80.00'),
+                image=jpeg_upload('pilau.jpg', width, height),
+            )
+
+    def test_derivatives_are_written_and_recorded(self):
+        food_item = self.upload(500)
+        with default_storage.open(food_item.image.name, 'rb') as original:
+            digest = hashlib.sha1(original.read()).hexdigest()
+
+        self.assertEqual(process_food_item_image(food_item.pk, food_item.image.name), digest)
+        food_item.refresh_from_db()
+        # Never upscaled past the 500px original
+        self.assertEqual((food_item.image_digest, food_item.image_widths), (digest, '160,320'))
+        for width, height in ((160, 96), (320, 192)):
+            for ext, image_format in (('webp', 'WEBP'), ('jpg', 'JPEG')):
+                name = derivative_name(digest, width, ext)
+                self.assertTrue(name.startswith(f'cache/food_items/{digest[:2]}/{digest}/'))
+                with default_storage.open(name, 'rb') as handle, Image.open(handle) as derivative:
+                    self.assertEqual((derivative.format, derivative.size), (image_format, (width, height)))
+        self.assertFalse(default_storage.exists(derivative_name(digest, 640, 'jpg')))
+
+        html = engines['django'].from_string(
+            '{% load food_images %}{% food_image item class="tab-image" %}'
+        ).render({'item': food_item})
+        self.assertIn(f'srcset="/media/{derivative_name(digest, 160, "webp")} 160w, '
+                      f'/media/{derivative_name(digest, 320, "webp")} 320w"', html)
+        self.assertIn(f'src="/media/{derivative_name(digest, 320, "jpg")}"', html)
+        self.assertIn('class="tab-image"', html)
+
+    def test_replaced_image_is_not_overwritten_by_a_late_job(self):
+        food_item = self.upload(200)
+        stale_name = food_item.image.name
+        food_item.image = jpeg_upload('pilau-new.jpg', 700, 300)
+        with self.captureOnCommitCallbacks():
+            food_item.save()
+
+        # The job for the first upload finishes after the second upload
+        process_food_item_image(food_item.pk, stale_name)
+        food_item.refresh_from_db()
+        self.assertEqual(food_item.image_digest, '')
+
+        html = engines['django'].from_string('{% load food_images %}{% food_image item %}').render({'item': food_item})
+        self.assertIn(f'src="/media/{food_item.image.name}"', html)
+
+    def test_unreadable_upload_is_logged(self):
+        food_item = FoodItem.objects.create(category=self.category, name='Chapati', price_per_plate=Decimal('20.00'))
+        default_storage.save('food_items/broken.jpg', io.BytesIO(b'not an image'))
+        with self.assertLogs('ecommerce.images', 'ERROR'):
+            self.assertIsNone(process_food_item_image(food_item.pk, 'food_items/broken.jpg'))
+
+
+class StaticFilesStorageTests(TestCase):
+    """collectstatic leaves dead CSS urls as they are instead of failing"""
+
+    def test_missing_url_target_is_kept(self):
+        storage = StaticFilesStorage(location=settings.BASE_DIR / 'static')
+        convert = storage.url_converter('css/vendor.css', {})
+        match = re.search(r'(?P<matched>url\("(?P<url>[^"]+)"\))', 'a { background: url("../images/lightbox-missing.png") }')
+        with self.assertLogs('ecommerce.storage', 'WARNING'):
+            self.assertEqual(convert(match), 'url("../images/lightbox-missing.png")')
+
+
+class OrderEventFeedTests(TestCase):
+    """Status transitions land in the change feed in order, readable by cursor"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.menu = create_menu_fixture(item_count=1)
+        cls.orders = [
+            Order.objects.create(daily_menu=cls.menu, total_amount=Decimal('50.00')) for _ in range(3)
+        ]
+        cls.staff = User.objects.create_user('attendant', password='attendant123', is_staff=True)
+
+    def transition_all(self):
+        served, cancelled, expired = self.orders
+        served.status = 'confirmed'
+        served.save()
+        served.mark_as_served(None)
+        cancelled.status = 'cancelled'
+        cancelled.save()
+        Order.objects.filter(pk=expired.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+        sweep_expired_orders()
+
+    def test_transitions_are_recorded_in_order(self):
+        served, cancelled, expired = self.orders
+        self.transition_all()
+        events = read_order_events()
+        self.assertEqual(
+            [(event.order_code, event.from_status, event.to_status) for event in events],
+            [
+                (served.order_code, 'pending', 'confirmed'),
+                (served.order_code, 'confirmed', 'served'),
+                (cancelled.order_code, 'pending', 'cancelled'),
+                (expired.order_code, 'pending', 'expired'),
+            ],
+        )
+        self.assertEqual([event.id for event in events], sorted(event.id for event in events))
+        # Saves that keep the status add nothing
+        served.save()
+        self.assertEqual(len(read_order_events()), 4)
+
+    def test_transitions_of_partly_loaded_orders_are_recorded(self):
+        first, second, third = self.orders
+        deferred = Order.objects.only('id', 'order_code').get(pk=first.pk)
+        deferred.status = 'cancelled'
+        deferred.save()
+
+        # Built from stored values rather than loaded
+        values = Order.objects.filter(pk=second.pk).values().get()
+        rebuilt = Order(**{**values, 'status': 'confirmed', 'payment_date': timezone.now()})
+        rebuilt.save()
+        rebuilt.status = 'served'
+        rebuilt.save()
+
+        self.assertEqual(
+            [(event.order_code, event.from_status, event.to_status) for event in read_order_events()],
+            [
+                (first.order_code, 'pending', 'cancelled'),
+                (second.order_code, 'pending', 'confirmed'),
+                (second.order_code, 'confirmed', 'served'),
+            ],
+        )
+        self.assertEqual(Order.objects.get(pk=third.pk).status, 'pending')
+        # The rollups saw the same transitions
+        incremental = rollup_totals()
+        rebuild_rollups()
+        self.assertEqual(incremental, rollup_totals())
+
+    def test_cursor_pages_through_the_feed(self):
+        self.transition_all()
+        self.client.force_login(self.staff)
+        url = reverse('order_events')
+        first = self.client.get(url, {'after': 0, 'limit': 3}).json()
+        second = self.client.get(url, {'after': first['next_after'], 'limit': 3}).json()
+        third = self.client.get(url, {'after': second['next_after']}).json()
+        self.assertEqual((len(first['events']), len(second['events']), third['events']), (3, 1, []))
+        self.assertEqual(third['next_after'], second['events'][-1]['id'])
+        self.assertEqual(second['events'][0]['to_status'], 'expired')
+
+        self.assertEqual(self.client.get(url, {'after': 'latest'}).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+    @override_settings(ORDER_EVENTS_POLL_INTERVAL=30)
+    def test_waiting_reader_wakes_on_commit(self):
+        sentinel = object()
+        results = iter([[], [sentinel]])
+        with mock.patch('ecommerce.events.read_order_events', lambda after, limit: next(results)):
+            # A commit elsewhere in the process wakes the reader long before the next poll
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.transition_all()
+            threading.Timer(0.1, lambda: [callback() for callback in callbacks]).start()
+            started = clock.monotonic()
+            events = wait_for_order_events(timeout=10)
+        self.assertEqual(events, [sentinel])
+        self.assertLess(clock.monotonic() - started, 5)
+
+    def test_waiting_reader_times_out(self):
+        started = clock.monotonic()
+        self.assertEqual(wait_for_order_events(timeout=0.2), [])
+        self.assertGreaterEqual(clock.monotonic() - started, 0.2)
+
+
+class CacheInvalidationTests(TestCase):
+    """Saves publish cache versions and clear exactly the caches built on them"""
+
+    def setUp(self):
+        bus.reset()
+        self.period = MealPeriod.objects.create(
+            name='supper',
+            start_time=time(17, 0),
+            end_time=time(21, 0),
+            ordering_start_time=time(16, 0),
+            ordering_end_time=time(20, 0),
+            serving_start_time=time(18, 0),
+            serving_end_time=time(21, 0),
+        )
+
+    def test_save_clears_dependent_caches(self):
+        self.assertEqual(active_meal_periods(), [self.period])
+        version = CacheVersion.objects.get(topic='ecommerce.mealperiod').version
+        with self.assertNumQueries(1):
+            # Only the version check; the periods come from memory
+            self.assertEqual(active_meal_periods(), [self.period])
+
+        self.period.is_active = False
+        with self.assertNumQueries(2):
+            self.period.save()
+        self.assertEqual(CacheVersion.objects.get(topic='ecommerce.mealperiod').version, version + 1)
+        self.assertEqual(active_meal_periods(), [])
+
+    def test_unrelated_changes_keep_the_cache(self):
+        active_meal_periods()
+        Category.objects.create(name='Beverages')
+        with self.assertNumQueries(1):
+            active_meal_periods()
+
+    def test_unreadable_versions_bypass_the_cache(self):
+        active_meal_periods()
+        MealPeriod.objects.filter(pk=self.period.pk).update(is_active=False)
+        with mock.patch('ecommerce.models.CacheVersion.objects.using', side_effect=DatabaseError), \
+                self.assertLogs('ecommerce.invalidation', 'WARNING'):
+            # An update() publishes nothing, but the cache is not trusted without a check
+            self.assertEqual(active_meal_periods(), [])
+
+
+class SystemSettingsAccessTests(TestCase):
+    """Settings rows are read typed, with defaults, and drive ordering and expiry"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.menu = create_menu_fixture(item_count=1)
+        cls.menu_item = cls.menu.menu_items.get()
+
+    def setUp(self):
+        bus.reset()
+
+    def test_values_are_typed_with_defaults(self):
+        self.assertEqual(get_setting('max_plates_per_item'), 1)
+        self.assertIs(get_setting('enable_guest_orders'), True)
+
+        SystemSettings.objects.create(key='max_plates_per_item', value=' 3 ')
+        SystemSettings.objects.create(key='enable_guest_orders', value='No')
+        SystemSettings.objects.create(key='order_expiry_hours', value='1.5', is_active=False)
+        self.assertEqual(get_setting('max_plates_per_item'), 3)
+        self.assertIs(get_setting('enable_guest_orders'), False)
+        self.assertEqual(get_setting('order_expiry_hours'), timedelta(hours=24))
+        with self.assertRaises(KeyError):
+            get_setting('mess_location')
+
+    @override_settings(CACHE_INVALIDATION_POLL_INTERVAL=60)
+    def test_reads_after_the_first_run_no_queries(self):
+        get_setting('max_plates_per_item')
+        with self.assertNumQueries(0):
+            for _ in range(100):
+                get_setting('max_plates_per_item')
+                get_setting('order_expiry_hours')
+
+    def test_unreadable_values_fall_back_to_the_default(self):
+        SystemSettings.objects.filter(key='order_expiry_hours').delete()
+        row = SystemSettings(key='order_expiry_hours', value='a day')
+        with self.assertRaises(ValidationError):
+            row.full_clean()
+        row.save()
+        with self.assertLogs('ecommerce.system_settings', 'WARNING'):
+            self.assertEqual(get_setting('order_expiry_hours'), timedelta(hours=24))
+
+    def add_to_cart(self, quantity):
+        return self.client.post(reverse('add_to_cart'), json.dumps({
+            'menu_item_id': self.menu_item.pk, 'quantity': quantity,
+        }), content_type='application/json')
+
+    def test_plate_limit_drives_add_to_cart(self):
+        self.assertEqual(self.add_to_cart(2).status_code, 400)
+        SystemSettings.objects.create(key='max_plates_per_item', value='2')
+        self.assertEqual(self.add_to_cart(3).status_code, 400)
+        self.assertEqual(self.add_to_cart(2).status_code, 200)
+        self.assertEqual(self.client.session['cart'][str(self.menu_item.pk)]['subtotal'], '100.00')
+
+    def test_guest_orders_can_be_disabled(self):
+        self.add_to_cart(1)
+        SystemSettings.objects.create(key='enable_guest_orders', value='false')
+        response = self.client.post(reverse('place_order'), {
+            'phone_number': '254712345678',
+            'registration_number': 'SC211-0001-2022',
+            'full_name': 'Guest Student',
+        })
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Order.objects.exists())
+        self.assertRedirects(self.client.get(reverse('checkout')), reverse('login') + '?next=' + reverse('checkout'),
+                             fetch_redirect_response=False)
+
+    def test_unpaid_orders_expire_after_the_configured_hours(self):
+        SystemSettings.objects.create(key='order_expiry_hours', value='2')
+        unpaid, paid, recent = [
+            Order.objects.create(daily_menu=self.menu, total_amount=Decimal('50.00')) for _ in range(3)
+        ]
+        Order.objects.filter(pk__in=[unpaid.pk, paid.pk]).update(ordered_at=timezone.now() - timedelta(hours=3))
+        Order.objects.filter(pk=paid.pk).update(status='confirmed')
+
+        self.assertEqual(sweep_expired_orders().expired, 1)
+        statuses = dict(Order.objects.values_list('pk', 'status'))
+        self.assertEqual((statuses[unpaid.pk], statuses[paid.pk], statuses[recent.pk]),
+                         ('expired', 'confirmed', 'pending'))
+
+
+class SingleflightCacheTests(TestCase):
+    """Each key is computed once however many callers miss it together"""
+
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+
+    def slow_compute(self, value='fresh', seconds=0.2):
+        def compute():
+            self.calls.append(value)
+            clock.sleep(seconds)
+            return value
+        return compute
+
+    def test_concurrent_misses_compute_once(self):
+        cached = SingleflightCache('test', ttl=60)
+        barrier = threading.Barrier(20)
+        results = []
+
+        def request():
+            barrier.wait()
+            results.append(cached.get('key', self.slow_compute()))
+
+        threads = [threading.Thread(target=request) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, ['fresh'])
+        self.assertEqual(results, ['fresh'] * 20)
+
+    def test_stale_value_is_served_while_one_caller_refreshes(self):
+        cached = SingleflightCache('test', ttl=60)
+        cached.get('key', lambda: 'stale')
+        key = 'singleflight:test:key'
+        value, fresh_until, cost, stamp = cache.get(key)
+        cache.set(key, (value, clock.time() - 1, cost, stamp))
+
+        refresher = threading.Thread(target=cached.get, args=('key', self.slow_compute()))
+        refresher.start()
+        while cache.get(f'{key}:lock') is None:
+            clock.sleep(0.01)
+        # Others don't wait for the refresh or start their own
+        self.assertEqual(cached.get('key', self.slow_compute('duplicate')), 'stale')
+        refresher.join()
+        self.assertEqual(self.calls, ['fresh'])
+        self.assertEqual(cached.get('key', self.slow_compute('duplicate')), 'fresh')
+
+    def test_entries_refresh_early_near_expiry(self):
+        cached = SingleflightCache('test', ttl=60)
+        now = clock.time()
+        with mock.patch('ecommerce.singleflight.random.random', return_value=0.5):
+            self.assertFalse(cached._refresh_early(now + 30, cost=0.1))
+            self.assertTrue(cached._refresh_early(now + 0.01, cost=0.1))
+        # An unlucky draw refreshes well before expiry, and more readily for costly values
+        with mock.patch('ecommerce.singleflight.random.random', return_value=0.99999):
+            self.assertFalse(cached._refresh_early(now + 30, cost=0.1))
+            self.assertTrue(cached._refresh_early(now + 30, cost=5))
+
+    def test_model_changes_replace_entries(self):
+        categories, _ = site_data(timezone.now().date(), None)
+        self.assertEqual(categories, [])
+        category = Category.objects.create(name='Beverages')
+        categories, _ = site_data(timezone.now().date(), None)
+        self.assertEqual(categories, [category])
+
+
+def _watch_meal_period(ready, seen, period_pk, serving_end_time):
+    """Forked worker: read the cached meal periods until a change shows, then report when"""
+    active_meal_periods()
+    ready.put(os.getpid())
+    deadline = clock.monotonic() + 30
+    while clock.monotonic() < deadline:
+        if any(period.pk == period_pk and period.serving_end_time == serving_end_time
+               for period in active_meal_periods()):
+            seen.put(clock.time())
+            break
+        clock.sleep(0.005)
+    connections.close_all()
+
+
+class CrossProcessInvalidationTests(TransactionTestCase):
+    """A change saved in one process reaches the caches of the others in bounded time"""
+    WORKERS = 4
+    POLL_INTERVAL = 0.25
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('needs a database shared between processes (set TEST NAME for SQLite)')
+        bus.reset()
+
+    def test_workers_see_a_change_within_the_poll_interval(self):
+        period = MealPeriod.objects.create(
+            name='breakfast',
+            start_time=time(6, 0),
+            end_time=time(9, 0),
+            ordering_start_time=time(5, 0),
+            ordering_end_time=time(8, 30),
+            serving_start_time=time(6, 30),
+            serving_end_time=time(9, 0),
+        )
+        context = multiprocessing.get_context('fork')
+        ready, seen = context.Queue(), context.Queue()
+        with override_settings(CACHE_INVALIDATION_POLL_INTERVAL=self.POLL_INTERVAL):
+            # Each worker opens its own connections
+            connections.close_all()
+            workers = [
+                context.Process(target=_watch_meal_period, args=(ready, seen, period.pk, time(9, 30)))
+                for _ in range(self.WORKERS)
+            ]
+            for worker in workers:
+                worker.start()
+            try:
+                for _ in workers:
+                    ready.get(timeout=30)
+                period.serving_end_time = time(9, 30)
+                period.save()
+                changed_at = clock.time()
+                staleness = sorted(seen.get(timeout=30) - changed_at for _ in workers)
+            finally:
+                for worker in workers:
+                    worker.join(timeout=10)
+
+        # Polling workers lag by at most one interval, plus scheduling noise
+        self.assertLess(staleness[-1], self.POLL_INTERVAL + 0.5, f'staleness per worker: {staleness}')
+
+
+class CheckoutStressTests(TransactionTestCase):
+    """Concurrent checkouts, callbacks and serves keep stock consistent"""
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('needs a database shared between connections (set TEST NAME for SQLite)')
+
+    def test_no_oversell_under_contention(self):
+        result = run_checkout_stress(workers=4, checkouts=40, items=2, plates=5, seed=7)
+        self.assertEqual(result.violations, [])
+        self.assertGreater(result.placed, 0)
+        self.assertLessEqual(result.placed, 10)
+
+
+class ExpirySweepLockTests(TransactionTestCase):
+    """A batch skips orders another transaction holds instead of waiting on them"""
+
+    def setUp(self):
+        if not connection.features.has_select_for_update_skip_locked:
+            self.skipTest('needs SELECT ... FOR UPDATE SKIP LOCKED')
+
+    def test_locked_orders_are_left_for_the_next_sweep(self):
+        menu = create_menu_fixture(item_count=1)
+        menu_item = menu.menu_items.get()
+        orders = [place_test_order(menu, {menu_item: 1}) for _ in range(3)]
+        Order.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_lock():
+            with transaction.atomic():
+                Order.objects.select_for_update().get(pk=orders[0].pk)
+                locked.set()
+                release.wait(10)
+            connection.close()
+
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        try:
+            locked.wait(10)
+            self.assertEqual(sweep_expired_orders(batch_size=1).expired, 2)
+        finally:
+            release.set()
+            holder.join()
+        self.assertEqual(Order.objects.get(pk=orders[0].pk).status, 'pending')
+        self.assertEqual(sweep_expired_orders().expired, 1)
+
+
+@override_settings(TEMPLATES=VIEW_TEMPLATES)
+class ReplicaRoutingTests(TransactionTestCase):
+    """Browse pages read from the replica; the order path and recent writers use the primary"""
+    databases = '__all__'
+
+    def setUp(self):
+        if not replica_alias():
+            self.skipTest("no 'replica' alias in DATABASES")
+        reset_replica_lag()
+        self.addCleanup(reset_replica_lag)
+        self.menu = create_menu_fixture(item_count=3)
+        self.menu_item = self.menu.menu_items.first()
+        # Caches fill from (and check versions on) the primary by design; warm them
+        cache.clear()
+        self.client.get(reverse('product_list'))
+        reset_replica_lag()
+
+    def get(self, name):
+        """(mess table queries on the primary, queries on the replica) for one GET"""
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections[replica_alias()]) as replica:
+            response = self.client.get(reverse(name))
+        self.assertEqual(response.status_code, 200)
+        mess_queries = [
+            query for query in primary.captured_queries
+            if 'ecommerce_' in query['sql'] and 'ecommerce_cacheversion' not in query['sql']
+        ]
+        return len(mess_queries), len(replica)
+
+    def test_browse_pages_read_from_replica(self):
+        primary, replica = self.get('product_list')
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_order_path_reads_from_primary(self):
+        self.client.post(reverse('add_to_cart'), json.dumps({'menu_item_id': self.menu_item.pk, 'quantity': 1}),
+                         content_type='application/json')
+        self.client.cookies.pop(PIN_COOKIE)
+        primary, replica = self.get('checkout')
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    def test_writes_pin_the_client_to_the_primary(self):
+        response = self.client.post(reverse('add_to_cart'), json.dumps({
+            'menu_item_id': self.menu_item.pk, 'quantity': 1,
+        }), content_type='application/json')
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], settings.REPLICA_STICKY_SECONDS)
+        self.assertEqual(self.get('product_list')[1], 0)
+
+        # Once the pin expires the replica serves the page again
+        self.client.cookies[PIN_COOKIE] = str(int(clock.time()) - 1)
+        self.assertGreater(self.get('product_list')[1], 0)
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        with mock.patch('ecommerce.routers.measure_replica_lag', return_value=settings.REPLICA_MAX_LAG_SECONDS + 1):
+            primary, replica = self.get('product_list')
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    def test_unreachable_replica_falls_back_to_primary(self):
+        with mock.patch('ecommerce.routers.measure_replica_lag', return_value=None):
+            self.assertEqual(self.get('product_list')[1], 0)
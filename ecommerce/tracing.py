@@ -0,0 +1,223 @@
+"""
+Phase-level tracing of the checkout and payment pipeline.
+
+place_order, initiate_stk_push, mpesa_callback and send_order_receipt run
+inside a trace() and each step inside a span(). A trace keeps the one
+correlation id it started with and is tagged with the order code once it
+exists, so a checkout's log line, spans and error logs carry one id
+throughout, and the order code ties its checkout, callback and receipt
+together. Every span's duration is appended to an in-process ring buffer,
+and when the outermost trace ends one JSON line with all its phases goes to
+the ecommerce.tracing logger: at INFO, or WARNING for a trace that raised.
+phase_summary() turns the buffer into p50/p95 per phase, which separates
+Daraja's latency (mpesa_oauth, stk_push) from our own database work.
+"""
+import json
+import logging
+import math
+import threading
+import time
+import uuid
+from collections import deque, namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import MealPeriod
+
+
+logger = logging.getLogger(__name__)
+
+TRACE_BUFFER_SIZE = 5000
+
+SpanRecord = namedtuple('SpanRecord', 'at pipeline phase duration correlation_id order_code error')
+
+_current = ContextVar('checkout_trace', default=None)
+
+
+class SpanBuffer:
+    """Fixed-size ring of the most recent spans"""
+
+    def __init__(self, size):
+        self._lock = threading.Lock()
+        self._spans = deque(maxlen=size)
+
+    def extend(self, spans):
+        with self._lock:
+            self._spans.extend(spans)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+
+buffer = SpanBuffer(getattr(settings, 'TRACE_BUFFER_SIZE', TRACE_BUFFER_SIZE))
+
+
+class Trace:
+    __slots__ = ('pipeline', 'correlation_id', 'order_code', 'started', 'phases', 'fields')
+
+    def __init__(self, pipeline, correlation_id, order_code=''):
+        self.pipeline = pipeline
+        self.correlation_id = correlation_id
+        self.order_code = order_code
+        self.started = time.perf_counter()
+        self.phases = []
+        self.fields = {}
+
+    def bind(self, order_code):
+        """Tag the trace with its order code once it is known"""
+        self.order_code = order_code
+
+    def annotate(self, **fields):
+        """Extra fields for the trace's log line (outcome, status, ...)"""
+        self.fields.update(fields)
+
+
+def current_trace():
+    return _current.get()
+
+
+@contextmanager
+def trace(pipeline, order_code=''):
+    """
+    Trace one pass through a pipeline, for `order_code` if already known.
+
+    Nested calls (initiate_stk_push inside place_order) join the outer
+    trace, so the whole checkout is one log line under one correlation id.
+    """
+    outer = _current.get()
+    if outer is not None:
+        if order_code and not outer.order_code:
+            outer.bind(order_code)
+        yield outer
+        return
+
+    active = Trace(pipeline, uuid.uuid4().hex[:12], order_code)
+    token = _current.set(active)
+    error = False
+    try:
+        yield active
+    except Exception:
+        error = True
+        raise
+    finally:
+        _current.reset(token)
+        _finish(active, time.perf_counter() - active.started, error)
+
+
+@contextmanager
+def span(phase):
+    """Time one phase of the current trace; a no-op outside any trace"""
+    active = _current.get()
+    if active is None:
+        yield
+        return
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        active.phases.append((phase, time.perf_counter() - started, error))
+
+
+def _finish(active, total, error):
+    now = timezone.now()
+    records = [
+        SpanRecord(now, active.pipeline, phase, duration, active.correlation_id, active.order_code, failed)
+        for phase, duration, failed in active.phases
+    ]
+    records.append(SpanRecord(
+        now, active.pipeline, 'total', total, active.correlation_id, active.order_code, error
+    ))
+    buffer.extend(records)
+
+    level = logging.WARNING if error else logging.INFO
+    if logger.isEnabledFor(level):
+        logger.log(level, json.dumps({
+            'event': 'trace',
+            'pipeline': active.pipeline,
+            'correlation_id': active.correlation_id,
+            'order_code': active.order_code,
+            'at': now.isoformat(),
+            'total_ms': round(total * 1000, 2),
+            'error': error,
+            'phases': [
+                {'phase': phase, 'ms': round(duration * 1000, 2), 'error': failed}
+                for phase, duration, failed in active.phases
+            ],
+            **active.fields,
+        }, default=str))
+
+
+def _percentile(ordered, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def phase_summary(start=None, end=None):
+    """Count, errors, p50, p95 and max (ms) per pipeline phase for spans in [start, end)"""
+    durations = {}
+    errors = {}
+    for record in buffer.snapshot():
+        if (start and record.at < start) or (end and record.at >= end):
+            continue
+        key = (record.pipeline, record.phase)
+        durations.setdefault(key, []).append(record.duration)
+        errors[key] = errors.get(key, 0) + record.error
+
+    # Phases stay in the order they first ran
+    rows = []
+    for (pipeline, phase), values in durations.items():
+        values.sort()
+        rows.append({
+            'pipeline': pipeline,
+            'phase': phase,
+            'count': len(values),
+            'errors': errors[(pipeline, phase)],
+            'p50_ms': round(_percentile(values, 0.5) * 1000, 1),
+            'p95_ms': round(_percentile(values, 0.95) * 1000, 1),
+            'max_ms': round(values[-1] * 1000, 1),
+        })
+    return rows
+
+
+def _window_times(period):
+    """Earliest and latest time of day a meal period sees checkout traffic"""
+    return (
+        min(period.ordering_start_time, period.start_time),
+        max(period.serving_end_time, period.end_time),
+    )
+
+
+def meal_period_window(meal_period=None, now=None):
+    """
+    (meal period, start, end) for today's run of a meal period, from its
+    ordering opening to the end of serving.
+
+    Without a meal period, the one in progress or else the last one to
+    open today; (None, None, None) before the first meal of the day.
+    """
+    now = timezone.localtime(now or timezone.now())
+    if meal_period is None:
+        opened = [
+            period for period in MealPeriod.objects.filter(is_active=True)
+            if _window_times(period)[0] <= now.time()
+        ]
+        if not opened:
+            return None, None, None
+        meal_period = max(opened, key=lambda period: _window_times(period)[0])
+    opens, closes = _window_times(meal_period)
+    start = timezone.make_aware(datetime.combine(now.date(), opens))
+    end = timezone.make_aware(datetime.combine(now.date(), closes))
+    return meal_period, start, end
@@ -39,10 +39,14 @@ urlpatterns = [
     # Staff URLs
     path('staff/dashboard/', views.staff_dashboard, name='staff_dashboard'),
     path('staff/verify-order/', views.verify_order, name='verify_order'),
+    path('staff/exports/<str:kind>/', views.export_data, name='export_data'),
+    path('staff/reports/sales/', views.sales_report_view, name='sales_report'),
+    path('metrics', views.metrics, name='metrics'),
     
     # API Endpoints
     path('api/check-availability/<int:menu_item_id>/', views.check_item_availability, name='check_item_availability'),
     path('api/meal-period-status/', views.get_meal_period_status, name='meal_period_status'),
+    path('api/order-events/', views.order_events, name='order_events'),
     
     # Utility Pages
     path('about/', views.about, name='about'),
@@ -1,27 +1,47 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
 from django.contrib.auth.models import User
+from django.contrib.auth.views import redirect_to_login
 from django.db.models import Q, Sum, Count
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse, Http404
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.utils import timezone
 from django.conf import settings
-from django.core.mail import send_mail
+from django.db import transaction as db_transaction
 from django.template.loader import render_to_string
 from decimal import Decimal
 import json
+import logging
 import requests
 import base64
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 from .models import (
     Category, SubCategory, FoodItem, MealPeriod, DailyMenu, 
     DailyMenuItem, Order, OrderItem, StudentProfile, MPesaTransaction,
     OrderReceipt, MessStaff
 )
+from .archive import find_order, user_order_querysets
+from .caches import active_meal_periods, home_catalog, home_menu, meal_period_at
+from .events import wait_for_order_events
+from .exports import EXPORTS, EXPORT_FORMATS, export_filename, stream_export
+from .onboarding import welcome_email
+from .outbox import enqueue_email
+from .metrics import render_prometheus
+from .pagination import keyset_page
+from .rollups import REPORT_GROUPINGS, REPORT_PERIODS, period_range, report_csv, sales_report
+from .stock import OutOfStock, release_plates, reserve_plates
+from .system_settings import get_setting
+from .tracing import span, trace
+
+
+logger = logging.getLogger(__name__)
+
+MY_ORDERS_PAGE_SIZE = 20
 
 
 # ==================== AUTHENTICATION VIEWS ====================
@@ -55,13 +75,19 @@ def register(request):
         if len(password1) < 6:
             errors.append("Password must be at least 6 characters.")
         
-        if User.objects.filter(username=username).exists():
+        # One query covers all three uniqueness checks
+        taken = list(User.objects.filter(
+            Q(username=username) | Q(email=email) |
+            Q(student_profile__registration_number=registration_number)
+        ).values_list('username', 'email', 'student_profile__registration_number'))
+        
+        if username in {row[0] for row in taken}:
             errors.append("Username already exists.")
         
-        if User.objects.filter(email=email).exists():
+        if email in {row[1] for row in taken}:
             errors.append("Email already registered.")
         
-        if StudentProfile.objects.filter(registration_number=registration_number).exists():
+        if registration_number in {row[2] for row in taken}:
             errors.append("Registration number already registered.")
         
         if errors:
@@ -70,35 +96,27 @@ def register(request):
             return render(request, 'accounts/register.html', {'data': request.POST})
         
         try:
-            # Create user
-            user = User.objects.create_user(
-                username=username,
-                email=email,
-                password=password1,
-                first_name=first_name,
-                last_name=last_name
-            )
-            
-            # Create student profile
-            StudentProfile.objects.create(
-                user=user,
-                registration_number=registration_number,
-                phone_number=phone_number,
-                course=course,
-                year_of_study=int(year_of_study) if year_of_study else None
-            )
-            
-            # Send welcome email
-            try:
-                send_mail(
-                    'Welcome to Muranga University Mess System',
-                    f'Hello {first_name},\n\nYour account has been created successfully!\n\nRegistration Number: {registration_number}\nUsername: {username}\n\nYou can now login and order your meals.\n\nBest regards,\nMuranga University Mess Team',
-                    settings.DEFAULT_FROM_EMAIL,
-                    [email],
-                    fail_silently=True,
+            with db_transaction.atomic():
+                # Create user
+                user = User.objects.create_user(
+                    username=username,
+                    email=email,
+                    password=password1,
+                    first_name=first_name,
+                    last_name=last_name
+                )
+                
+                # Create student profile
+                StudentProfile.objects.create(
+                    user=user,
+                    registration_number=registration_number,
+                    phone_number=phone_number,
+                    course=course,
+                    year_of_study=int(year_of_study) if year_of_study else None
                 )
-            except:
-                pass
+                
+                # Welcome email goes to the outbox, committed with the account
+                enqueue_email('welcome', *welcome_email(first_name, registration_number, username, email))
             
             messages.success(request, "Registration successful! Please login to continue.")
             return redirect('login')
@@ -165,76 +183,32 @@ def index(request):
     current_time = timezone.now().time()
     
     # Get current meal period
-    current_meal_period = MealPeriod.objects.filter(
-        is_active=True,
-        start_time__lte=current_time,
-        end_time__gte=current_time
-    ).first()
+    current_meal_period = meal_period_at(current_time)
     
     # Get today's menu for current meal period
     todays_menu = None
     menu_items = []
     if current_meal_period:
-        todays_menu = DailyMenu.objects.filter(
-            date=today,
-            meal_period=current_meal_period,
-            is_published=True,
-            is_active=True
-        ).prefetch_related(
-            'menu_items__food_item__category'
-        ).first()
-        
-        if todays_menu:
-            menu_items = todays_menu.menu_items.filter(
-                is_available=True,
-                plates_remaining__gt=0
-            ).select_related('food_item__category')[:10]
-    
-    # Get featured categories (top 8)
-    featured_categories = Category.objects.filter(
-        is_active=True
-    ).annotate(
-        item_count=Count('food_items')
-    ).order_by('display_order')[:8]
+        todays_menu, menu_items = home_menu(today, current_meal_period)
     
-    # Get best selling items (items with most orders)
-    # Fixed: use 'orderitem' instead of 'order_items'
-    best_selling = FoodItem.objects.filter(
-        is_active=True,
-        is_available=True
-    ).annotate(
-        order_count=Count('orderitem')
-    ).order_by('-order_count')[:10]
-    
-    # Get latest items (recently added)
-    latest_items = FoodItem.objects.filter(
-        is_active=True,
-        is_available=True
-    ).order_by('-created_at')[:10]
-    
-    # Get popular items (most frequently appearing in menus)
-    popular_items = FoodItem.objects.filter(
-        is_active=True,
-        is_available=True
-    ).annotate(
-        menu_count=Count('daily_appearances')
-    ).order_by('-menu_count')[:10]
+    # Featured categories, best selling, latest and popular items
+    catalog = home_catalog()
     
     # Statistics for hero section
     stats = {
-        'total_varieties': FoodItem.objects.filter(is_active=True).count(),
-        'total_orders': Order.objects.filter(status='served').count(),
-        'meal_periods': MealPeriod.objects.filter(is_active=True).count(),
+        'total_varieties': catalog['total_varieties'],
+        'total_orders': catalog['total_orders'],
+        'meal_periods': len(active_meal_periods()),
     }
     
     context = {
         'todays_menu': todays_menu,
         'menu_items': menu_items,
         'current_meal_period': current_meal_period,
-        'featured_categories': featured_categories,
-        'best_selling': best_selling,
-        'latest_items': latest_items,
-        'popular_items': popular_items,
+        'featured_categories': catalog['featured_categories'],
+        'best_selling': catalog['best_selling'],
+        'latest_items': catalog['latest_items'],
+        'popular_items': catalog['popular_items'],
         'stats': stats,
         'ordering_allowed': todays_menu.is_ordering_allowed() if todays_menu else False,
     }
@@ -249,7 +223,7 @@ def product_list(request):
     
     # Get current meal period
     current_meal_period = None
-    for period in MealPeriod.objects.filter(is_active=True):
+    for period in active_meal_periods():
         if period.ordering_start_time <= current_time <= period.ordering_end_time:
             current_meal_period = period
             break
@@ -321,7 +295,7 @@ def product_detail(request, slug):
     current_time = now.time()
     
     current_meal_period = None
-    for period in MealPeriod.objects.filter(is_active=True):
+    for period in active_meal_periods():
         if period.ordering_start_time <= current_time <= period.ordering_end_time:
             current_meal_period = period
             break
@@ -385,7 +359,7 @@ def category_detail(request, slug):
     current_time = now.time()
     
     current_meal_period = None
-    for period in MealPeriod.objects.filter(is_active=True):
+    for period in active_meal_periods():
         if period.ordering_start_time <= current_time <= period.ordering_end_time:
             current_meal_period = period
             break
@@ -433,6 +407,15 @@ def save_cart(request, cart):
     request.session.modified = True
 
 
+def order_quantities(cart):
+    """{menu_item_id: plates} for the items in a cart"""
+    return {item_data['menu_item_id']: item_data['quantity'] for item_data in cart.values()}
+
+
+def plate_count(count):
+    return f"{count} plate" if count == 1 else f"{count} plates"
+
+
 @require_http_methods(["POST"])
 def add_to_cart(request):
     """Add item to cart (AJAX)"""
@@ -441,21 +424,23 @@ def add_to_cart(request):
         menu_item_id = data.get('menu_item_id')
         quantity = int(data.get('quantity', 1))
         
-        # Validate quantity (only 1 plate per item allowed)
-        if quantity != 1:
+        # Validate quantity against the per-item plate limit
+        max_plates = get_setting('max_plates_per_item')
+        if not 1 <= quantity <= max_plates:
             return JsonResponse({
                 'success': False,
-                'message': 'You can only order 1 plate per food item.'
+                'message': f'You can only order {plate_count(max_plates)} per food item.'
             }, status=400)
         
         # Get menu item
         menu_item = get_object_or_404(DailyMenuItem, id=menu_item_id, is_available=True)
         
         # Check if available
-        if menu_item.plates_remaining < 1:
+        if menu_item.plates_remaining < quantity:
             return JsonResponse({
                 'success': False,
-                'message': 'This item is out of stock.'
+                'message': 'This item is out of stock.' if menu_item.plates_remaining < 1
+                else f'Only {plate_count(menu_item.plates_remaining)} left.'
             }, status=400)
         
         # Check if ordering is allowed
@@ -472,7 +457,7 @@ def add_to_cart(request):
         if str(menu_item_id) in cart:
             return JsonResponse({
                 'success': False,
-                'message': 'This item is already in your cart. You can only order 1 plate per item.'
+                'message': 'This item is already in your cart.'
             }, status=400)
         
         # Add to cart
@@ -482,8 +467,8 @@ def add_to_cart(request):
             'food_item_name': menu_item.food_item.name,
             'food_item_slug': menu_item.food_item.slug,
             'price': str(menu_item.food_item.price_per_plate),
-            'quantity': 1,
-            'subtotal': str(menu_item.food_item.price_per_plate),
+            'quantity': quantity,
+            'subtotal': str(menu_item.food_item.price_per_plate * quantity),
             'daily_menu_id': menu_item.daily_menu.id,
         }
         
@@ -509,7 +494,7 @@ def add_to_cart(request):
 
 @require_http_methods(["POST"])
 def update_cart(request):
-    """Update cart item quantity (AJAX) - Not really needed since quantity is always 1"""
+    """Update cart item quantity (AJAX)"""
     try:
         data = json.loads(request.body)
         menu_item_id = str(data.get('menu_item_id'))
@@ -522,10 +507,24 @@ def update_cart(request):
                 'message': 'Item not found in cart.'
             }, status=404)
         
-        # Since quantity is always 1, this just confirms the item
+        item_data = cart[menu_item_id]
+        quantity = int(data.get('quantity', item_data['quantity']))
+        max_plates = get_setting('max_plates_per_item')
+        if not 1 <= quantity <= max_plates:
+            return JsonResponse({
+                'success': False,
+                'message': f'You can only order {plate_count(max_plates)} per food item.'
+            }, status=400)
+        
+        item_data['quantity'] = quantity
+        item_data['subtotal'] = str(Decimal(item_data['price']) * quantity)
+        save_cart(request, cart)
+        
         return JsonResponse({
             'success': True,
             'message': 'Cart updated!',
+            'cart_count': len(cart),
+            'cart_total': str(sum(Decimal(item['subtotal']) for item in cart.values()))
         })
         
     except Exception as e:
@@ -576,21 +575,21 @@ def cart_view(request):
     cart = get_cart(request)
     cart_items = []
     cart_total = Decimal('0.00')
+    menu_items = DailyMenuItem.objects.select_related('food_item').in_bulk(
+        [item_data['menu_item_id'] for item_data in cart.values()]
+    )
     
     for item_id, item_data in cart.items():
-        try:
-            menu_item = DailyMenuItem.objects.select_related('food_item').get(
-                id=item_data['menu_item_id']
-            )
-            
-            cart_items.append({
-                'menu_item': menu_item,
-                'quantity': item_data['quantity'],
-                'subtotal': Decimal(item_data['subtotal'])
-            })
-            cart_total += Decimal(item_data['subtotal'])
-        except DailyMenuItem.DoesNotExist:
+        menu_item = menu_items.get(item_data['menu_item_id'])
+        if menu_item is None:
             continue
+        
+        cart_items.append({
+            'menu_item': menu_item,
+            'quantity': item_data['quantity'],
+            'subtotal': Decimal(item_data['subtotal'])
+        })
+        cart_total += Decimal(item_data['subtotal'])
     
     context = {
         'cart_items': cart_items,
@@ -619,43 +618,46 @@ def checkout(request):
         messages.warning(request, "Your cart is empty.")
         return redirect('product_list')
     
+    if not request.user.is_authenticated and not get_setting('enable_guest_orders'):
+        messages.info(request, "Please log in to place an order.")
+        return redirect_to_login(request.get_full_path(), 'login')
+    
     # Get cart items and validate
     cart_items = []
     cart_total = Decimal('0.00')
     daily_menu = None
+    menu_items = DailyMenuItem.objects.select_related(
+        'food_item', 'daily_menu', 'daily_menu__meal_period'
+    ).in_bulk([item_data['menu_item_id'] for item_data in cart.values()])
     
     for item_id, item_data in cart.items():
-        try:
-            menu_item = DailyMenuItem.objects.select_related(
-                'food_item', 'daily_menu', 'daily_menu__meal_period'
-            ).get(id=item_data['menu_item_id'])
-            
-            # Validate availability
-            if not menu_item.is_available or menu_item.plates_remaining < 1:
-                messages.error(request, f"{menu_item.food_item.name} is no longer available.")
-                return redirect('cart')
-            
-            # Validate ordering time
-            if not menu_item.daily_menu.is_ordering_allowed():
-                messages.error(request, "Ordering time has expired for these items.")
-                return redirect('cart')
-            
-            # Set daily menu (all items should be from same menu)
-            if daily_menu is None:
-                daily_menu = menu_item.daily_menu
-            elif daily_menu.id != menu_item.daily_menu.id:
-                messages.error(request, "Cart contains items from different meal periods.")
-                return redirect('cart')
-            
-            cart_items.append({
-                'menu_item': menu_item,
-                'quantity': item_data['quantity'],
-                'subtotal': Decimal(item_data['subtotal'])
-            })
-            cart_total += Decimal(item_data['subtotal'])
-            
-        except DailyMenuItem.DoesNotExist:
+        menu_item = menu_items.get(item_data['menu_item_id'])
+        if menu_item is None:
             continue
+        
+        # Validate availability
+        if not menu_item.is_available or menu_item.plates_remaining < item_data['quantity']:
+            messages.error(request, f"{menu_item.food_item.name} is no longer available.")
+            return redirect('cart')
+        
+        # Validate ordering time
+        if not menu_item.daily_menu.is_ordering_allowed():
+            messages.error(request, "Ordering time has expired for these items.")
+            return redirect('cart')
+        
+        # Set daily menu (all items should be from same menu)
+        if daily_menu is None:
+            daily_menu = menu_item.daily_menu
+        elif daily_menu.id != menu_item.daily_menu.id:
+            messages.error(request, "Cart contains items from different meal periods.")
+            return redirect('cart')
+        
+        cart_items.append({
+            'menu_item': menu_item,
+            'quantity': item_data['quantity'],
+            'subtotal': Decimal(item_data['subtotal'])
+        })
+        cart_total += Decimal(item_data['subtotal'])
     
     # Get student info if logged in
     student_profile = None
@@ -678,112 +680,156 @@ def checkout(request):
 @require_http_methods(["POST"])
 def place_order(request):
     """Place order and initiate M-Pesa payment"""
-    try:
-        cart = get_cart(request)
-        
-        if not cart:
-            return JsonResponse({
-                'success': False,
-                'message': 'Your cart is empty.'
-            }, status=400)
-        
-        # Get form data
-        phone_number = request.POST.get('phone_number', '').strip()
-        registration_number = request.POST.get('registration_number', '').strip().upper()
-        full_name = request.POST.get('full_name', '').strip()
-        
-        if not all([phone_number, registration_number, full_name]):
-            return JsonResponse({
-                'success': False,
-                'message': 'All fields are required.'
-            }, status=400)
-        
-        # Validate phone number format (254...)
-        if not phone_number.startswith('254') or len(phone_number) != 12:
-            return JsonResponse({
-                'success': False,
-                'message': 'Phone number must be in format 254XXXXXXXXX'
-            }, status=400)
-        
-        # Create order
-        daily_menu = None
-        order_total = Decimal('0.00')
-        
-        # Validate cart items and calculate total
-        for item_id, item_data in cart.items():
-            menu_item = DailyMenuItem.objects.select_related('daily_menu').get(
-                id=item_data['menu_item_id']
-            )
+    with trace('checkout') as checkout_trace:
+        try:
+            cart = get_cart(request)
             
-            if not menu_item.is_available or menu_item.plates_remaining < 1:
+            if not cart:
+                checkout_trace.annotate(outcome='empty_cart')
                 return JsonResponse({
                     'success': False,
-                    'message': f'{menu_item.food_item.name} is no longer available.'
+                    'message': 'Your cart is empty.'
                 }, status=400)
             
-            if daily_menu is None:
-                daily_menu = menu_item.daily_menu
+            if not request.user.is_authenticated and not get_setting('enable_guest_orders'):
+                checkout_trace.annotate(outcome='guests_disabled')
+                return JsonResponse({
+                    'success': False,
+                    'message': 'Please log in to place an order.'
+                }, status=403)
             
-            order_total += Decimal(item_data['subtotal'])
-        
-        # Create order
-        order = Order.objects.create(
-            user=request.user if request.user.is_authenticated else None,
-            student_profile=request.user.student_profile if request.user.is_authenticated and hasattr(request.user, 'student_profile') else None,
-            guest_registration_number=registration_number if not request.user.is_authenticated else '',
-            guest_name=full_name if not request.user.is_authenticated else '',
-            guest_phone=phone_number if not request.user.is_authenticated else '',
-            daily_menu=daily_menu,
-            total_amount=order_total,
-            mpesa_phone_number=phone_number,
-            status='pending'
-        )
-        
-        # Create order items and update stock
-        for item_id, item_data in cart.items():
-            menu_item = DailyMenuItem.objects.select_related('food_item').get(
-                id=item_data['menu_item_id']
-            )
+            # Get form data
+            phone_number = request.POST.get('phone_number', '').strip()
+            registration_number = request.POST.get('registration_number', '').strip().upper()
+            full_name = request.POST.get('full_name', '').strip()
             
-            OrderItem.objects.create(
-                order=order,
-                daily_menu_item=menu_item,
-                food_item=menu_item.food_item,
-                quantity=item_data['quantity'],
-                price_per_plate=menu_item.food_item.price_per_plate
-            )
+            if not all([phone_number, registration_number, full_name]):
+                checkout_trace.annotate(outcome='invalid_form')
+                return JsonResponse({
+                    'success': False,
+                    'message': 'All fields are required.'
+                }, status=400)
             
-            # Update stock
-            menu_item.plates_ordered += item_data['quantity']
-            menu_item.save()
-        
-        # Initiate M-Pesa STK Push
-        mpesa_response = initiate_stk_push(order, phone_number, order_total)
-        
-        if mpesa_response.get('success'):
-            # Clear cart
-            request.session['cart'] = {}
-            request.session.modified = True
+            # Validate phone number format (254...)
+            if not phone_number.startswith('254') or len(phone_number) != 12:
+                checkout_trace.annotate(outcome='invalid_form')
+                return JsonResponse({
+                    'success': False,
+                    'message': 'Phone number must be in format 254XXXXXXXXX'
+                }, status=400)
             
-            return JsonResponse({
-                'success': True,
-                'message': 'Order placed! Please complete payment on your phone.',
-                'order_code': order.order_code,
-                'checkout_request_id': mpesa_response.get('checkout_request_id')
-            })
-        else:
-            # Delete order if M-Pesa failed
-            order.delete()
+            # Create order
+            daily_menu = None
+            order_total = Decimal('0.00')
+            
+            # Validate cart items and calculate total
+            with span('validate_cart'):
+                max_plates = get_setting('max_plates_per_item')
+                menu_items = DailyMenuItem.objects.select_related('daily_menu__meal_period', 'food_item').in_bulk(
+                    [item_data['menu_item_id'] for item_data in cart.values()]
+                )
+                for item_id, item_data in cart.items():
+                    menu_item = menu_items.get(item_data['menu_item_id'])
+                    if menu_item is None:
+                        raise DailyMenuItem.DoesNotExist(f"Menu item {item_data['menu_item_id']} no longer exists.")
+                    
+                    # The cart may predate a lower plate limit
+                    if item_data['quantity'] > max_plates:
+                        checkout_trace.annotate(outcome='over_limit')
+                        return JsonResponse({
+                            'success': False,
+                            'message': f'You can only order {plate_count(max_plates)} of {menu_item.food_item.name}.'
+                        }, status=400)
+                    
+                    if not menu_item.is_available or menu_item.plates_remaining < item_data['quantity']:
+                        checkout_trace.annotate(outcome='unavailable')
+                        return JsonResponse({
+                            'success': False,
+                            'message': f'{menu_item.food_item.name} is no longer available.'
+                        }, status=400)
+                    
+                    if daily_menu is None:
+                        daily_menu = menu_item.daily_menu
+                    
+                    order_total += Decimal(item_data['subtotal'])
+            
+            # Order, items and plates commit together or not at all
+            try:
+                with db_transaction.atomic():
+                    with span('insert_order'):
+                        order = Order.objects.create(
+                            items_summary=Order.summarize_items(
+                                [item_data['food_item_name'] for item_data in cart.values()]
+                            ),
+                            item_count=len(cart),
+                            user=request.user if request.user.is_authenticated else None,
+                            student_profile=request.user.student_profile if request.user.is_authenticated and hasattr(request.user, 'student_profile') else None,
+                            guest_registration_number=registration_number if not request.user.is_authenticated else '',
+                            guest_name=full_name if not request.user.is_authenticated else '',
+                            guest_phone=phone_number if not request.user.is_authenticated else '',
+                            daily_menu=daily_menu,
+                            total_amount=order_total,
+                            mpesa_phone_number=phone_number,
+                            status='pending'
+                        )
+                    checkout_trace.bind(order.order_code)
+                    
+                    # Create order items
+                    with span('insert_items'):
+                        for item_id, item_data in cart.items():
+                            menu_item = menu_items[item_data['menu_item_id']]
+                            OrderItem.objects.create(
+                                order=order,
+                                daily_menu_item=menu_item,
+                                food_item=menu_item.food_item,
+                                quantity=item_data['quantity'],
+                                price_per_plate=menu_item.food_item.price_per_plate
+                            )
+                    
+                    # Take the plates; fails if another checkout got the last ones
+                    with span('reserve_stock'):
+                        reserve_plates(order_quantities(cart))
+            except OutOfStock as e:
+                checkout_trace.annotate(outcome='sold_out')
+                return JsonResponse({
+                    'success': False,
+                    'message': f'{menu_items[e.menu_item_id].food_item.name} just sold out.'
+                }, status=409)
+            
+            # Initiate M-Pesa STK Push
+            mpesa_response = initiate_stk_push(order, phone_number, order_total)
+            
+            if mpesa_response.get('success'):
+                # Clear cart
+                with span('clear_cart'):
+                    request.session['cart'] = {}
+                    request.session.modified = True
+                
+                checkout_trace.annotate(outcome='stk_sent')
+                return JsonResponse({
+                    'success': True,
+                    'message': 'Order placed! Please complete payment on your phone.',
+                    'order_code': order.order_code,
+                    'checkout_request_id': mpesa_response.get('checkout_request_id')
+                })
+            else:
+                # Delete order and give its plates back if M-Pesa failed
+                with span('delete_order'), db_transaction.atomic():
+                    release_plates(order_quantities(cart))
+                    order.delete()
+                checkout_trace.annotate(outcome='stk_failed')
+                return JsonResponse({
+                    'success': False,
+                    'message': mpesa_response.get('message', 'Payment initiation failed.')
+                }, status=400)
+            
+        except Exception as e:
+            logger.exception("Checkout %s failed", checkout_trace.correlation_id)
+            checkout_trace.annotate(outcome='error', error_message=str(e))
             return JsonResponse({
                 'success': False,
-                'message': mpesa_response.get('message', 'Payment initiation failed.')
-            }, status=400)
-        
-    except Exception as e:
-        return JsonResponse({
-            'success': False,
-            'message': str(e)
-        }, status=500)
+                'message': str(e)
+            }, status=500)
 
 
 # ==================== M-PESA INTEGRATION ====================
@@ -803,13 +849,19 @@ def get_mpesa_access_token():
         json_response = response.json()
         return json_response.get('access_token')
     except Exception as e:
-        print(f"Error getting access token: {e}")
+        logger.warning("Error getting access token: %s", e)
         return None
 
 
 def initiate_stk_push(order, phone_number, amount):
     """Initiate M-Pesa STK Push"""
-    access_token = get_mpesa_access_token()
+    with trace('stk_push', order_code=order.order_code):
+        return _initiate_stk_push(order, phone_number, amount)
+
+
+def _initiate_stk_push(order, phone_number, amount):
+    with span('mpesa_oauth'):
+        access_token = get_mpesa_access_token()
     
     if not access_token:
         return {
@@ -846,20 +898,22 @@ def initiate_stk_push(order, phone_number, amount):
     }
     
     try:
-        response = requests.post(api_url, json=payload, headers=headers, timeout=30)
-        response.raise_for_status()
-        json_response = response.json()
+        with span('stk_push'):
+            response = requests.post(api_url, json=payload, headers=headers, timeout=30)
+            response.raise_for_status()
+            json_response = response.json()
         
         if json_response.get('ResponseCode') == '0':
             # Create M-Pesa transaction record
-            MPesaTransaction.objects.create(
-                order=order,
-                merchant_request_id=json_response.get('MerchantRequestID'),
-                checkout_request_id=json_response.get('CheckoutRequestID'),
-                phone_number=phone_number,
-                amount=amount,
-                status='pending'
-            )
+            with span('record_transaction'):
+                MPesaTransaction.objects.create(
+                    order=order,
+                    merchant_request_id=json_response.get('MerchantRequestID'),
+                    checkout_request_id=json_response.get('CheckoutRequestID'),
+                    phone_number=phone_number,
+                    amount=amount,
+                    status='pending'
+                )
             
             return {
                 'success': True,
@@ -873,7 +927,7 @@ def initiate_stk_push(order, phone_number, amount):
             }
     
     except Exception as e:
-        print(f"STK Push Error: {e}")
+        logger.warning("STK Push error for %s: %s", order.order_code, e)
         return {
             'success': False,
             'message': 'Failed to initiate payment. Please try again.'
@@ -884,89 +938,126 @@ def initiate_stk_push(order, phone_number, amount):
 @require_http_methods(["POST"])
 def mpesa_callback(request):
     """M-Pesa callback URL"""
-    try:
-        data = json.loads(request.body)
-        
-        stk_callback = data.get('Body', {}).get('stkCallback', {})
-        merchant_request_id = stk_callback.get('MerchantRequestID')
-        checkout_request_id = stk_callback.get('CheckoutRequestID')
-        result_code = stk_callback.get('ResultCode')
-        result_desc = stk_callback.get('ResultDesc')
-        
-        # Get transaction
+    with trace('payment_callback') as callback_trace:
         try:
-            transaction = MPesaTransaction.objects.get(
-                checkout_request_id=checkout_request_id
-            )
-            order = transaction.order
-            
-            if result_code == 0:
-                # Payment successful
-                callback_metadata = stk_callback.get('CallbackMetadata', {}).get('Item', [])
-                
-                mpesa_receipt = None
-                transaction_date = None
-                phone_number = None
-                
-                for item in callback_metadata:
-                    if item.get('Name') == 'MpesaReceiptNumber':
-                        mpesa_receipt = item.get('Value')
-                    elif item.get('Name') == 'TransactionDate':
-                        transaction_date = item.get('Value')
-                    elif item.get('Name') == 'PhoneNumber':
-                        phone_number = item.get('Value')
-                
-                # Update transaction
-                transaction.status = 'completed'
-                transaction.mpesa_receipt_number = mpesa_receipt
-                transaction.result_code = str(result_code)
-                transaction.result_desc = result_desc
-                if transaction_date:
-                    transaction.transaction_date = datetime.strptime(str(transaction_date), '%Y%m%d%H%M%S')
-                transaction.save()
-                
-                # Update order
-                order.status = 'confirmed'
-                order.mpesa_receipt_number = mpesa_receipt
-                order.mpesa_transaction_id = merchant_request_id
-                order.payment_date = timezone.now()
-                order.confirmed_at = timezone.now()
-                order.save()
+            with span('parse_callback'):
+                data = json.loads(request.body)
                 
-                # Send receipt email/SMS
-                send_order_receipt(order)
-                
-            else:
-                # Payment failed
-                transaction.status = 'failed'
-                transaction.result_code = str(result_code)
-                transaction.result_desc = result_desc
-                transaction.save()
-                
-                order.status = 'cancelled'
-                order.save()
-                
-                # Restore stock
-                for order_item in order.items.all():
-                    menu_item = order_item.daily_menu_item
-                    menu_item.plates_ordered -= order_item.quantity
-                    menu_item.save()
-        
-        except MPesaTransaction.DoesNotExist:
-            print(f"Transaction not found: {checkout_request_id}")
+                stk_callback = data.get('Body', {}).get('stkCallback', {})
+                merchant_request_id = stk_callback.get('MerchantRequestID')
+                checkout_request_id = stk_callback.get('CheckoutRequestID')
+                result_code = stk_callback.get('ResultCode')
+                result_desc = stk_callback.get('ResultDesc')
+            callback_trace.annotate(checkout_request_id=checkout_request_id, result_code=result_code)
+            
+            # Get transaction
+            try:
+                with db_transaction.atomic():
+                    # The row lock makes a repeated delivery of this callback
+                    # wait for the first one, then find it already handled
+                    with span('load_transaction'):
+                        transaction = MPesaTransaction.objects.select_for_update().select_related('order').get(
+                            checkout_request_id=checkout_request_id
+                        )
+                    order = transaction.order
+                    callback_trace.bind(order.order_code)
+                    
+                    if transaction.status != 'pending':
+                        callback_trace.annotate(outcome='duplicate')
+                    
+                    elif result_code == 0:
+                        # Payment successful
+                        callback_metadata = stk_callback.get('CallbackMetadata', {}).get('Item', [])
+                        
+                        mpesa_receipt = None
+                        transaction_date = None
+                        phone_number = None
+                        
+                        for item in callback_metadata:
+                            if item.get('Name') == 'MpesaReceiptNumber':
+                                mpesa_receipt = item.get('Value')
+                            elif item.get('Name') == 'TransactionDate':
+                                transaction_date = item.get('Value')
+                            elif item.get('Name') == 'PhoneNumber':
+                                phone_number = item.get('Value')
+                        
+                        with span('confirm_order'):
+                            # Update transaction
+                            transaction.status = 'completed'
+                            transaction.mpesa_receipt_number = mpesa_receipt
+                            transaction.result_code = str(result_code)
+                            transaction.result_desc = result_desc
+                            if transaction_date:
+                                transaction.transaction_date = datetime.strptime(str(transaction_date), '%Y%m%d%H%M%S')
+                            transaction.save()
+                            
+                            # Plates of an order that expired while the student
+                            # paid were already handed back; take them again
+                            if order.status not in Order.LIVE_STATUSES:
+                                quantities = dict(order.items.values_list('daily_menu_item_id', 'quantity'))
+                                try:
+                                    with db_transaction.atomic():
+                                        reserve_plates(quantities)
+                                except OutOfStock:
+                                    logger.warning(
+                                        "Order %s was paid (%s) after its plates sold out; refund it",
+                                        order.order_code, mpesa_receipt
+                                    )
+                                    callback_trace.annotate(outcome='paid_after_sell_out')
+                                    return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Success'})
+                            
+                            # Update order
+                            order.status = 'confirmed'
+                            order.mpesa_receipt_number = mpesa_receipt
+                            order.mpesa_transaction_id = merchant_request_id
+                            order.payment_date = timezone.now()
+                            order.confirmed_at = timezone.now()
+                            
+                            # Queue receipt email/SMS with the confirmation
+                            send_order_receipt(order)
+                            
+                            # Last: the status change appends to the order change
+                            # feed, which holds its append lock until commit
+                            order.save()
+                        callback_trace.annotate(outcome='confirmed')
+                    
+                    else:
+                        # Payment failed
+                        # Restore stock, unless the expiry sweep already did
+                        if order.status in Order.LIVE_STATUSES:
+                            with span('restore_stock'):
+                                release_plates(dict(order.items.values_list('daily_menu_item_id', 'quantity')))
+                        
+                        with span('cancel_order'):
+                            transaction.status = 'failed'
+                            transaction.result_code = str(result_code)
+                            transaction.result_desc = result_desc
+                            transaction.save()
+                            
+                            # Last, like the confirmation above
+                            order.status = 'cancelled'
+                            order.save()
+                        callback_trace.annotate(outcome='cancelled')
+            
+            except MPesaTransaction.DoesNotExist:
+                logger.warning("Transaction not found: %s", checkout_request_id)
+                callback_trace.annotate(outcome='unknown_transaction')
+            
+            return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Success'})
         
-        return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Success'})
-    
-    except Exception as e:
-        print(f"Callback error: {e}")
-        return JsonResponse({'ResultCode': 1, 'ResultDesc': str(e)})
+        except Exception as e:
+            logger.exception("Callback error for %s", callback_trace.correlation_id)
+            callback_trace.annotate(outcome='error', error_message=str(e))
+            return JsonResponse({'ResultCode': 1, 'ResultDesc': str(e)})
 
 
 @require_http_methods(["GET"])
 def check_payment_status(request, order_code):
     """Check payment status (AJAX)"""
     try:
-        order = get_object_or_404(Order, order_code=order_code)
+        order = find_order(order_code)
+        if order is None:
+            raise Http404("No order matches the given query.")
         
         return JsonResponse({
             'success': True,
@@ -1015,55 +1106,69 @@ def mpesa_query_status(checkout_request_id):
         response.raise_for_status()
         return response.json()
     except Exception as e:
-        print(f"Query status error: {e}")
+        logger.warning("Query status error: %s", e)
         return None
 
 
 def send_order_receipt(order):
-    """Send order receipt via email and/or SMS"""
-    try:
-        # Prepare receipt data
-        context = {
-            'order': order,
-            'order_items': order.items.select_related('food_item'),
-            'student_name': order.user.get_full_name() if order.user else order.guest_name,
-            'registration_number': order.get_student_identifier(),
-        }
-        
-        # Send email
-        if order.user and order.user.email:
-            email_html = render_to_string('mess/email/order_receipt.html', context)
-            email_text = render_to_string('mess/email/order_receipt.txt', context)
-            
-            send_mail(
-                subject=f'Order Receipt - {order.order_code}',
-                message=email_text,
-                html_message=email_html,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[order.user.email],
-                fail_silently=True,
-            )
-            
-            # Create receipt record
-            OrderReceipt.objects.create(
-                order=order,
-                receipt_type='email',
-                recipient_email=order.user.email,
-                is_sent=True
-            )
-        
-        # TODO: Implement SMS sending via Africa's Talking or similar
-        # send_sms(order.mpesa_phone_number, sms_message)
-        
-    except Exception as e:
-        print(f"Error sending receipt: {e}")
+    """Queue the order receipt email and SMS"""
+    with trace('receipt', order_code=order.order_code):
+        try:
+            # A savepoint: a failed insert here must not abort the payment
+            # callback's transaction, which still has to save the order
+            with db_transaction.atomic():
+                # Prepare receipt data
+                context = {
+                    'order': order,
+                    'order_items': order.items.select_related('food_item'),
+                    'student_name': order.user.get_full_name() if order.user else order.guest_name,
+                    'registration_number': order.get_student_identifier(),
+                }
+                email = order.user.email if order.user else ''
+                phone = order.mpesa_phone_number
+                
+                if not (email or phone):
+                    return
+                
+                # Queue email; the outbox worker marks the receipt sent on delivery
+                if email:
+                    with span('render_receipt'):
+                        email_html = render_to_string('mess/email/order_receipt.html', context)
+                        email_text = render_to_string('mess/email/order_receipt.txt', context)
+                    
+                    with span('queue_email'):
+                        enqueue_email(
+                            'receipt',
+                            subject=f'Order Receipt - {order.order_code}',
+                            body=email_text,
+                            html_body=email_html,
+                            recipients=[email],
+                            order=order,
+                        )
+                
+                # Create receipt record; a pending SMS is picked up by the SMS dispatcher
+                with span('create_receipt'):
+                    OrderReceipt.objects.create(
+                        order=order,
+                        receipt_type='both' if email and phone else ('email' if email else 'sms'),
+                        recipient_email=email or None,
+                        recipient_phone=phone or None,
+                        is_sent=False,
+                        sms_status='pending' if phone else '',
+                        sms_next_attempt_at=timezone.now() if phone else None,
+                    )
+                
+        except Exception as e:
+            logger.exception("Error queueing receipt for %s: %s", order.order_code, e)
 
 
 # ==================== ORDER MANAGEMENT VIEWS ====================
 
 def order_success(request, order_code):
     """Order success page"""
-    order = get_object_or_404(Order, order_code=order_code)
+    order = find_order(order_code)
+    if order is None:
+        raise Http404("No order matches the given query.")
     
     # Verify user owns this order
     if order.user:
@@ -1081,7 +1186,9 @@ def order_success(request, order_code):
 
 def order_detail(request, order_code):
     """View order details"""
-    order = get_object_or_404(Order, order_code=order_code)
+    order = find_order(order_code)
+    if order is None:
+        raise Http404("No order matches the given query.")
     
     # Verify user owns this order or is staff
     if order.user:
@@ -1091,7 +1198,10 @@ def order_detail(request, order_code):
     
     context = {
         'order': order,
-        'order_items': order.items.select_related('food_item', 'daily_menu_item'),
+        # Archived items keep the food item but not the menu entry
+        'order_items': order.items.select_related(
+            'food_item', *(['daily_menu_item'] if isinstance(order, Order) else [])
+        ),
         'can_be_served': order.can_be_served(),
         'is_expired': order.is_expired(),
     }
@@ -1101,19 +1211,18 @@ def order_detail(request, order_code):
 
 @login_required
 def my_orders(request):
-    """View user's orders"""
-    try:
-        student_profile = request.user.student_profile
-        orders = Order.objects.filter(
-            Q(user=request.user) | Q(student_profile=student_profile)
-        ).select_related('daily_menu', 'daily_menu__meal_period').order_by('-ordered_at')
-    except StudentProfile.DoesNotExist:
-        orders = Order.objects.filter(user=request.user).select_related(
-            'daily_menu', 'daily_menu__meal_period'
-        ).order_by('-ordered_at')
+    """View user's orders, one keyset page at a time"""
+    # Hot and archived orders, matched by user or by student profile
+    orders, next_cursor = keyset_page(
+        user_order_querysets(request.user),
+        cursor=request.GET.get('cursor'),
+        page_size=MY_ORDERS_PAGE_SIZE,
+    )
     
     context = {
         'orders': orders,
+        'next_cursor': next_cursor,
+        'has_next': next_cursor is not None,
     }
     
     return render(request, 'mess/my_orders.html', context)
@@ -1162,8 +1271,11 @@ def verify_order(request):
                 context = {'order': order}
                 return render(request, 'mess/verify_order.html', context)
             
-            # Mark as served
-            order.mark_as_served(request.user)
+            # Mark as served; a concurrent scan of the same code loses here
+            if not order.mark_as_served(request.user):
+                messages.warning(request, f"Order {order_code} has already been served.")
+                context = {'order': order, 'already_served': True}
+                return render(request, 'mess/verify_order.html', context)
             messages.success(request, f"Order {order_code} marked as served successfully!")
             
             context = {
@@ -1239,7 +1351,7 @@ def search(request):
     current_time = now.time()
     
     current_meal_period = None
-    for period in MealPeriod.objects.filter(is_active=True):
+    for period in active_meal_periods():
         if period.ordering_start_time <= current_time <= period.ordering_end_time:
             current_meal_period = period
             break
@@ -1276,6 +1388,111 @@ def search(request):
     return render(request, 'mess/search_results.html', context)
 
 
+# ==================== EXPORT VIEWS ====================
+
+@staff_member_required
+@require_http_methods(["GET"])
+def export_data(request, kind):
+    """Stream orders, order items or payments as (gzipped) CSV/JSONL for finance"""
+    if kind not in EXPORTS:
+        return JsonResponse({
+            'success': False,
+            'message': f'Unknown export. Choose one of: {", ".join(EXPORTS)}.'
+        }, status=404)
+    
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        return JsonResponse({
+            'success': False,
+            'message': 'Format must be csv or jsonl.'
+        }, status=400)
+    
+    try:
+        start = date.fromisoformat(request.GET['start']) if request.GET.get('start') else None
+        end = date.fromisoformat(request.GET['end']) if request.GET.get('end') else None
+    except ValueError:
+        return JsonResponse({
+            'success': False,
+            'message': 'Dates must be in format YYYY-MM-DD.'
+        }, status=400)
+    
+    filters = {
+        'start': start,
+        'end': end,
+        'meal_period': request.GET.get('meal_period') or None,
+        'status': request.GET.get('status') or None,
+    }
+    compress = request.GET.get('gzip', '1') != '0'
+    
+    if compress:
+        content_type = 'application/gzip'
+    else:
+        content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    
+    response = StreamingHttpResponse(
+        stream_export(kind, fmt, compress=compress, **filters),
+        content_type=content_type,
+    )
+    filename = export_filename(kind, fmt, compress=compress, **filters)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+# ==================== REPORT VIEWS ====================
+
+@staff_member_required
+@require_http_methods(["GET"])
+def sales_report_view(request):
+    """Sales for a week, month, semester or date range, read from the daily rollups"""
+    period = request.GET.get('period', 'week')
+    group_by = request.GET.get('group_by', 'food_item')
+    if period not in REPORT_PERIODS + ['custom'] or group_by not in REPORT_GROUPINGS:
+        return JsonResponse({
+            'success': False,
+            'message': f'period must be one of {", ".join(REPORT_PERIODS)} or custom; '
+                       f'group_by one of {", ".join(REPORT_GROUPINGS)}.'
+        }, status=400)
+    
+    try:
+        if period == 'custom':
+            start = date.fromisoformat(request.GET['start'])
+            end = date.fromisoformat(request.GET['end'])
+        else:
+            on = date.fromisoformat(request.GET['date']) if request.GET.get('date') else timezone.now().date()
+            start, end = period_range(period, on)
+    except (KeyError, ValueError):
+        return JsonResponse({
+            'success': False,
+            'message': 'Dates must be in format YYYY-MM-DD (custom periods need start and end).'
+        }, status=400)
+    
+    meal_period = request.GET.get('meal_period') or None
+    rows, totals = sales_report(start, end, group_by=group_by, meal_period=meal_period)
+    
+    if request.GET.get('format') == 'csv':
+        response = HttpResponse(report_csv(rows, totals, group_by), content_type='text/csv')
+        response['Content-Disposition'] = f'attachment; filename="sales_{group_by}_{start}_{end}.csv"'
+        return response
+    
+    return JsonResponse({
+        'success': True,
+        'start': start,
+        'end': end,
+        'group_by': group_by,
+        'rows': rows,
+        'totals': totals,
+    })
+
+
+# ==================== METRICS ====================
+
+@staff_member_required
+@require_http_methods(["GET"])
+def metrics(request):
+    """Per-view latency, query and render histograms in Prometheus text format"""
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 # ==================== API ENDPOINTS ====================
 
 @require_http_methods(["GET"])
@@ -1287,6 +1504,41 @@ def get_cart_count(request):
     })
 
 
+@staff_member_required
+@require_http_methods(["GET"])
+def order_events(request):
+    """Order status changes after a cursor, optionally waiting for the next one (long poll)"""
+    try:
+        after = int(request.GET.get('after', 0))
+        limit = int(request.GET.get('limit', settings.ORDER_EVENTS_PAGE_SIZE))
+        wait = float(request.GET.get('wait', 0))
+    except ValueError:
+        return JsonResponse({
+            'success': False,
+            'message': 'after and limit must be integers, wait a number of seconds.'
+        }, status=400)
+    
+    limit = max(1, min(limit, settings.ORDER_EVENTS_MAX_PAGE_SIZE))
+    wait = max(0.0, min(wait, settings.ORDER_EVENTS_MAX_WAIT))
+    events = wait_for_order_events(after, limit, wait)
+    
+    return JsonResponse({
+        'success': True,
+        'events': [
+            {
+                'id': event.id,
+                'order_code': event.order_code,
+                'from_status': event.from_status,
+                'to_status': event.to_status,
+                'created_at': event.created_at.isoformat(),
+            }
+            for event in events
+        ],
+        # Pass back as `after` to continue where this page stopped
+        'next_after': events[-1].id if events else after,
+    })
+
+
 @require_http_methods(["GET"])
 def check_item_availability(request, menu_item_id):
     """Check if item is still available (AJAX)"""
@@ -1312,7 +1564,7 @@ def get_meal_period_status(request):
     current_time = now.time()
     
     current_period = None
-    for period in MealPeriod.objects.filter(is_active=True):
+    for period in active_meal_periods():
         if period.start_time <= current_time <= period.end_time:
             current_period = period
             break
@@ -1348,19 +1600,16 @@ def contact(request):
         message = request.POST.get('message', '').strip()
         
         if all([name, email, subject, message]):
-            try:
-                # Send contact email to admin
-                send_mail(
-                    subject=f'Contact Form: {subject}',
-                    message=f'From: {name} ({email})\n\n{message}',
-                    from_email=settings.DEFAULT_FROM_EMAIL,
-                    recipient_list=[settings.CONTACT_EMAIL],
-                    fail_silently=False,
-                )
-                messages.success(request, "Your message has been sent successfully!")
-                return redirect('contact')
-            except Exception as e:
-                messages.error(request, "Failed to send message. Please try again.")
+            # Queue contact email to admin; replies go straight to the sender
+            enqueue_email(
+                'contact',
+                subject=f'Contact Form: {subject}',
+                body=f'From: {name} ({email})\n\n{message}',
+                recipients=[settings.CONTACT_EMAIL],
+                reply_to=email,
+            )
+            messages.success(request, "Your message has been sent successfully!")
+            return redirect('contact')
         else:
             messages.error(request, "All fields are required.")
     
@@ -0,0 +1,51 @@
+"""
+In-process periodic background workers.
+
+Housekeeping jobs (expiry sweeps, draining the email outbox, ...) can run
+from cron through their management commands, or inside each web process on
+a daemon thread started from EcommerceConfig.ready(). The jobs lock the rows
+they work on with skip_locked, so several processes running the same worker
+do not step on each other.
+"""
+import logging
+import threading
+
+from django.db import close_old_connections
+
+
+logger = logging.getLogger(__name__)
+
+_workers = {}
+
+
+class PeriodicWorker(threading.Thread):
+    """Daemon thread that calls `job` every `interval` seconds"""
+
+    def __init__(self, name, job, interval):
+        super().__init__(name=name, daemon=True)
+        self.job = job
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                close_old_connections()
+                self.job()
+            except Exception:
+                logger.exception("%s failed", self.name)
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self.stopped.set()
+
+
+def start_worker(name, job, interval):
+    """Start the named worker once per process"""
+    worker = _workers.get(name)
+    if worker is None or not worker.is_alive():
+        worker = PeriodicWorker(name, job, interval)
+        worker.start()
+        _workers[name] = worker
+    return worker
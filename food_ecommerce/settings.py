@@ -25,16 +25,20 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
+    'whitenoise.runserver_nostatic',
     'django.contrib.staticfiles',
     'ecommerce',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'ecommerce.metrics.RequestMetricsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'ecommerce.routers.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -43,7 +47,10 @@ ROOT_URLCONF = 'food_ecommerce.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing renders for the request metrics; the NAME
+        # keeps the engine's usual alias instead of one taken from the path
+        'BACKEND': 'ecommerce.metrics.TimedDjangoTemplates',
+        'NAME': 'django',
         'DIRS': ['templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -75,6 +82,17 @@ DATABASES = {
     }
 }
 
+# Read replica (a streaming standby of food_db). Uncomment to serve browse
+# pages and reports from it. To try the routing locally, point it at the
+# same database; tests treat it as a mirror of default.
+# DATABASES['replica'] = {
+#     **DATABASES['default'],
+#     'HOST': 'replica.db.internal',
+#     'TEST': {'MIRROR': 'default'},
+# }
+
+DATABASE_ROUTERS = ['ecommerce.routers.PrimaryReplicaRouter']
+
 
 
 # Password validation
@@ -108,6 +126,10 @@ USE_TZ = True
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Resized WebP/JPEG copies of food images, under MEDIA_ROOT/<dir>/<sha1[:2]>/<sha1>/
+FOOD_IMAGE_CACHE_DIR = 'cache/food_items'
+FOOD_IMAGE_WIDTHS = [160, 320, 480, 640]
+
 # ==================== STATIC FILES ====================
 
 STATIC_URL = '/static/'
@@ -116,6 +138,21 @@ STATICFILES_DIRS = [
     BASE_DIR / 'static',
 ]
 
+# In production collectstatic writes content-hashed files with .gz/.br
+# siblings, served by WhiteNoise with far-future immutable cache headers.
+# Development and tests keep plain names so no collectstatic run is needed.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+            else 'ecommerce.storage.StaticFilesStorage'
+        ),
+    },
+}
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -166,6 +203,129 @@ EMAIL_HOST_USER = 'your-email@gmail.com'
 EMAIL_HOST_PASSWORD = 'your-app-password'  # Use app password for Gmail
 DEFAULT_FROM_EMAIL = 'Muranga University Mess <your-email@gmail.com>'
 CONTACT_EMAIL = 'admin@murangauniversity.ac.ke'
+# Base of links in emails sent outside a request (set-password links for imported students)
+SITE_URL = 'https://your-domain.com'
+
+# ==================== REQUEST METRICS ====================
+
+# Requests running more queries than this are logged with their most
+# repeated SQL (None disables the check). Histograms are served at /metrics.
+METRICS_QUERY_BUDGET = 30
+
+# ==================== CHECKOUT TRACING ====================
+
+# Spans kept in memory per process for the checkout phase timings page
+# (M-Pesa transactions admin). Each finished checkout, callback and receipt
+# is also logged as one JSON line on the ecommerce.tracing logger: at INFO,
+# or WARNING if it failed. Set INFO to log every run.
+TRACE_BUFFER_SIZE = 5000
+TRACE_LOG_LEVEL = 'WARNING'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json_line': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'trace_console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json_line',
+        },
+    },
+    'loggers': {
+        'ecommerce.tracing': {
+            'handlers': ['trace_console'],
+            'level': TRACE_LOG_LEVEL,
+            'propagate': False,
+        },
+    },
+}
+
+# ==================== READ REPLICA ====================
+
+# Alias in DATABASES that read-only pages use; ignored until it is defined
+REPLICA_DATABASE = 'replica'
+
+# URL names whose reads may come from the replica. The order and payment
+# path (cart, checkout, callbacks, order pages, staff serving) never does.
+REPLICA_READ_VIEWS = [
+    'index', 'product_list', 'product_detail', 'category_list', 'category_detail', 'search',
+    'sales_report', 'export_data',
+    'about', 'contact', 'terms', 'privacy',
+]
+
+# Fall back to the primary while the replica is further behind than this
+REPLICA_MAX_LAG_SECONDS = 5
+# Seconds between lag checks, per process
+REPLICA_LAG_CHECK_INTERVAL = 10
+# After a write, the client reads from the primary for this long; keep it
+# above REPLICA_MAX_LAG_SECONDS so it sees its own order
+REPLICA_STICKY_SECONDS = 15
+
+# ==================== CACHE INVALIDATION ====================
+
+# In-process caches (meal periods, ...) are cleared in every worker when the
+# rows behind them change. On Postgres (psycopg2) workers LISTEN for changes;
+# elsewhere each worker re-reads the small version table this often, which
+# bounds how long it can serve a changed row.
+CACHE_INVALIDATION_POLL_INTERVAL = 2
+
+# Page data in the Django cache is computed by one request per key while the
+# others wait (cold) or get the previous value (stale). A computation that
+# runs longer than this stops holding the others back. For one computation
+# across workers rather than per worker, point CACHES at a shared backend:
+# CACHES = {
+#     'default': {
+#         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+#         'LOCATION': 'redis://127.0.0.1:6379',
+#     }
+# }
+SINGLEFLIGHT_LOCK_TIMEOUT = 10
+
+# ==================== ORDER EXPIRY ====================
+
+# Seconds between in-process expiry sweeps (None disables the thread; use the
+# sweep_expired_orders command from cron instead). Concurrent sweepers skip
+# each other's locked rows, so enabling it on several workers is safe.
+ORDER_EXPIRY_SWEEP_INTERVAL = None
+
+# Seconds between in-process checks for meals to close (None disables the
+# thread; use the close_meals command instead)
+MEAL_CLOSE_INTERVAL = None
+
+# ==================== ORDER CHANGE FEED ====================
+
+# /api/order-events/?after=N&limit=&wait= pages through order status changes.
+# A reader that waits is woken by commits in its own process and re-reads
+# every ORDER_EVENTS_POLL_INTERVAL seconds for those of other processes.
+ORDER_EVENTS_PAGE_SIZE = 100
+ORDER_EVENTS_MAX_PAGE_SIZE = 1000
+ORDER_EVENTS_MAX_WAIT = 25  # seconds; keep below the proxy's read timeout
+ORDER_EVENTS_POLL_INTERVAL = 1
+
+# ==================== EMAIL OUTBOX ====================
+
+# Seconds between in-process outbox drains (None disables the thread; use the
+# drain_outbox command instead). Drainers lock rows with SKIP LOCKED, so
+# several can run at once without sending an email twice.
+OUTBOX_DRAIN_INTERVAL = None
+
+# ==================== SMS RECEIPTS ====================
+
+# ecommerce.sms.ConsoleBackend, ecommerce.sms.FileBackend or
+# ecommerce.sms.HttpBackend (JSON bulk-send gateway at SMS_GATEWAY_URL)
+SMS_BACKEND = 'ecommerce.sms.ConsoleBackend'
+SMS_GATEWAY_URL = ''
+SMS_API_KEY = ''
+SMS_SENDER_ID = 'MURANGAMESS'
+SMS_FILE_PATH = BASE_DIR / 'sms.log'
+SMS_BATCH_SIZE = 100  # recipients per gateway request
+SMS_RATE_LIMIT = 5  # gateway requests per second
+
+# Seconds between in-process SMS dispatches (None disables the thread; use
+# the send_sms_receipts command instead)
+SMS_DISPATCH_INTERVAL = None
 
 # ==================== SESSION CONFIGURATION ====================
 